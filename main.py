@@ -1,18 +1,20 @@
 import pandas as pd
-import numpy as np
 import streamlit as st
-from datetime import datetime, time
+from datetime import datetime
 import io
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+from time import perf_counter
+from utils.visor import VisorResultados
+from utils.cubo import DIMENSIONES, MEDIDAS, detalle
+from utils.ingesta import IngestaExcel
+from utils.lote import (etiquetas_libros, hojas_del_libro, reportes_por_libro,
+                        resumen_lote)
 
-# Configuración de la página
-st.set_page_config(page_title="Sistema de Gestión ATM",
-                   page_icon="🏧",
-                   layout="wide")
+# El pipeline, el procesamiento, los bloques, la exportación y el almacén
+# (pyarrow) se importan recién donde se usan: el primer render, sin archivos
+# cargados, no los necesita (ver python -m utils.arranque)
 
 # CSS simplificado para compatibilidad con Streamlit Cloud
-st.markdown("""
+ESTILOS = """
 <style>
   .stApp {
     background-color: #0d1117;
@@ -32,248 +34,76 @@ st.markdown("""
     border-radius: 5px;
   }
 </style>
-""",
-            unsafe_allow_html=True)
-
-# Inicializar estados de sesión para mejor UX
-if 'processing' not in st.session_state:
-    st.session_state.processing = False
-if 'last_processed' not in st.session_state:
-    st.session_state.last_processed = None
-if 'resultados' not in st.session_state:
-    st.session_state.resultados = {}
-
-
-# Utilidades (mantengo toda la lógica original intacta)
-def normalizar_id(series):
-    return series.astype(str)\
-                 .str.extract(r"(\d+)\s*$", expand=False)\
-                 .str.lstrip('0')
-
-
-def combinar_fecha_hora(f_val, h_val):
-    try:
-        fecha = pd.to_datetime(f_val, errors='coerce').date()
-        if pd.isna(fecha):
-            return None
-        if pd.isna(h_val):
-            return datetime.combine(fecha, time.min)
-        hora = h_val if isinstance(h_val, time) else pd.to_datetime(
-            h_val, errors='coerce').time()
-        return datetime.combine(fecha, hora)
-    except:
-        return None
-
-
-def limpiar_th_downtime(df_raw):
-    header_idx = -1
-    for i, row in df_raw.head(5).iterrows():
-        texto = ' '.join(row.astype(str)).upper()
-        if 'TICKET KEY' in texto and 'START TIME' in texto:
-            header_idx = i
-            break
-    if header_idx < 0:
-        return pd.DataFrame()
-    df = df_raw.iloc[header_idx:].reset_index(drop=True)
-    df.columns = df.iloc[0].astype(str).str.strip()
-    df = df.drop(0).reset_index(drop=True)
-    df.columns = df.columns.str.strip()
-    return df.dropna(how='all').reset_index(drop=True)
-
-
-# Funciones de categorización (sin cambios)
-def categoria_por_sbif(codigo):
-    try:
-        c = str(int(float(codigo))).strip()
-    except:
-        c = str(codigo).strip()
-    return {
-        '2': 'Exigidos por SBIF',
-        '6': 'Exigidos por SBIF',
-        '7': 'Exigidos por SBIF',
-        '5': 'Remodelación',
-        '3': 'Vandalismo'
-    }.get(c, 'Comunicaciones')
-
-
-def categoria_por_resumen_falla(falla):
-    m = str(falla).lower()
-    mapa = {
-        'dispensador con falla': 'Dispenser No Paga FLMG',
-        'impresora de recibos': 'Impresora Recibos FLMG',
-        'bna con falla': 'BNA/SDM/Deposito FLMG',
-        '4 gavetas': '4 Gavetas Indisponibles',
-        'host down': 'Aplicacion Fuera de Servicio',
-        'comunicación con falla': 'Comunicaciones',
-        'lector de tarjeta con falla': 'Lector de Tarjeta FLMG',
-        'impresora sin papel': 'Sin Papel Recibos',
-        'modo supervisor': 'Supervisor',
-        'cash out': 'Cash Out'
-    }
-    for k, v in mapa.items():
-        if k in m:
-            return v
-    return 'Comunicaciones'
-
-
-def categoria_por_falla_ncr(falla):
-    m = str(falla).lower()
-    mapa = {
-        'falla de configuración': 'Falla de HW / Servicio Técnico',
-        'hardware': 'Falla de HW / Servicio Técnico',
-        'pantalla con fallas': 'Falla de HW / Servicio Técnico',
-        'lector de tarjeta con falla': 'Lector de Tarjeta SLMG',
-        'impresora con falla': 'Impresora de recibos SLMG',
-        'dispensador con falla': 'Dispenser no paga SLMG',
-        'bna con falla': 'BNA/SDM/Deposito SLMG'
-    }
-    for k, v in mapa.items():
-        if k in m:
-            return v
-    return 'Falla de HW / Servicio Técnico'
-
-
-# Funciones de procesamiento (sin cambios en la lógica)
-def procesar_exclusiones_cmm(df_cmm, df_th, tol):
-    atm_col = 'ATM'
-    fini = next(c for c in df_cmm
-                if 'FECHA' in c.upper() and 'INICIO' in c.upper())
-    hini = next(c for c in df_cmm
-                if 'HORA' in c.upper() and 'INICIO' in c.upper())
-    ffin = next(
-        c for c in df_cmm
-        if 'FECHA' in c.upper() and any(k in c.upper()
-                                        for k in ['TERMINO', 'CIERRE', 'FIN']))
-    hfin = next(
-        c for c in df_cmm
-        if 'HORA' in c.upper() and any(k in c.upper()
-                                       for k in ['TERMINO', 'CIERRE', 'FIN']))
-    sbif = next(c for c in df_cmm
-                if 'SBIF' in c.upper() or 'CODIGO' in c.upper())
-
-    df_cmm['_ini'] = df_cmm.apply(
-        lambda r: combinar_fecha_hora(r[fini], r[hini]), axis=1)
-    df_cmm['_fin'] = df_cmm.apply(
-        lambda r: combinar_fecha_hora(r[ffin], r[hfin]), axis=1)
-
-    df_th['id_norm'] = normalizar_id(df_th['ID'])
-    df_th['ini_th'] = pd.to_datetime(df_th['START TIME'], errors='coerce')
-    df_th['fin_th'] = pd.to_datetime(df_th['END TIME'], errors='coerce')
-
-    out = []
-    for _, r in df_cmm.iterrows():
-        atm, ini, fin = r[atm_col], r['_ini'], r['_fin']
-        if pd.isna(ini): continue
-        orig = categoria_por_sbif(r[sbif])
-        norm = normalizar_id(pd.Series(str(atm))).iloc[0]
-        sub = df_th[df_th['id_norm'] == norm]
-
-        if sub.empty:
-            out.append({
-                'ATM': atm,
-                'Status Orig': orig,
-                'Estado': 'No Encontrado',
-                'TK TH': 'N/A',
-                'Ini Orig': ini,
-                'Fin Orig': fin,
-                'Ini TH': pd.NaT,
-                'Fin TH': pd.NaT
-            })
-        else:
-            sub['diff'] = (sub['ini_th'] - ini).abs().dt.total_seconds() / 60
-            best = sub.loc[sub['diff'].idxmin()]
-            est = 'Encontrado' if best['diff'] <= tol else 'Diferencia'
-            out.append({
-                'ATM': atm,
-                'Status Orig': orig,
-                'Estado': est,
-                'TK TH': best['TICKET KEY'],
-                'Ini Orig': ini,
-                'Fin Orig': fin,
-                'Ini TH': best['ini_th'],
-                'Fin TH': best['fin_th']
-            })
-    return pd.DataFrame(out)
-
-
-def procesar_base_fallas(df_base, df_th):
-    df_base['id_norm'] = normalizar_id(df_base['ATM'])
-    df_base['Status'] = df_base['RESUMEN FALLA'].apply(
-        categoria_por_resumen_falla)
-
-    df_th2 = df_th.copy()
-    df_th2['id_norm'] = normalizar_id(df_th2['ID'])
-    df_th2['sd'] = pd.to_datetime(df_th2['START TIME'], errors='coerce')
-    idx = df_th2.groupby('id_norm')['sd'].idxmax()
-    df_lat = df_th2.loc[idx]
-    df_lat['Inicio TH'] = df_lat['sd']
-    df_lat['Fin TH'] = pd.to_datetime(df_lat['END TIME'], errors='coerce')
-
-    m = pd.merge(df_base,
-                 df_lat[['id_norm', 'TICKET KEY', 'Inicio TH', 'Fin TH']],
-                 on='id_norm',
-                 how='left')
-    m['Estado'] = np.where(m['TICKET KEY'].notna(), 'Encontrado en TH',
-                           'No Encontrado')
-    m['TK TH'] = m['TICKET KEY'].fillna('N/A')
-    return m[['ATM', 'TK TH', 'Status', 'Estado', 'Inicio TH', 'Fin TH']]
-
-
-def procesar_base_fallas_ncr(df_ncr, df_th, tol=30):
-    df_ncr['inicio'] = df_ncr.apply(lambda r: combinar_fecha_hora(
-        r.get('FECHA INICIAL'), r.get('HORA INICIAL')),
-                                    axis=1)
-    df_th['id_norm'] = normalizar_id(df_th['ID'])
-    df_th['inicio_th'] = pd.to_datetime(df_th['START TIME'], errors='coerce')
-    df_th['fin_th'] = pd.to_datetime(df_th['END TIME'], errors='coerce')
-    df_th['REFERENCE'] = df_th['REFERENCE'].astype(str).str.strip()
-
-    out = []
-    for _, r in df_ncr.iterrows():
-        atm, wo, falla, ini = r['ATM'], str(
-            r['WO']).strip(), r['FALLA NCR'], r['inicio']
-        cat = categoria_por_falla_ncr(falla)
-        est, tk, i_th, f_th = 'No Encontrado', 'N/A', pd.NaT, pd.NaT
-
-        if wo.lower() not in ['nan', '']:
-            dfw = df_th[df_th['REFERENCE'] == wo]
-            if not dfw.empty:
-                m0 = dfw.iloc[0]
-                est, tk, i_th, f_th = 'Encontrado por WO', m0['REFERENCE'], m0[
-                    'inicio_th'], m0['fin_th']
-
-        if est == 'No Encontrado' and pd.notna(ini):
-            norm = normalizar_id(pd.Series(str(atm))).iloc[0]
-            sub = df_th[df_th['id_norm'] == norm].copy()
-            if not sub.empty:
-                sub['diff'] = (sub['inicio_th'] -
-                               ini).abs().dt.total_seconds() / 60
-                filt = sub[sub['diff'] <= tol]
-                match = filt[filt['CATEGORY'].str.contains(cat,
-                                                           case=False,
-                                                           na=False)]
-                if not match.empty:
-                    b = match.loc[match['diff'].idxmin()]
-                    est, tk, i_th, f_th = 'Encontrado (ID+Tiempo+Falla)', b[
-                        'REFERENCE'], b['inicio_th'], b['fin_th']
-                elif not filt.empty:
-                    b = filt.loc[filt['diff'].idxmin()]
-                    est, tk, i_th, f_th = 'Encontrado (ID+Tiempo)', b[
-                        'REFERENCE'], b['inicio_th'], b['fin_th']
-                else:
-                    b = sub.iloc[0]
-                    est, tk, i_th, f_th = 'Encontrado (Solo ID)', b[
-                        'REFERENCE'], b['inicio_th'], b['fin_th']
-
-        out.append({
-            'ATM': atm,
-            'TK TH': tk,
-            'Status (Categoría)': cat,
-            'Inicio TH': i_th,
-            'Fin TH': f_th,
-            'Estado Búsqueda': est
-        })
-    return pd.DataFrame(out)
+"""
+
+
+def configurar_pagina():
+    """Configuración de la página y estilos (se emiten en cada rerun)"""
+    st.set_page_config(page_title="Sistema de Gestión ATM",
+                       page_icon="🏧",
+                       layout="wide")
+    st.markdown(ESTILOS, unsafe_allow_html=True)
+
+
+@st.cache_resource
+def almacen_resultados():
+    """Almacén de resultados comprimidos compartido por todas las sesiones"""
+    from utils.almacen import AlmacenResultados
+    return AlmacenResultados.desde_config()
+
+
+@st.cache_resource
+def exportacion_metricas():
+    """Publica las métricas del proceso según [metricas] (una vez por proceso)"""
+    from utils.metricas import configurar_exportacion
+    return configurar_exportacion()
+
+
+@st.cache_resource
+def cache_etapas():
+    """Caché de etapas compartida por todas las sesiones (se crea al procesar
+    por primera vez); los resultados viven en el almacén y la caché solo
+    guarda referencias"""
+    from utils.pipeline import CacheEtapas
+    return CacheEtapas.desde_config(almacen=almacen_resultados())
+
+
+def iniciar_sesion():
+    """Inicializa los estados de sesión para mejor UX"""
+    if 'processing' not in st.session_state:
+        st.session_state.processing = False
+    if 'last_processed' not in st.session_state:
+        st.session_state.last_processed = None
+    if 'resultados' not in st.session_state:
+        st.session_state.resultados = {}
+    if 'metricas' not in st.session_state:
+        st.session_state.metricas = {}
+    if 'matriz_ncr' not in st.session_state:
+        st.session_state.matriz_ncr = None
+    if 'originales' not in st.session_state:
+        st.session_state.originales = {}
+    if 'etapas' not in st.session_state:
+        st.session_state.etapas = None
+    if 'huellas_resultados' not in st.session_state:
+        st.session_state.huellas_resultados = {}
+    if 'origenes' not in st.session_state:
+        st.session_state.origenes = {}
+    if 'resumen_lote' not in st.session_state:
+        st.session_state.resumen_lote = None
+    if 'cubos' not in st.session_state:
+        st.session_state.cubos = {}
+    if 'cambios' not in st.session_state:
+        st.session_state.cambios = None
+
+
+def registro_corridas():
+    """Registro de corridas de la sesión para el reporte diferencial"""
+    if 'corridas' not in st.session_state:
+        from utils.cambios import RegistroCorridas
+        # Con [cambios] directorio la corrida anterior es la última de
+        # cualquier sesión; sin él, la anterior de esta sesión
+        st.session_state.corridas = RegistroCorridas.desde_config()
+    return st.session_state.corridas
 
 
 # Función para validar archivos
@@ -289,6 +119,10 @@ def validate_files(file_dat, file_th):
 
 # Interfaz principal mejorada
 def main():
+    configurar_pagina()
+    iniciar_sesion()
+    exportacion_metricas()
+
     # Header principal con métricas
     st.title("🏧 Sistema de Gestión ATM")
     st.markdown(
@@ -302,19 +136,36 @@ def main():
         # Sección de archivos con validación visual
         st.subheader("📂 Carga de Archivos")
 
-        file_dat = st.file_uploader(
+        archivos_dat = st.file_uploader(
             "📊 Datos ATM (Excel)",
             type=['xlsx', 'xls'],
-            help="Archivo Excel con datos de ATMs para procesamiento")
+            accept_multiple_files=True,
+            help="Archivo Excel con datos de ATMs para procesamiento. "
+            "Con varios archivos se procesan todos contra el mismo TH (modo lote)")
+        archivos_dat = archivos_dat or []
+        file_dat = archivos_dat[0] if archivos_dat else None
+        modo_lote = len(archivos_dat) > 1
 
         if file_dat:
-            st.success("✅ Archivo de datos cargado correctamente")
-            # Cargar hojas disponibles
-            excel = pd.ExcelFile(file_dat)
-            hojas = excel.sheet_names
+            if modo_lote:
+                st.success(
+                    f"✅ {len(archivos_dat)} archivos de datos cargados (modo lote)")
+            else:
+                st.success("✅ Archivo de datos cargado correctamente")
+            # Cargar hojas disponibles (unión de las hojas de todos los libros)
+            libros = dict(
+                zip(etiquetas_libros([a.name for a in archivos_dat]),
+                    archivos_dat))
+            hojas_libros = {
+                libro: pd.ExcelFile(archivo).sheet_names
+                for libro, archivo in libros.items()
+            }
+            hojas = list(
+                dict.fromkeys(h for lista in hojas_libros.values()
+                              for h in lista))
         else:
             st.warning("⚠️ Archivo de datos requerido")
-            excel, hojas = None, []
+            libros, hojas_libros, hojas = {}, {}, []
 
         file_th = st.file_uploader(
             "📉 TH Downtime (Excel)",
@@ -369,6 +220,10 @@ def main():
             )
             return
 
+        from utils.pipeline import (PROCESOS, Pipeline, construir_lote,
+                                    construir_pipeline, etapa_lote, huella)
+        from utils.procesamiento import MODOS_BASE_FALLAS
+
         # Configuración en layout organizado
         col1, col2 = st.columns([1, 1])
 
@@ -400,6 +255,37 @@ def main():
                 "Tolerancia en minutos para la búsqueda de coincidencias temporales"
             )
 
+            modo_base = st.selectbox(
+                "📅 Ticket TH para Base Fallas",
+                list(MODOS_BASE_FALLAS),
+                format_func=MODOS_BASE_FALLAS.get,
+                key='modo_base',
+                help=
+                "As-of asigna a cada falla el ticket TH más reciente iniciado "
+                "hasta la fecha de la falla (más la tolerancia)")
+
+            modo_bloques = st.checkbox(
+                "🧱 Procesar por bloques (archivos muy grandes)",
+                key='modo_bloques',
+                help=
+                "Lee cada hoja por bloques y guarda los resultados en disco "
+                "en lugar de cargarlos completos en memoria")
+            filas_bloque, memoria_max = None, None
+            if modo_bloques:
+                memoria_max = st.number_input(
+                    "💾 Presupuesto de memoria (MB)",
+                    min_value=64,
+                    value=512,
+                    step=64,
+                    key='memoria_max',
+                    help="Memoria objetivo para el índice TH más un bloque")
+                filas_bloque = st.number_input(
+                    "📏 Filas por bloque (0 = según el presupuesto)",
+                    min_value=0,
+                    value=0,
+                    step=5000,
+                    key='filas_bloque') or None
+
             st.markdown("**📊 Resumen de Configuración**")
             procesamiento_count = sum([
                 excl != "No procesar", base != "No procesar", ncr
@@ -427,10 +313,115 @@ def main():
                 use_container_width=True,
                 disabled=not (file_dat and file_th
                               and procesamiento_count > 0))
+            preview_button = st.button(
+                "🔎 VISTA PREVIA (muestra)",
+                use_container_width=True,
+                disabled=not (file_dat and file_th
+                              and procesamiento_count > 0),
+                help="Procesa una muestra por ATM de cada hoja y estima las "
+                "tasas por estado y el tiempo de la corrida completa")
+
+        # Vista previa: tasas estimadas con una muestra de cada hoja
+        configuracion = ((excl, base, ncr), tol, modo_base, modo_bloques,
+                         tuple(a.name for a in archivos_dat), file_th.name)
+        if preview_button:
+            from utils.bloques import leer_hoja_por_bloques
+            from utils.vista_previa import muestra_por_bloques, vista_previa
+            previas = {}
+            with st.spinner("🔎 Procesando una muestra de cada hoja..."):
+                try:
+                    for nombre, hoja in [('Exclusiones-CMM', excl),
+                                         ('Base Fallas', base),
+                                         ('Base Fallas NCR', ncr)]:
+                        if hoja == "No procesar":
+                            continue
+                        # En modo lote, el primer libro que tiene la hoja
+                        archivo = next(libros[libro] for libro in libros
+                                       if hoja in hojas_libros[libro])
+                        ingesta = IngestaExcel()
+                        # Las lecturas quedan en la caché de etapas y la
+                        # corrida completa las reutiliza
+                        pipeline = construir_pipeline(
+                            cache_etapas(), ingesta, file_th,
+                            archivo, {nombre: hoja}, tol, modo_base)
+                        etapas = ['Índice TH'] if modo_bloques else \
+                            ['Índice TH', f'Lectura {nombre}']
+                        pendientes = pipeline.pendientes(etapas)
+                        ingesta.iniciar([
+                            clave for clave in ['TH', nombre]
+                            if f'Lectura {clave}' in pendientes
+                        ])
+                        th = pipeline.resultado('Índice TH')
+                        if th is None:
+                            st.error("❌ No se pudo procesar el archivo TH "
+                                     "Downtime. Verifica el formato.")
+                            break
+                        parametros = {'tol': tol}
+                        if nombre == 'Base Fallas':
+                            parametros['modo'] = modo_base
+                        if nombre == 'Base Fallas NCR':
+                            parametros['matriz'] = pipeline.resultado('Matriz NCR')
+                        try:
+                            if modo_bloques:
+                                # La corrida por bloques vuelve a leer la hoja:
+                                # su lectura completa mide ese tiempo
+                                inicio_lectura = perf_counter()
+                                datos, total = muestra_por_bloques(
+                                    leer_hoja_por_bloques(archivo, hoja,
+                                                          filas_bloque,
+                                                          memoria_max,
+                                                          th.nbytes()))
+                                lectura = perf_counter() - inicio_lectura
+                            else:
+                                datos = pipeline.resultado(f'Lectura {nombre}')
+                                total, lectura = len(datos), 0.0
+                            previas[nombre] = (hoja, vista_previa(
+                                PROCESOS[nombre], datos, th, parametros,
+                                total=total, segundos_lectura=lectura))
+                        except Exception as e:
+                            previas[nombre] = (hoja, e)
+                except Exception as e:
+                    st.error(f"❌ **Error en la vista previa:** {str(e)}")
+            # En la sesión queda solo la referencia al almacén
+            st.session_state.vista_previa = (configuracion, almacen_resultados(
+            ).guardar(huella(('Vista previa', previas)), previas))
+
+        previa = st.session_state.get('vista_previa')
+        previas = previa[1].cargar() if previa and previa[0] == configuracion \
+            else None
+        if previas:
+            st.markdown("#### 🔎 Vista previa (estimación con una muestra)")
+            for nombre, (hoja, estimacion) in previas.items():
+                if isinstance(estimacion, Exception):
+                    st.error(
+                        f"❌ {nombre}: la hoja '{hoja}' no se pudo procesar "
+                        f"({estimacion}). ¿Es la hoja correcta?")
+                    continue
+                tabla = estimacion.tabla.assign(**{
+                    'Tasa estimada': estimacion.tabla['Tasa'].map('{:.1%}'.format),
+                    'IC 95%': [f"{a:.1%} – {b:.1%}" for a, b in zip(
+                        estimacion.tabla['IC inferior'],
+                        estimacion.tabla['IC superior'])],
+                })[['Estado', 'Tasa estimada', 'IC 95%', 'Filas estimadas',
+                    'Muestra']]
+                st.markdown(f"**{nombre}** · hoja '{hoja}'")
+                st.dataframe(tabla, use_container_width=True, hide_index=True)
+                lectura = f"lectura {estimacion.segundos_lectura:.1f} s" \
+                    if estimacion.segundos_lectura else "lectura en caché"
+                st.caption(
+                    f"Muestra de {estimacion.muestra} de {estimacion.total} "
+                    f"fila(s), estratificada por ATM · Tiempo estimado de la "
+                    f"corrida: {estimacion.segundos_estimados:.1f} s "
+                    f"(procesamiento {estimacion.segundos_proceso:.1f} s, "
+                    f"{lectura})")
 
         # Lógica de procesamiento (mantengo toda la funcionalidad original)
         if process_button:
+            from utils.bloques import SpoolResultados, leer_hoja_por_bloques
+            from utils.cambios import fuente_libro
+            from utils.metricas import memoria_pico, registrar_corrida
             st.session_state.processing = True
+            inicio_corrida = perf_counter()
 
             with st.spinner("🔄 Procesando datos..."):
                 # Mostrar progreso
@@ -438,14 +429,62 @@ def main():
                 status_text = st.empty()
 
                 try:
-                    # Cargar y limpiar datos TH
-                    status_text.text('📂 Cargando archivo TH Downtime...')
+                    # Hojas seleccionadas, en el orden de las pestañas de resultados
+                    hojas_sel = {
+                        nombre: hoja
+                        for nombre, hoja in [('Exclusiones-CMM', excl),
+                                             ('Base Fallas', base),
+                                             ('Base Fallas NCR', ncr)]
+                        if hoja != "No procesar"
+                    }
+
+                    # Armar el grafo de etapas; solo se ejecuta lo que cambió
+                    status_text.text('📂 Cargando archivos...')
                     progress_bar.progress(20)
-
-                    df_th_raw = pd.read_excel(file_th, header=None)
-                    df_th = limpiar_th_downtime(df_th_raw)
-
-                    if df_th.empty:
+                    ingesta = IngestaExcel()
+                    bloques = dict(filas_bloque=filas_bloque,
+                                   memoria_max_mb=memoria_max) \
+                        if modo_bloques else None
+                    if modo_lote:
+                        # Un solo índice TH para todos los libros del lote
+                        libros_sel = {
+                            libro: (archivo,
+                                    hojas_del_libro(hojas_sel,
+                                                    hojas_libros[libro]))
+                            for libro, archivo in libros.items()
+                        }
+                        libros_sel = {
+                            libro: datos
+                            for libro, datos in libros_sel.items() if datos[1]
+                        }
+                        pipeline = construir_lote(
+                            cache_etapas(), ingesta, file_th,
+                            libros_sel, tol, modo_base, bloques)
+                        procesos = {
+                            etapa_lote(libro, nombre):
+                            (libro, nombre, archivo, hoja)
+                            for libro, (archivo, hojas_libro) in libros_sel.items()
+                            for nombre, hoja in hojas_libro.items()
+                        }
+                    else:
+                        pipeline = construir_pipeline(
+                            cache_etapas(), ingesta, file_th,
+                            file_dat, hojas_sel, tol, modo_base, bloques)
+                        procesos = {
+                            nombre: (None, nombre, file_dat, hoja)
+                            for nombre, hoja in hojas_sel.items()
+                        }
+
+                    # Leer en paralelo el TH y las hojas que no están en caché
+                    pendientes = pipeline.pendientes(['Índice TH'] +
+                                                     list(procesos))
+                    ingesta.iniciar([
+                        clave for clave in ['TH'] + list(procesos)
+                        if f'Lectura {clave}' in pendientes
+                    ])
+
+                    # Cargar, limpiar e indexar datos TH
+                    if pipeline.resultado('Índice TH') is None:
                         st.error(
                             "❌ No se pudo procesar el archivo TH Downtime. Verifica el formato."
                         )
@@ -455,63 +494,135 @@ def main():
                     progress_bar.progress(40)
                     status_text.text('⚙️ Procesando datos...')
 
-                    resultados = {}
-                    progress_step = 60 / max(procesamiento_count, 1)
+                    textos = {
+                        'Exclusiones-CMM': '🔄 Procesando Exclusiones-CMM...',
+                        'Base Fallas': '⚡ Procesando Base Fallas...',
+                        'Base Fallas NCR': '🛠️ Procesando Base Fallas NCR...'
+                    }
+
+                    resultados, originales, cubos = {}, {}, {}
+                    progress_step = 60 / max(len(procesos), 1)
                     current_progress = 40
 
-                    # Procesar Exclusiones-CMM
-                    if excl != "No procesar":
-                        status_text.text('🔄 Procesando Exclusiones-CMM...')
+                    # Cada proceso arranca apenas su hoja termina de leerse
+                    for etapa in ingesta.en_orden_de_llegada(list(procesos)):
+                        libro, nombre = procesos[etapa][:2]
+                        status_text.text(textos[nombre] + (
+                            f' ({libro})' if libro else ''))
                         try:
-                            resultados[
-                                'Exclusiones-CMM'] = procesar_exclusiones_cmm(
-                                    excel.parse(excl), df_th, tol)
+                            if nombre == 'Base Fallas NCR':
+                                st.session_state.matriz_ncr = \
+                                    pipeline.resultado('Matriz NCR').tabla
+                            resultados[etapa] = pipeline.resultado(etapa)
+                            cubos[etapa] = pipeline.resultado(f'Cubo {etapa}')
+                            if not modo_bloques:
+                                originales[etapa] = pipeline.resultado(
+                                    f'Lectura {etapa}')
                             current_progress += progress_step
                             progress_bar.progress(int(current_progress))
                         except Exception as e:
-                            st.error(
-                                f"❌ Error procesando Exclusiones-CMM: {str(e)}"
-                            )
+                            st.error(f"❌ Error procesando {etapa}: {str(e)}")
 
-                    # Procesar Base Fallas
-                    if base != "No procesar":
-                        status_text.text('⚡ Procesando Base Fallas...')
-                        try:
-                            resultados['Base Fallas'] = procesar_base_fallas(
-                                excel.parse(base), df_th)
-                            current_progress += progress_step
-                            progress_bar.progress(int(current_progress))
-                        except Exception as e:
-                            st.error(
-                                f"❌ Error procesando Base Fallas: {str(e)}")
-
-                    # Procesar Base Fallas NCR
-                    if ncr != "No procesar":
-                        status_text.text('🛠️ Procesando Base Fallas NCR...')
-                        try:
-                            resultados[
-                                'Base Fallas NCR'] = procesar_base_fallas_ncr(
-                                    excel.parse(ncr), df_th, tol)
-                            current_progress += progress_step
-                            progress_bar.progress(int(current_progress))
-                        except Exception as e:
-                            st.error(
-                                f"❌ Error procesando Base Fallas NCR: {str(e)}"
-                            )
+                    resultados = {
+                        etapa: resultados[etapa]
+                        for etapa in procesos if etapa in resultados
+                    }
 
                     # Finalizar procesamiento
                     status_text.text('✅ Procesamiento completado!')
                     progress_bar.progress(100)
 
+                    # Filas que cambiaron desde la corrida anterior de cada hoja
+                    cambios = {}
+                    for etapa, df_res in resultados.items():
+                        libro, nombre, archivo = procesos[etapa][:3]
+                        fuente = fuente_libro(libro or getattr(archivo, 'name', ''))
+                        if etapa in originales:
+                            df_in = originales[etapa]
+                        else:
+                            archivo, hoja = procesos[etapa][2:4]
+                            df_in = lambda archivo=archivo, hoja=hoja: \
+                                leer_hoja_por_bloques(archivo, hoja,
+                                                      filas_bloque, memoria_max)
+                        try:
+                            diferencia = registro_corridas().comparar(
+                                nombre, df_in, df_res, fuente=fuente)
+                        except Exception as e:
+                            st.warning(f"⚠️ No se pudieron calcular los cambios de {etapa}: {e}")
+                            continue
+                        if diferencia is not None:
+                            cambios[etapa] = diferencia
+
+                    # En la sesión quedan solo referencias: los resultados,
+                    # las hojas originales, los cubos y los cambios se guardan
+                    # comprimidos en el almacén
+                    almacen = almacen_resultados()
+                    metricas = {}
+                    for etapa, df_res in list(resultados.items()):
+                        if isinstance(df_res, SpoolResultados):
+                            metricas[etapa] = df_res.metricas
+                            continue
+                        visor = VisorResultados(df_res)
+                        resultados[etapa] = almacen.guardar(
+                            pipeline.huella(etapa), df_res, abrir=True)
+                        resultados[etapa].derivado('visor', lambda _: visor)
+                        metricas[etapa] = visor.metricas
+                    originales = {
+                        etapa: almacen.guardar(
+                            pipeline.huella(f'Lectura {etapa}'), df_in)
+                        for etapa, df_in in originales.items()
+                    }
+                    cubos = {
+                        etapa: almacen.guardar(
+                            pipeline.huella(f'Cubo {etapa}'), cubo)
+                        for etapa, cubo in cubos.items()
+                    }
+                    cambios = almacen.guardar(huella(('Cambios', cambios)),
+                                              cambios) if cambios else None
+                    registrar_corrida({
+                        'filas': {etapa: m['total'] for etapa, m in metricas.items()},
+                        'estados': {etapa: m['por_estado']
+                                    for etapa, m in metricas.items()
+                                    if 'por_estado' in m},
+                        'filas_th': len(pipeline.resultado('Índice TH')),
+                        'etapas': pipeline.resumen().to_dict(orient='records'),
+                        'errores': {etapa: True for etapa in procesos
+                                    if etapa not in resultados},
+                        'segundos': perf_counter() - inicio_corrida,
+                        'memoria_pico': memoria_pico(),
+                    }, 'app')
+
                     # Guardar resultados en sesión
                     st.session_state.resultados = resultados
+                    st.session_state.originales = originales
+                    st.session_state.metricas = metricas
+                    st.session_state.cubos = cubos
+                    st.session_state.cambios = cambios
+                    st.session_state.etapas = pipeline.resumen()
+                    st.session_state.huellas_resultados = {
+                        nombre: pipeline.huella(nombre)
+                        for nombre in resultados
+                    }
+                    st.session_state.origenes = {
+                        etapa: procesos[etapa]
+                        for etapa in resultados
+                    }
+                    st.session_state.resumen_lote = resumen_lote({
+                        procesos[etapa][:2]: metricas[etapa]
+                        for etapa in resultados
+                    }) if modo_lote else None
                     st.session_state.last_processed = datetime.now()
                     st.session_state.processing = False
 
                     if resultados:
-                        st.success(
-                            f"✅ **Procesamiento completado exitosamente!** Se procesaron {len(resultados)} tipo(s) de datos."
-                        )
+                        if modo_lote:
+                            st.success(
+                                f"✅ **Procesamiento completado exitosamente!** Se procesaron {len(resultados)} hoja(s) de {len(libros_sel)} libro(s) con un único índice TH."
+                            )
+                        else:
+                            st.success(
+                                f"✅ **Procesamiento completado exitosamente!** Se procesaron {len(resultados)} tipo(s) de datos."
+                            )
                         st.info(
                             "💡 **Próximo paso:** Ve a la pestaña 'Resultados' para ver y descargar los datos procesados."
                         )
@@ -531,6 +642,25 @@ def main():
     with tab2:
         st.subheader("📊 Resultados del Procesamiento")
 
+        # Solo hay resultados después de procesar, con estos módulos ya cargados
+        if st.session_state.resultados:
+            from utils.almacen import ResultadoGuardado
+            from utils.bloques import SpoolResultados, leer_hoja_por_bloques
+            from utils.cambios import conteos
+            from utils.exportacion import FORMATOS, paquete_exportacion
+            from utils.metricas import registrar_reporte
+
+            # Resultados vencidos en el almacén por inactividad
+            vencidos = [
+                name for name, df_out in st.session_state.resultados.items()
+                if isinstance(df_out, ResultadoGuardado) and not df_out.disponible
+            ]
+            if vencidos:
+                st.warning(
+                    "⌛ Los resultados se descartaron por inactividad. Vuelve a "
+                    "procesar los archivos para verlos.")
+                st.session_state.resultados = {}
+
         if st.session_state.resultados:
             # Información del último procesamiento
             if st.session_state.last_processed:
@@ -538,286 +668,322 @@ def main():
                     f"🕒 **Último procesamiento:** {st.session_state.last_processed.strftime('%d/%m/%Y %H:%M:%S')}"
                 )
 
+            # Etapas ejecutadas y reutilizadas en el último procesamiento
+            etapas = st.session_state.etapas
+            if etapas is not None and not etapas.empty:
+                reutilizadas = int((etapas['Estado'] == 'Caché').sum())
+                with st.expander(
+                        f"♻️ Etapas: {reutilizadas} de {len(etapas)} "
+                        f"reutilizadas desde caché"):
+                    st.dataframe(etapas,
+                                 use_container_width=True,
+                                 hide_index=True)
+
+            # Cambios respecto de la corrida anterior (ver utils.cambios)
+            cambios = st.session_state.cambios
+            cambios = (cambios.cargar() if cambios is not None else None) or {}
+            if cambios:
+                totales = pd.DataFrame(
+                    [{'Proceso': name, **conteos(df_cambios)}
+                     for name, df_cambios in cambios.items()])
+                n_cambios = int(totales.drop(columns='Proceso').to_numpy().sum())
+                with st.expander(
+                        f"🔁 {n_cambios} fila(s) cambiaron desde la corrida anterior"):
+                    st.dataframe(totales, use_container_width=True,
+                                 hide_index=True)
+                    for name, df_cambios in cambios.items():
+                        if len(df_cambios):
+                            st.markdown(f"**{name}**")
+                            st.dataframe(df_cambios, use_container_width=True,
+                                         hide_index=True)
+            # Sin [cambios] directorio las instantáneas no sobreviven a la sesión
+            if not registro_corridas().directorio:
+                st.caption(
+                    "🔁 Los cambios se comparan con la corrida anterior de esta "
+                    "sesión. Configura `directorio` en la sección [cambios] de "
+                    "atm_config.toml para compararlos entre sesiones y reinicios.")
+
+            # En modo lote: resumen combinado y selección del libro a revisar
+            resultados_vista = st.session_state.resultados
+            resumen = st.session_state.resumen_lote
+            if resumen is not None:
+                st.markdown("#### 📚 Resumen del lote")
+                st.dataframe(resumen, use_container_width=True, hide_index=True)
+                libros_lote = list(
+                    dict.fromkeys(libro for libro, *_ in
+                                  st.session_state.origenes.values()))
+                libro_sel = st.selectbox("📘 Libro", libros_lote,
+                                         key='vis_libro')
+                resultados_vista = {
+                    name: df_out
+                    for name, df_out in st.session_state.resultados.items()
+                    if st.session_state.origenes[name][0] == libro_sel
+                }
+
             # Mostrar resultados en sub-tabs
-            result_tabs = st.tabs(list(st.session_state.resultados.keys()))
+            result_tabs = st.tabs([
+                st.session_state.origenes[name][1]
+                for name in resultados_vista
+            ])
 
-            for tab, (name,
-                      df_out) in zip(result_tabs,
-                                     st.session_state.resultados.items()):
+            for tab, (name, df_out) in zip(result_tabs,
+                                           resultados_vista.items()):
                 with tab:
                     st.markdown(f"### 📈 {name}")
 
-                    # Métricas del resultado
+                    es_spool = isinstance(df_out, SpoolResultados)
+                    metricas = st.session_state.metricas[name]
+                    if es_spool:
+                        con_estado = df_out.columna_estado
+                    else:
+                        # Se descomprime al verlo (los últimos abiertos quedan en memoria)
+                        visor = df_out.derivado('visor', VisorResultados)
+                        df_out = visor.df
+                        con_estado = visor.columna_estado
+
+                    # Métricas del resultado (calculadas al terminar el procesamiento)
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        st.metric("Total Registros", len(df_out))
+                        st.metric("Total Registros", metricas['total'])
                     with col2:
-                        if 'Estado' in df_out.columns:
-                            encontrados = len(
-                                df_out[df_out['Estado'].str.contains(
-                                    'Encontrado', na=False)])
-                            st.metric("Encontrados", encontrados)
-                        elif 'Estado Búsqueda' in df_out.columns:
-                            encontrados = len(
-                                df_out[df_out['Estado Búsqueda'].str.contains(
-                                    'Encontrado', na=False)])
-                            st.metric("Encontrados", encontrados)
+                        if con_estado:
+                            st.metric("Encontrados", metricas['encontrados'])
                         else:
-                            st.metric("Procesados", len(df_out))
+                            st.metric("Procesados", metricas['total'])
                     with col3:
-                        if 'Estado' in df_out.columns:
-                            no_encontrados = len(
-                                df_out[df_out['Estado'] == 'No Encontrado'])
-                            st.metric("No Encontrados", no_encontrados)
-                        elif 'Estado Búsqueda' in df_out.columns:
-                            no_encontrados = len(df_out[
-                                df_out['Estado Búsqueda'] == 'No Encontrado'])
-                            st.metric("No Encontrados", no_encontrados)
+                        if con_estado:
+                            st.metric("No Encontrados",
+                                      metricas['no_encontrados'])
                         else:
-                            st.metric("Columnas", len(df_out.columns))
-
-                    # Mostrar DataFrame
-                    st.dataframe(df_out, use_container_width=True, height=400)
+                            st.metric("Columnas", metricas['columnas'])
+
+                    # Mostrar solo la página visible (ordenada y filtrada en el servidor)
+                    if es_spool:
+                        # Los resultados por bloques se leen desde disco en orden original
+                        st.caption(
+                            f"🧱 Resultado guardado en disco en "
+                            f"{len(df_out.partes)} bloque(s); se muestra en el "
+                            f"orden original")
+                        tamano = st.selectbox("Filas por página",
+                                              [50, 100, 250, 500],
+                                              index=1,
+                                              key=f'vis_tamano_{name}')
+                        total_filtrado = metricas['total']
+                    else:
+                        c1, c2, c3, c4 = st.columns([2, 2, 1, 1])
+                        with c1:
+                            estados_sel = st.multiselect(
+                                "Filtrar por estado",
+                                visor.estados,
+                                key=f'vis_estados_{name}')
+                        with c2:
+                            col_orden = st.selectbox(
+                                "Ordenar por", [None] + list(df_out.columns),
+                                format_func=lambda c: "Orden original"
+                                if c is None else c,
+                                key=f'vis_orden_{name}')
+                        with c3:
+                            ascendente = st.radio("Sentido", ["Asc", "Desc"],
+                                                  key=f'vis_sentido_{name}',
+                                                  horizontal=True) == "Asc"
+                        with c4:
+                            tamano = st.selectbox("Filas por página",
+                                                  [50, 100, 250, 500],
+                                                  index=1,
+                                                  key=f'vis_tamano_{name}')
+
+                        total_filtrado = len(
+                            visor.seleccionar(None, True, estados_sel))
+                    paginas = max(1, -(-total_filtrado // tamano))
+                    if st.session_state.get(f'vis_pagina_{name}', 1) > paginas:
+                        st.session_state[f'vis_pagina_{name}'] = paginas
+                    numero = st.number_input("Página",
+                                             min_value=1,
+                                             max_value=paginas,
+                                             value=1,
+                                             step=1,
+                                             key=f'vis_pagina_{name}')
+                    if es_spool:
+                        df_pagina, total_filtrado, paginas = df_out.pagina(
+                            int(numero), tamano)
+                    else:
+                        df_pagina, total_filtrado, paginas = visor.pagina(
+                            int(numero), tamano, col_orden, ascendente,
+                            estados_sel)
+                    st.dataframe(df_pagina, use_container_width=True, height=400)
+                    inicio = (int(numero) - 1) * tamano
+                    st.caption(
+                        f"Filas {min(inicio + 1, total_filtrado)}–"
+                        f"{inicio + len(df_pagina)} de {total_filtrado} "
+                        f"· Página {int(numero)} de {paginas}")
+
+                    # Tablas dinámicas sobre el cubo pre-agregado del resultado
+                    cubo = st.session_state.cubos.get(name)
+                    cubo = cubo.cargar() if cubo is not None else None
+                    if cubo is not None and len(cubo):
+                        with st.expander(
+                                "🧊 Análisis por ATM, día, categoría y estado"):
+                            c1, c2, c3 = st.columns(3)
+                            with c1:
+                                dim_filas = st.selectbox(
+                                    "Filas", DIMENSIONES, index=2,
+                                    key=f'cubo_filas_{name}')
+                            with c2:
+                                dim_columnas = st.selectbox(
+                                    "Columnas",
+                                    [None] + [d for d in DIMENSIONES
+                                              if d != dim_filas],
+                                    format_func=lambda d: "Sin desglose"
+                                    if d is None else d,
+                                    key=f'cubo_columnas_{name}')
+                            with c3:
+                                medida = st.selectbox("Medida", MEDIDAS,
+                                                      key=f'cubo_medida_{name}')
+
+                            tabla = cubo.tabla(dim_filas, dim_columnas, medida)
+                            st.bar_chart(tabla.head(50))
+                            st.dataframe(tabla, use_container_width=True)
+
+                            # Detalle: filas del resultado de un valor de la tabla
+                            valor = st.selectbox(f"Ver filas de {dim_filas}",
+                                                 list(tabla.index),
+                                                 key=f'cubo_valor_{name}')
+                            posiciones = cubo.filas({dim_filas: [valor]})
+                            st.caption(
+                                f"{len(posiciones)} fila(s) con {dim_filas} = "
+                                f"{valor} (se muestran hasta 500)")
+                            st.dataframe(detalle(df_out, posiciones[:500]),
+                                         use_container_width=True)
+
+                    if st.session_state.origenes[name][1] == 'Base Fallas NCR' and \
+                            st.session_state.matriz_ncr is not None:
+                        with st.expander(
+                                "🧩 Matriz de compatibilidad de categorías"):
+                            st.caption(
+                                "Categoría NCR vs CATEGORY de TH. Se puede ajustar en "
+                                "la sección [compatibilidad_ncr] de atm_config.toml"
+                            )
+                            st.dataframe(st.session_state.matriz_ncr,
+                                         use_container_width=True)
 
             # Botón de descarga mejorado
             st.markdown("---")
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
-                # Generar archivo Excel con formato
-                buffer = io.BytesIO()
-                with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                    # Hoja de portada
-                    portada = pd.DataFrame({
-                        'Sistema de Gestión ATM': [
-                            'Reporte Generado',
-                            f'Fecha: {datetime.now().strftime("%d/%m/%Y %H:%M:%S")}',
-                            'Descripción: Resultados del procesamiento de Exclusiones-CMM, Base Fallas y Base Fallas NCR',
-                            'Generado por: Sistema Automatizado v2.0',
-                            f'Tolerancia utilizada: {tol} minutos',
-                            f'Archivo: Resultados_ATM_Formateado.xlsx'
-                        ]
-                    })
-                    portada.to_excel(writer, sheet_name='Portada', index=False)
-                    ws_portada = writer.sheets['Portada']
-                    ws_portada['A1'].font = Font(name='Arial',
-                                                 size=16,
-                                                 bold=True,
-                                                 color='00FF00')
-                    ws_portada['A1'].fill = PatternFill('solid',
-                                                        fgColor='004D40')
-                    for row in ws_portada['A2:A6']:
-                        for cell in row:
-                            cell.font = Font(name='Arial',
-                                             size=12,
-                                             color='000000')
-                    ws_portada.column_dimensions['A'].width = 80
-
-                    # Hojas de resultados con formato mejorado y diferenciado
-                    for name, df_out in st.session_state.resultados.items():
-                        # Obtener datos originales según el tipo
-                        if name == 'Exclusiones-CMM':
-                            df_in = excel.parse(excl)
-                        elif name == 'Base Fallas':
-                            df_in = excel.parse(base)
-                        else:  # Base Fallas NCR
-                            df_in = excel.parse(ncr)
-
-                        # Combinar datos originales con resultados
-                        df_comb = pd.concat([
-                            df_in.reset_index(drop=True),
-                            df_out.reset_index(drop=True)
-                        ],
-                                            axis=1)
-
-                        # Escribir al Excel
-                        df_comb.to_excel(writer,
-                                         sheet_name=name,
-                                         index=False,
-                                         startrow=2)
-                        ws = writer.sheets[name]
-
-                        # TÍTULO PRINCIPAL
-                        ws['A1'] = name
-                        ws['A1'].font = Font(name='Arial',
-                                             size=16,
-                                             bold=True,
-                                             color='FFFFFF')
-                        ws['A1'].fill = PatternFill('solid', fgColor='1F4E79')
-                        ws['A1'].alignment = Alignment(horizontal='center',
-                                                       vertical='center')
-                        ws.merge_cells(start_row=1,
-                                       start_column=1,
-                                       end_row=1,
-                                       end_column=df_comb.shape[1])
-
-                        # SUBTÍTULOS PARA DIFERENCIAR SECCIONES
-                        # Subtítulo para datos originales
-                        ws.merge_cells(start_row=2,
-                                       start_column=1,
-                                       end_row=2,
-                                       end_column=df_in.shape[1])
-                        ws['A2'] = "DATOS ORIGINALES"
-                        ws['A2'].font = Font(name='Arial',
-                                             size=12,
-                                             bold=True,
-                                             color='FFFFFF')
-                        ws['A2'].fill = PatternFill(
-                            'solid',
-                            fgColor='8B4513')  # Marrón para originales
-                        ws['A2'].alignment = Alignment(horizontal='center',
-                                                       vertical='center')
-
-                        # Subtítulo para resultados del procesamiento
-                        start_col_results = df_in.shape[1] + 1
-                        ws.merge_cells(start_row=2,
-                                       start_column=start_col_results,
-                                       end_row=2,
-                                       end_column=df_comb.shape[1])
-                        cell_results = ws.cell(row=2, column=start_col_results)
-                        cell_results.value = "RESULTADOS DEL PROCESAMIENTO"
-                        cell_results.font = Font(name='Arial',
-                                                 size=12,
-                                                 bold=True,
-                                                 color='FFFFFF')
-                        cell_results.fill = PatternFill(
-                            'solid', fgColor='0066CC')  # Azul para resultados
-                        cell_results.alignment = Alignment(horizontal='center',
-                                                           vertical='center')
-
-                        # ENCABEZADOS DE COLUMNAS (fila 3)
-                        for col_idx, cell in enumerate(ws[3], 1):
-                            if col_idx <= df_in.shape[1]:
-                                # Encabezados de datos originales
-                                cell.font = Font(name='Arial',
-                                                 size=10,
-                                                 bold=True,
-                                                 color='FFFFFF')
-                                cell.fill = PatternFill(
-                                    'solid',
-                                    fgColor='A0522D')  # Marrón más claro
-                                cell.alignment = Alignment(horizontal='center',
-                                                           vertical='center',
-                                                           wrap_text=True)
-                            else:
-                                # Encabezados de resultados
-                                cell.font = Font(name='Arial',
-                                                 size=10,
-                                                 bold=True,
-                                                 color='FFFFFF')
-                                cell.fill = PatternFill(
-                                    'solid',
-                                    fgColor='4A90E2')  # Azul más claro
-                                cell.alignment = Alignment(horizontal='center',
-                                                           vertical='center',
-                                                           wrap_text=True)
-
-                            # Borde para todos los encabezados
-                            cell.border = Border(left=Side(style='thin',
-                                                           color='000000'),
-                                                 right=Side(style='thin',
-                                                            color='000000'),
-                                                 top=Side(style='thin',
-                                                          color='000000'),
-                                                 bottom=Side(style='medium',
-                                                             color='000000'))
-
-                        # DATOS (desde fila 4 en adelante)
-                        for row_idx in range(4, len(df_comb) + 4):
-                            for col_idx in range(1, df_comb.shape[1] + 1):
-                                cell = ws.cell(row=row_idx, column=col_idx)
-
-                                # Aplicar formato según si es dato original o resultado
-                                if col_idx <= df_in.shape[1]:
-                                    # Datos originales - tonos beige/marrones claros
-                                    if row_idx % 2 == 0:
-                                        cell.fill = PatternFill(
-                                            'solid',
-                                            fgColor='F5F5DC')  # Beige claro
-                                    else:
-                                        cell.fill = PatternFill(
-                                            'solid', fgColor='FAEBD7'
-                                        )  # Beige más claro
-                                    cell.font = Font(
-                                        name='Arial', size=9,
-                                        color='2F4F4F')  # Texto gris oscuro
-                                else:
-                                    # Resultados del procesamiento - tonos azules claros
-                                    if row_idx % 2 == 0:
-                                        cell.fill = PatternFill(
-                                            'solid',
-                                            fgColor='E6F3FF')  # Azul muy claro
-                                    else:
-                                        cell.fill = PatternFill(
-                                            'solid',
-                                            fgColor='CCE7FF')  # Azul claro
-                                    cell.font = Font(
-                                        name='Arial',
-                                        size=9,
-                                        color='003366',
-                                        bold=True
-                                    )  # Texto azul oscuro y negrita
-
-                                # Alineación y bordes
-                                cell.alignment = Alignment(horizontal='center',
-                                                           vertical='center')
-                                cell.border = Border(
-                                    left=Side(style='thin', color='CCCCCC'),
-                                    right=Side(style='thin', color='CCCCCC'),
-                                    top=Side(style='thin', color='CCCCCC'),
-                                    bottom=Side(style='thin', color='CCCCCC'))
-
-                        # AJUSTAR ANCHO DE COLUMNAS
-                        for col_idx in range(1, df_comb.shape[1] + 1):
-                            # Calcular ancho basado en contenido
-                            max_length = 0
-                            column_letter = get_column_letter(col_idx)
-
-                            # Revisar encabezado
-                            header_length = len(
-                                str(
-                                    ws.cell(row=3, column=col_idx).value
-                                    or ''))
-                            max_length = max(max_length, header_length)
-
-                            # Revisar datos (solo primeras 100 filas para performance)
-                            for row_idx in range(4, min(len(df_comb) + 4,
-                                                        104)):
-                                cell_value = ws.cell(row=row_idx,
-                                                     column=col_idx).value
-                                if cell_value is not None:
-                                    max_length = max(max_length,
-                                                     len(str(cell_value)))
-
-                            # Establecer ancho (mínimo 12, máximo 50)
-                            adjusted_width = min(max(max_length + 2, 12), 50)
-                            ws.column_dimensions[
-                                column_letter].width = adjusted_width
-
-                        # CONGELAR PANELES
-                        ws.freeze_panes = 'A4'  # Congelar desde la fila 4 (después de títulos y encabezados)
-
-                        # LÍNEA DIVISORIA VERTICAL entre datos originales y resultados
-                        for row_idx in range(2, len(df_comb) + 4):
-                            separator_col = df_in.shape[1] + 1
-                            cell = ws.cell(row=row_idx, column=separator_col)
-                            cell.border = Border(
-                                left=Side(
-                                    style='medium',
-                                    color='FF6600'),  # Línea naranja gruesa
-                                right=cell.border.right,
-                                top=cell.border.top,
-                                bottom=cell.border.bottom)
-
-                buffer.seek(0)
-
+                por_libro = False
+                if resumen is not None:
+                    por_libro = st.radio(
+                        "Reporte del lote",
+                        ["Consolidado (un Excel)", "Uno por libro (ZIP)"],
+                        key='reporte_lote',
+                        horizontal=True) == "Uno por libro (ZIP)"
+                solo_cambios = False
+                if cambios and not por_libro:
+                    solo_cambios = st.radio(
+                        "Contenido del reporte",
+                        ["Completo (con hoja Cambios)", "Solo cambios"],
+                        key='reporte_cambios',
+                        horizontal=True) == "Solo cambios"
+
+                # Datos originales de cada resultado (se leen solo al exportar)
+                cache = cache_etapas()
+                clave_cambios = getattr(st.session_state.cambios, 'clave', None)
+                huellas = st.session_state.huellas_resultados
+                fuentes = []
+                for name, df_out in st.session_state.resultados.items():
+                    libro, nombre, archivo, hoja = st.session_state.origenes[name]
+                    if isinstance(df_out, SpoolResultados):
+                        df_in = lambda archivo=archivo, hoja=hoja: \
+                            leer_hoja_por_bloques(archivo, hoja,
+                                                  filas_bloque, memoria_max)
+                    elif name in st.session_state.originales:
+                        df_in = lambda guardado=st.session_state.originales[name], \
+                                archivo=archivo, hoja=hoja: \
+                            guardado.leer() if guardado.disponible else \
+                            pd.read_excel(archivo, hoja)
+                    else:
+                        df_in = lambda archivo=archivo, hoja=hoja: \
+                            pd.read_excel(archivo, hoja)
+                    if isinstance(df_out, ResultadoGuardado):
+                        df_out = df_out.leer
+                    fuentes.append((name, libro, nombre, df_in, df_out))
+
+                # Generar archivo Excel con formato (escritura fila por fila)
+                def generar_reporte():
+                    secciones = {}
+                    for name, libro, nombre, df_in, df_out in fuentes:
+                        if por_libro:
+                            secciones.setdefault(libro, []).append(
+                                (nombre, df_in, df_out))
+                        else:
+                            secciones.setdefault(None, []).append(
+                                (name, df_in, df_out))
+
+                    if por_libro:
+                        return reportes_por_libro(secciones, tol, resumen)
+                    # openpyxl se carga recién al generar el primer reporte
+                    from utils.reporte import escribir_reporte
+                    inicio_reporte = perf_counter()
+                    buffer = io.BytesIO()
+                    escribir_reporte(buffer,
+                                     [] if solo_cambios else secciones.get(None, []),
+                                     tol, resumen=resumen, cambios=cambios)
+                    registrar_reporte(buffer.tell(),
+                                      perf_counter() - inicio_reporte, 'app')
+                    return buffer.getvalue()
+
+                # Se genera al hacer clic y se reutiliza mientras no cambien
+                # los resultados
+                def reporte_excel():
+                    return Pipeline(cache).agregar(
+                        'Reporte',
+                        generar_reporte,
+                        claves=[huellas, tol, por_libro, clave_cambios,
+                                solo_cambios]).resultado('Reporte')
+
+                marca = datetime.now().strftime('%Y%m%d_%H%M%S')
                 st.download_button(
                     label="📥 DESCARGAR RESULTADOS FORMATEADOS",
-                    data=buffer,
-                    file_name=
-                    f"Resultados_ATM_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                    mime=
+                    data=reporte_excel,
+                    file_name=f"Resultados_ATM_{marca}.zip" if por_libro else
+                    f"Cambios_ATM_{marca}.xlsx" if solo_cambios else
+                    f"Resultados_ATM_{marca}.xlsx",
+                    mime="application/zip" if por_libro else
                     "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     use_container_width=True)
+
+                # Exportación sin estilos para otros sistemas (por bloques)
+                st.markdown("**📦 Datos para otros sistemas**")
+                c1, c2 = st.columns(2)
+                with c1:
+                    formato = st.selectbox(
+                        "Formato",
+                        list(FORMATOS),
+                        format_func=lambda f: FORMATOS[f][1],
+                        key='exportar_formato')
+                with c2:
+                    con_originales = st.checkbox(
+                        "Incluir datos originales",
+                        key='exportar_originales',
+                        help="Une cada resultado con su hoja de origen, como "
+                        "el reporte Excel")
+
+                def datos_exportados():
+                    secciones = [(name, df_in if con_originales else None,
+                                  df_out)
+                                 for name, _, _, df_in, df_out in fuentes]
+                    return Pipeline(cache).agregar(
+                        'Exportación',
+                        lambda: paquete_exportacion(secciones, formato),
+                        claves=[huellas, formato, con_originales]).resultado(
+                            'Exportación')
+
+                st.download_button(
+                    label="📦 DESCARGAR DATOS (ZIP)",
+                    data=datos_exportados,
+                    file_name=f"Datos_ATM_{marca}.zip",
+                    mime="application/zip",
+                    use_container_width=True)
         else:
             st.info("🔄 **No hay resultados disponibles.**")
             st.markdown("""
@@ -837,6 +1003,7 @@ def main():
 
         #### 1. 📁 **Carga de Archivos**
         - **Datos ATM (Excel)**: Archivo principal con datos de ATMs
+        - **Modo lote**: carga varios archivos de datos ATM (por región o mes) y se procesan todos contra el mismo TH, indexado una sola vez
         - **TH Downtime (Excel)**: Archivo con registros de tiempo de inactividad
         - Los archivos deben estar en formato Excel (.xlsx o .xls)
 
@@ -862,7 +1029,7 @@ def main():
             st.markdown("""
             **⚡ Base Fallas**
             - Procesamiento de fallas generales
-            - Matching con últimos registros TH
+            - Matching con último registro TH global o a la fecha de la falla
             - Categorización por tipo de falla
             """)
 
@@ -876,14 +1043,16 @@ def main():
 
         st.markdown("""
         #### 4. 📊 **Resultados**
-        - Visualización en tablas interactivas
+        - Visualización paginada con orden y filtro por estado
         - Métricas de resumen por cada procesamiento
+        - Análisis por ATM, día, categoría y estado: tablas dinámicas y gráficos con el detalle de las filas de cada valor
         - Descarga en formato Excel con formato profesional
 
         #### 5. 📥 **Descarga**
         - Archivo Excel con múltiples hojas
         - Formato profesional con colores y estilos
         - Hoja de portada con información del reporte
+        - **Datos para otros sistemas**: ZIP con un archivo Parquet, CSV comprimido o Arrow por resultado (sin estilos, mucho más rápido que el Excel)
 
         ---
 
@@ -927,5 +1096,7 @@ def main():
         """)
 
 
-# Ejecutar la aplicación directamente
-main()
+# Ejecutar la aplicación directamente (streamlit run main.py); al
+# importarla desde streamlit_app.py no se ejecuta dos veces
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""
+Almacén de resultados comprimidos con vencimiento (TTL) y tope de memoria
+"""
+import io
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.config import seccion_config
+
+# Tipos Arrow que vuelven de Parquet como las mismas columnas object de pandas
+_TIPOS_OBJECT = (pa.types.is_string, pa.types.is_large_string, pa.types.is_null,
+                 pa.types.is_time)
+
+
+def _tabla_exacta(df):
+    """
+    Tabla Arrow del DataFrame si la ida y vuelta por Parquet es exacta
+
+    Las columnas object con tipos mezclados, los NaN en columnas de texto
+    (volverían como None) o los nombres de columna no textuales hacen que
+    se use pickle en su lugar.
+
+    Returns:
+        pa.Table: None si el DataFrame no es representable sin pérdida
+    """
+    if not all(isinstance(c, str) for c in df.columns) or df.columns.has_duplicates:
+        return None
+    objetos = df.columns[df.dtypes == object]
+    for col in objetos:
+        nulos = df[col][df[col].isna()]
+        if any(v is not None for v in nulos):
+            return None
+    try:
+        tabla = pa.Table.from_pandas(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError,
+            TypeError, ValueError):
+        return None
+    for col in objetos:
+        tipo = tabla.schema.field(col).type
+        if not any(es(tipo) for es in _TIPOS_OBJECT):
+            return None
+    return tabla
+
+
+def comprimir(valor):
+    """
+    Serializa un valor comprimido con zstd
+
+    Los DataFrames representables sin pérdida se guardan en Parquet
+    (columnar, con diccionarios para textos repetidos); el resto, con
+    pickle.
+
+    Returns:
+        tuple: (formato, bytes, tamaño sin comprimir)
+    """
+    if isinstance(valor, pd.DataFrame):
+        tabla = _tabla_exacta(valor)
+        if tabla is not None:
+            buffer = io.BytesIO()
+            pq.write_table(tabla, buffer, compression='zstd')
+            return 'parquet', buffer.getvalue(), None
+    datos = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+    return 'pickle', pa.compress(datos, codec='zstd', asbytes=True), len(datos)
+
+
+def descomprimir(formato, datos, tamano):
+    """
+    Inverso de comprimir
+    """
+    if formato == 'parquet':
+        return pq.read_table(pa.BufferReader(datos)).to_pandas()
+    return pickle.loads(pa.decompress(datos, tamano, codec='zstd', asbytes=True))
+
+
+class ResultadoGuardado:
+    """
+    Referencia a un valor del almacén (lo único que se guarda en la sesión)
+    """
+
+    def __init__(self, almacen, clave):
+        self.almacen = almacen
+        self.clave = clave
+
+    @property
+    def disponible(self):
+        return self.clave in self.almacen
+
+    def cargar(self):
+        """
+        Valor descomprimido (compartido entre reruns; None si venció)
+        """
+        return self.almacen.abrir(self.clave)
+
+    def leer(self):
+        """
+        Copia propia del valor, sin ocupar un lugar entre los abiertos
+        (para exportaciones); None si venció
+        """
+        return self.almacen.obtener(self.clave)
+
+    def derivado(self, nombre, construir):
+        """
+        Objeto construido a partir del valor (p. ej. un VisorResultados),
+        que se conserva mientras el valor siga abierto
+
+        Returns:
+            None si el valor venció
+        """
+        return self.almacen.derivado(self.clave, nombre, construir)
+
+
+class AlmacenResultados:
+    """
+    Resultados comprimidos compartidos por todas las sesiones del proceso
+
+    Cada valor se guarda una vez por huella (Parquet/zstd o pickle/zstd) y
+    las sesiones solo conservan un ResultadoGuardado. Los valores se
+    descomprimen al verlos y los últimos abiertos quedan en memoria
+    (max_abiertos). Un valor sin uso durante ttl_minutos vence; si el total
+    comprimido supera max_mb se descartan los menos usados o, con un
+    directorio configurado, se pasan a disco.
+    """
+
+    def __init__(self, ttl_minutos=60, max_mb=512, max_abiertos=4, directorio=None):
+        """
+        Args:
+            ttl_minutos (float): Minutos sin uso hasta que un valor vence
+                (None = sin vencimiento)
+            max_mb (float): Tope de bytes comprimidos en memoria
+            max_abiertos (int): Valores descomprimidos a conservar
+            directorio (str): Carpeta para los valores que exceden el tope
+                (opcional)
+        """
+        self.ttl = ttl_minutos * 60 if ttl_minutos else None
+        self.max_bytes = int(max_mb * 2**20)
+        self.max_abiertos = max_abiertos
+        self.directorio = directorio
+        # clave -> [formato, datos (None = en disco), tamaño, último acceso]
+        self._entradas = OrderedDict()
+        # clave -> {'valor': ..., derivados...}
+        self._abiertos = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+    @classmethod
+    def desde_config(cls, config=None):
+        """
+        Crea el almacén según la sección [almacen] de atm_config.toml
+        """
+        seccion = seccion_config('almacen', config)
+        return cls(seccion.get('ttl_minutos', 60), seccion.get('max_mb', 512),
+                   int(seccion.get('max_abiertos', 4)),
+                   seccion.get('directorio') or None)
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f'{clave}.bin')
+
+    def __contains__(self, clave):
+        with self._lock:
+            self._purgar()
+            return clave in self._entradas
+
+    def __len__(self):
+        return len(self._entradas)
+
+    @property
+    def bytes_en_memoria(self):
+        """
+        Bytes comprimidos que ocupan los valores en memoria
+        """
+        return self._bytes
+
+    def guardar(self, clave, valor, abrir=False):
+        """
+        Guarda un valor (si la huella ya está, solo renueva su vencimiento)
+
+        Args:
+            clave (str): Huella del valor
+            valor: DataFrame u otro valor serializable
+            abrir (bool): Dejar además el valor recibido entre los abiertos,
+                para verlo sin descomprimirlo (no debe modificarse después)
+
+        Returns:
+            ResultadoGuardado: Referencia para la sesión
+        """
+        with self._lock:
+            existe = clave in self._entradas
+            if existe:
+                self._tocar(clave)
+        if not existe:
+            # La compresión se hace fuera del lock: otras sesiones siguen leyendo
+            formato, datos, tamano = comprimir(valor)
+            with self._lock:
+                if clave not in self._entradas:
+                    self._entradas[clave] = [formato, datos, tamano, time.monotonic()]
+                    self._bytes += len(datos)
+                self._tocar(clave)
+                self._purgar()
+                self._liberar()
+        if abrir:
+            with self._lock:
+                self._abrir(clave, valor)
+        return ResultadoGuardado(self, clave)
+
+    def obtener(self, clave, defecto=None):
+        """
+        Copia nueva del valor (para quien pueda modificarla, como las etapas
+        del procesamiento); defecto si no está o venció
+        """
+        with self._lock:
+            self._purgar()
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return defecto
+            self._tocar(clave)
+            formato, datos, tamano, _ = entrada
+        if datos is None:
+            try:
+                with open(self._ruta(clave), 'rb') as f:
+                    datos = f.read()
+            except OSError:
+                self.descartar(clave)
+                return defecto
+        return descomprimir(formato, datos, tamano)
+
+    def abrir(self, clave):
+        """
+        Valor descomprimido compartido (para verlo); None si no está o venció
+        """
+        with self._lock:
+            if clave in self._abiertos and clave in self:
+                self._abiertos.move_to_end(clave)
+                self._tocar(clave)
+                return self._abiertos[clave]['valor']
+        valor = self.obtener(clave)
+        if valor is None:
+            return None
+        with self._lock:
+            return self._abrir(clave, valor)
+
+    def derivado(self, clave, nombre, construir):
+        """
+        Objeto derivado de un valor abierto, construido una sola vez
+        """
+        valor = self.abrir(clave)
+        if valor is None:
+            return None
+        with self._lock:
+            abierto = self._abiertos.get(clave)
+            if abierto is not None and nombre in abierto:
+                return abierto[nombre]
+        derivado = construir(valor)
+        with self._lock:
+            if clave in self._abiertos:
+                derivado = self._abiertos[clave].setdefault(nombre, derivado)
+        return derivado
+
+    def descartar(self, clave):
+        """
+        Elimina un valor del almacén (y de disco)
+        """
+        with self._lock:
+            entrada = self._entradas.pop(clave, None)
+            self._abiertos.pop(clave, None)
+            if entrada is None:
+                return
+            if entrada[1] is not None:
+                self._bytes -= len(entrada[1])
+            elif self.directorio and os.path.exists(self._ruta(clave)):
+                os.remove(self._ruta(clave))
+
+    def _abrir(self, clave, valor):
+        abierto = self._abiertos.setdefault(clave, {'valor': valor})
+        self._abiertos.move_to_end(clave)
+        while len(self._abiertos) > self.max_abiertos:
+            self._abiertos.popitem(last=False)
+        return abierto['valor']
+
+    def _tocar(self, clave):
+        self._entradas[clave][3] = time.monotonic()
+        self._entradas.move_to_end(clave)
+
+    def _purgar(self):
+        """
+        Descarta los valores vencidos (el orden LRU deja los más viejos primero)
+        """
+        if self.ttl is None:
+            return
+        limite = time.monotonic() - self.ttl
+        while self._entradas:
+            clave, entrada = next(iter(self._entradas.items()))
+            if entrada[3] > limite:
+                break
+            self.descartar(clave)
+
+    def _liberar(self):
+        """
+        Aplica el tope de memoria: pasa a disco (o descarta) los menos usados
+        """
+        for clave in list(self._entradas):
+            if self._bytes <= self.max_bytes:
+                break
+            entrada = self._entradas[clave]
+            if entrada[1] is None:
+                continue
+            if self.directorio:
+                temporal = f'{self._ruta(clave)}.{os.getpid()}.tmp'
+                with open(temporal, 'wb') as f:
+                    f.write(entrada[1])
+                os.replace(temporal, self._ruta(clave))
+                self._bytes -= len(entrada[1])
+                entrada[1] = None
+            else:
+                self.descartar(clave)
@@ -0,0 +1,152 @@
+"""
+Presupuesto de tiempo de arranque de la aplicación
+
+Uso:
+    python -m utils.arranque
+    python -m utils.arranque --limite 1.5 --limite-render 3 --repeticiones 5
+
+Mide, en procesos nuevos (como tras reiniciar el contenedor), el tiempo de
+importar main.py y el del primer render de streamlit_app.py, lista los
+módulos que más tardan en importarse y verifica que los módulos pesados
+que se cargan bajo demanda (openpyxl, el reporte Excel, el pipeline y el
+almacén con pyarrow.parquet) no se importen al arrancar ni en el primer
+render. Termina con código 1 si se excede algún presupuesto; el workflow
+.github/workflows/arranque.yml lo ejecuta en cada push.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LIMITE_IMPORTACION = 1.5  # segundos para importar main.py
+LIMITE_RENDER = 4.0       # segundos para el primer render (proceso nuevo)
+# Módulos que solo deben cargarse al cargar archivos, procesar o exportar
+MODULOS_DIFERIDOS = ['openpyxl', 'utils.reporte', 'utils.pipeline',
+                     'utils.procesamiento', 'utils.bloques', 'utils.exportacion',
+                     'utils.almacen', 'utils.vista_previa', 'pyarrow.parquet']
+
+_IMPORTAR = f"""
+import json, sys, time
+inicio = time.perf_counter()
+import main
+segundos = time.perf_counter() - inicio
+print(json.dumps({{'segundos': segundos,
+                  'cargados': [m for m in {MODULOS_DIFERIDOS!r} if m in sys.modules]}}))
+"""
+
+_RENDER = f"""
+import json, logging, sys, time
+logging.disable(logging.CRITICAL)
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file('streamlit_app.py', default_timeout=120)
+inicio = time.perf_counter()
+at.run()
+primero = time.perf_counter() - inicio
+inicio = time.perf_counter()
+at.run()
+print(json.dumps({{'primero': primero, 'rerun': time.perf_counter() - inicio,
+                  'errores': [str(e.value) for e in at.exception],
+                  'cargados': [m for m in {MODULOS_DIFERIDOS!r} if m in sys.modules]}}))
+"""
+
+
+def _python(codigo, *opciones):
+    proceso = subprocess.run([sys.executable, *opciones, '-c', codigo], cwd=RAIZ,
+                             capture_output=True, text=True, check=True)
+    return json.loads(proceso.stdout.strip().splitlines()[-1]), proceso.stderr
+
+
+def modulos_lentos(importtime, top=10):
+    """
+    Paquetes de primer nivel con más tiempo propio de importación
+
+    Args:
+        importtime (str): Salida de python -X importtime
+        top (int): Cantidad de paquetes a devolver
+
+    Returns:
+        list: [(paquete, segundos)] de mayor a menor
+    """
+    tiempos = {}
+    for linea in importtime.splitlines():
+        if not linea.startswith('import time:') or 'self [us]' in linea:
+            continue
+        propio, _, modulo = linea[len('import time:'):].split('|')
+        paquete = modulo.strip().split('.')[0]
+        tiempos[paquete] = tiempos.get(paquete, 0) + int(propio) / 1e6
+    return sorted(tiempos.items(), key=lambda t: -t[1])[:top]
+
+
+def medir_arranque(repeticiones=3, render=True):
+    """
+    Mide el arranque en frío en procesos nuevos
+
+    Args:
+        repeticiones (int): Mediciones por métrica (se informa la mínima)
+        render (bool): Medir también el primer render con AppTest
+
+    Returns:
+        dict: 'importacion' y 'render' (segundos), 'rerun' (segundos),
+            'cargados' (módulos diferidos presentes al arrancar o tras el
+            primer render),
+            'lentos' ([(paquete, segundos)]) y 'errores'
+    """
+    importaciones, cargados = [], set()
+    for _ in range(repeticiones):
+        datos, _ = _python(_IMPORTAR)
+        importaciones.append(datos['segundos'])
+        cargados.update(datos['cargados'])
+    _, importtime = _python(_IMPORTAR, '-X', 'importtime')
+
+    informe = {'importacion': min(importaciones), 'cargados': sorted(cargados),
+               'lentos': modulos_lentos(importtime), 'render': None, 'rerun': None,
+               'errores': []}
+    if render:
+        renders = [_python(_RENDER)[0] for _ in range(repeticiones)]
+        informe['render'] = min(r['primero'] for r in renders)
+        informe['rerun'] = min(r['rerun'] for r in renders)
+        informe['errores'] = sorted({e for r in renders for e in r['errores']})
+        informe['cargados'] = sorted(cargados.union(*(r['cargados'] for r in renders)))
+    return informe
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Verifica el presupuesto de tiempo de arranque de la app')
+    parser.add_argument('--limite', type=float, default=LIMITE_IMPORTACION,
+                        help='Segundos máximos para importar main.py')
+    parser.add_argument('--limite-render', type=float, default=LIMITE_RENDER,
+                        help='Segundos máximos para el primer render')
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--sin-render', action='store_true',
+                        help='Medir solo la importación')
+    args = parser.parse_args(argv)
+
+    informe = medir_arranque(args.repeticiones, not args.sin_render)
+    fallas = []
+    print(f"Importación de main.py: {informe['importacion']:.2f} s "
+          f"(límite {args.limite} s)")
+    if informe['importacion'] > args.limite:
+        fallas.append('importación sobre el límite')
+    if informe['render'] is not None:
+        print(f"Primer render: {informe['render']:.2f} s (límite {args.limite_render} s), "
+              f"rerun: {informe['rerun']:.2f} s")
+        if informe['render'] > args.limite_render:
+            fallas.append('primer render sobre el límite')
+    if informe['cargados']:
+        fallas.append(f"módulos diferidos cargados al arrancar: {', '.join(informe['cargados'])}")
+    fallas += [f"error en el render: {e}" for e in informe['errores']]
+
+    print("\nPaquetes más lentos de importar (tiempo propio):")
+    for paquete, segundos in informe['lentos']:
+        print(f"  {paquete:<24} {segundos:.3f} s")
+    for falla in fallas:
+        print(f"FALLA {falla}")
+    return 1 if fallas else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,327 @@
+import math
+import os
+import shutil
+import tempfile
+import weakref
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.io.parsers import TextParser
+
+from utils.visor import columna_estado, metricas_resultado
+
+FILAS_BLOQUE_DEFECTO = 50_000
+FILAS_BLOQUE_MINIMO = 1_000
+FILAS_MUESTRA = 2_000  # primer bloque, usado para estimar el tamaño del resto
+
+# Un bloque convive en memoria con sus columnas auxiliares y con su resultado
+FACTOR_MEMORIA_BLOQUE = 4
+
+
+def _valor_celda(celda):
+    """
+    Convierte una celda de openpyxl igual que pd.read_excel
+    """
+    if celda.value is None:
+        return ''
+    if celda.data_type == 'e':
+        return np.nan
+    if celda.data_type == 'n' and isinstance(celda.value, float) \
+            and celda.value.is_integer():
+        return int(celda.value)
+    return celda.value
+
+
+def _rebobinar(archivo):
+    if hasattr(archivo, 'seek'):
+        archivo.seek(0)
+    return archivo
+
+
+def _parsear(encabezado, filas, inicio):
+    """
+    Arma un DataFrame con el mismo parser que usa pd.read_excel
+    """
+    ancho = len(encabezado)
+    datos = [encabezado] + [
+        (fila + [''] * (ancho - len(fila)))[:ancho] for fila in filas]
+    df = TextParser(datos, header=0, skip_blank_lines=False).read()
+    df.index = pd.RangeIndex(inicio, inicio + len(df))
+    return df
+
+
+def estimar_filas_bloque(muestra, memoria_max_mb, memoria_fija=0):
+    """
+    Estima cuántas filas de entrada caben por bloque en un presupuesto de memoria
+
+    Args:
+        muestra (pd.DataFrame): Primer bloque leído de la hoja
+        memoria_max_mb (float): Presupuesto total en MB
+        memoria_fija (int): Bytes ya ocupados (por ejemplo, el índice TH)
+
+    Returns:
+        int: Filas por bloque (al menos FILAS_BLOQUE_MINIMO)
+    """
+    if muestra.empty:
+        return FILAS_BLOQUE_DEFECTO
+    bytes_fila = muestra.memory_usage(deep=True).sum() / len(muestra)
+    disponible = memoria_max_mb * 2**20 - memoria_fija
+    filas = int(disponible // (bytes_fila * FACTOR_MEMORIA_BLOQUE))
+    return max(FILAS_BLOQUE_MINIMO, filas)
+
+
+def leer_hoja_por_bloques(archivo, hoja, filas_bloque=None, memoria_max_mb=None,
+                          memoria_fija=0):
+    """
+    Lee una hoja Excel por bloques de filas sin cargarla completa
+
+    Usa openpyxl en modo read-only y convierte las celdas igual que
+    pd.read_excel, de modo que la concatenación de los bloques equivale a
+    excel.parse(hoja). Los archivos .xls (no soportados por openpyxl) se
+    leen completos y se entregan en bloques.
+
+    Args:
+        archivo: Ruta o archivo subido
+        hoja (str): Nombre de la hoja
+        filas_bloque (int): Filas por bloque (None = según el presupuesto)
+        memoria_max_mb (float): Presupuesto de memoria para estimar el bloque
+        memoria_fija (int): Bytes ya ocupados fuera del bloque
+
+    Yields:
+        pd.DataFrame: Bloques con índice continuo respecto de la hoja
+    """
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    estimar = not filas_bloque and bool(memoria_max_mb)
+    if filas_bloque:
+        tamano = filas_bloque
+    elif estimar:
+        tamano = FILAS_MUESTRA
+    else:
+        tamano = FILAS_BLOQUE_DEFECTO
+
+    try:
+        wb = load_workbook(_rebobinar(archivo), read_only=True,
+                           data_only=True, keep_links=False)
+    except (InvalidFileException, KeyError, OSError):
+        df = pd.read_excel(_rebobinar(archivo), sheet_name=hoja)
+        if estimar:
+            tamano = estimar_filas_bloque(df.head(FILAS_MUESTRA),
+                                          memoria_max_mb, memoria_fija)
+        for inicio in range(0, len(df), tamano):
+            yield df.iloc[inicio:inicio + tamano]
+        return
+
+    try:
+        ws = wb[hoja]
+        ws.reset_dimensions()
+        encabezado = None
+        filas, vacias, inicio = [], [], 0
+        for celdas in ws.iter_rows():
+            fila = [_valor_celda(c) for c in celdas]
+            while fila and fila[-1] == '':
+                fila.pop()
+            if encabezado is None:
+                encabezado = fila
+                continue
+            # Las filas vacías al final de la hoja se descartan (como pd.read_excel)
+            if not fila:
+                vacias.append(fila)
+                continue
+            filas.extend(vacias)
+            vacias = []
+            filas.append(fila)
+            while len(filas) >= tamano:
+                bloque = _parsear(encabezado, filas[:tamano], inicio)
+                filas = filas[tamano:]
+                inicio += len(bloque)
+                if estimar:
+                    tamano = estimar_filas_bloque(bloque, memoria_max_mb,
+                                                  memoria_fija)
+                    estimar = False
+                yield bloque
+        if encabezado is not None and (filas or inicio == 0):
+            yield _parsear(encabezado, filas, inicio)
+    finally:
+        wb.close()
+
+
+def _tabla_arrow(df):
+    """
+    Convierte un bloque a Arrow; las columnas object con tipos mezclados
+    (p. ej. tickets numéricos y 'N/A') se guardan como texto
+    """
+    df = df.reset_index(drop=True)
+    for col in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def escribir_parquet(df, destino):
+    """
+    Escribe un resultado en formato Parquet
+
+    Args:
+        df (pd.DataFrame): Resultado del procesamiento
+        destino: Ruta o buffer binario de salida
+    """
+    pq.write_table(_tabla_arrow(df), destino)
+
+
+class SpoolResultados:
+    """
+    Resultados de un proceso guardados por bloques en archivos Parquet
+
+    Cada bloque procesado se escribe a disco y se descarta de memoria; las
+    métricas de resumen se acumulan al escribir, así que la pestaña
+    Resultados y el reporte no necesitan volver a leer todo el spool.
+
+    Los archivos se eliminan cuando el spool deja de estar referenciado
+    (por la caché de etapas y por cada sesión que lo muestra) o al salir
+    del intérprete; cerrar() los elimina antes.
+    """
+
+    def __init__(self, directorio=None):
+        """
+        Args:
+            directorio (str): Carpeta del spool (por defecto, una temporal)
+        """
+        self.directorio = directorio or tempfile.mkdtemp(prefix='atm_spool_')
+        os.makedirs(self.directorio, exist_ok=True)
+        self._finalizador = weakref.finalize(self, shutil.rmtree, self.directorio,
+                                             ignore_errors=True)
+        self.partes = []
+        self.filas_partes = []
+        self.columnas = None
+        self.columna_estado = None
+        self._por_estado = Counter()
+
+    def __len__(self):
+        return sum(self.filas_partes)
+
+    def escribir(self, df):
+        """
+        Agrega un bloque de resultados al spool
+        """
+        if self.columnas is None:
+            self.columnas = list(df.columns)
+            self.columna_estado = columna_estado(df)
+        if self.columna_estado:
+            self._por_estado.update(
+                df[self.columna_estado].value_counts(dropna=False).to_dict())
+        ruta = os.path.join(self.directorio, f'parte_{len(self.partes):05d}.parquet')
+        escribir_parquet(df, ruta)
+        self.partes.append(ruta)
+        self.filas_partes.append(len(df))
+
+    @property
+    def metricas(self):
+        """
+        Métricas de resumen acumuladas (mismo formato que VisorResultados)
+        """
+        por_estado = None
+        if self.columna_estado:
+            por_estado = {k: int(v) for k, v in self._por_estado.items()}
+        return metricas_resultado(len(self), len(self.columnas or []), por_estado)
+
+    def leer_bloque(self, i):
+        """
+        Lee el bloque i del spool
+        """
+        return pq.read_table(self.partes[i]).to_pandas()
+
+    def iter_bloques(self):
+        """
+        Recorre los bloques del spool en orden
+        """
+        for i in range(len(self.partes)):
+            yield self.leer_bloque(i)
+
+    __iter__ = iter_bloques
+
+    def pagina(self, numero, tamano):
+        """
+        Materializa una página leyendo solo los bloques que la contienen
+
+        Returns:
+            tuple: (DataFrame de la página, total de filas, total de páginas)
+        """
+        total = len(self)
+        paginas = max(1, math.ceil(total / tamano))
+        numero = min(max(1, numero), paginas)
+        inicio = (numero - 1) * tamano
+        fin = min(inicio + tamano, total)
+
+        trozos, offset = [], 0
+        for i, filas in enumerate(self.filas_partes):
+            if offset < fin and offset + filas > inicio:
+                bloque = self.leer_bloque(i)
+                trozos.append(bloque.iloc[max(inicio - offset, 0):fin - offset])
+            offset += filas
+        if not trozos:
+            return pd.DataFrame(columns=self.columnas), total, paginas
+        df = pd.concat(trozos)
+        df.index = pd.RangeIndex(inicio, inicio + len(df))
+        return df, total, paginas
+
+    def tomar(self, posiciones):
+        """
+        Materializa las filas indicadas leyendo solo los bloques que las contienen
+
+        Args:
+            posiciones (array): Posiciones ordenadas dentro del spool
+        """
+        posiciones = np.asarray(posiciones, dtype=np.int64)
+        limites = np.cumsum([0] + self.filas_partes)
+        trozos = []
+        for i in np.unique(np.searchsorted(limites, posiciones, side='right') - 1):
+            en_bloque = posiciones[(posiciones >= limites[i]) &
+                                   (posiciones < limites[i + 1])]
+            trozos.append(self.leer_bloque(i).iloc[en_bloque - limites[i]])
+        if not trozos:
+            return pd.DataFrame(columns=self.columnas)
+        df = pd.concat(trozos)
+        df.index = pd.Index(posiciones)
+        return df
+
+    def to_frame(self):
+        """
+        Carga el spool completo en memoria
+        """
+        if not self.partes:
+            return pd.DataFrame(columns=self.columnas)
+        return pd.concat(self.iter_bloques(), ignore_index=True)
+
+    def cerrar(self):
+        """
+        Elimina los archivos del spool
+        """
+        self._finalizador()
+        self.partes, self.filas_partes = [], []
+
+
+def procesar_por_bloques(procesar, bloques, th, spool=None, **kwargs):
+    """
+    Aplica un proceso bloque a bloque y guarda los resultados en un spool
+
+    Args:
+        procesar (callable): procesar_exclusiones_cmm, procesar_base_fallas, ...
+        bloques (iterable): Bloques de entrada (ver leer_hoja_por_bloques)
+        th (IndiceTH): Índice TH compartido por todos los bloques
+        spool (SpoolResultados): Spool destino (por defecto, uno nuevo)
+        **kwargs: Argumentos adicionales del proceso (tol, modo, matriz...)
+
+    Returns:
+        SpoolResultados: Spool con los resultados de todos los bloques
+    """
+    spool = spool or SpoolResultados()
+    for bloque in bloques:
+        spool.escribir(procesar(bloque, th, **kwargs))
+    return spool
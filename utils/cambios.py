@@ -0,0 +1,307 @@
+"""
+Reporte diferencial: filas que cambiaron desde la corrida anterior
+
+Cada corrida deja una instantánea compacta de sus resultados por proceso:
+una clave estable por fila (ATM + inicio + WO) con el estado, el ticket TH y
+la categoría. La corrida siguiente cruza su instantánea con la anterior por
+la clave (join por hash) y solo informa las filas nuevas, las resueltas (que
+ya no aparecen) y las que cambiaron de estado, ticket o categoría.
+
+Las instantáneas se guardan por libro de origen y proceso, de modo que dos
+libros distintos (p. ej. dos sucursales) no se comparan entre sí.
+"""
+import contextlib
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils.config import seccion_config
+from utils.cubo import COLUMNAS_CATEGORIA
+from utils.dedupe import huellas_filas
+from utils.procesamiento import normalizar_id
+from utils.visor import columna_estado
+
+TIPOS_CAMBIO = ['Nueva', 'Resuelta', 'Cambió estado']
+# Columnas comparadas entre corridas (textos, '' si no hay dato)
+SEGUIDAS = ['Estado', 'TK TH', 'Categoría']
+COLUMNAS_INSTANTANEA = ['clave', 'ATM', 'Inicio', 'WO'] + SEGUIDAS
+COLUMNAS_CAMBIOS = ['Cambio', 'ATM', 'Inicio', 'WO',
+                    'Estado anterior', 'Estado', 'TK TH anterior', 'TK TH',
+                    'Categoría anterior', 'Categoría']
+
+
+def fuente_libro(nombre_archivo):
+    """
+    Etiqueta estable del libro de origen a partir del nombre del archivo
+
+    Se quita la carpeta y la extensión y las fechas o números pasan a '#',
+    así el archivo de cada día (ATM_20240601.xlsx, ATM_20240602.xlsx) se
+    compara con el del día anterior y no con el de otro libro.
+    """
+    nombre = os.path.splitext(os.path.basename(str(nombre_archivo)))[0]
+    return re.sub(r'\d+', '#', nombre).strip() or None
+
+
+@contextlib.contextmanager
+def _bloqueo_archivo(ruta):
+    """
+    Bloqueo exclusivo entre procesos sobre un archivo .lock (POSIX o Windows)
+    """
+    with open(ruta, 'a+b') as f:
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _bloques(fuente):
+    """
+    DataFrames de una fuente (DataFrame, spool, función o iterable de bloques)
+    """
+    if callable(fuente) and not isinstance(fuente, pd.DataFrame):
+        fuente = fuente()
+    if isinstance(fuente, pd.DataFrame):
+        return [fuente]
+    if hasattr(fuente, 'iter_bloques'):
+        return fuente.iter_bloques()
+    return fuente
+
+
+def _texto(serie):
+    """
+    Serie como texto, con '' en lugar de los valores faltantes
+    """
+    return serie.astype(object).where(serie.notna(), '').astype(str)
+
+
+def _inicio(df):
+    """
+    Fecha y hora de inicio de cada fila de la hoja original (vectorizado;
+    mismas columnas que buscan los procesos: FECHA/HORA de inicio)
+    """
+    fechas = [c for c in df if 'FECHA' in str(c).upper()]
+    if not fechas:
+        return pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+    horas = [c for c in df if 'HORA' in str(c).upper()]
+    fini = next((c for c in fechas if 'INICI' in str(c).upper()), fechas[0])
+    hini = next((c for c in horas if 'INICI' in str(c).upper()),
+                horas[0] if horas else None)
+    inicio = pd.to_datetime(df[fini], errors='coerce').astype('datetime64[ns]') \
+        .dt.normalize()
+    if hini is None:
+        return inicio
+    texto = _texto(df[hini]).str.strip()
+    hora = pd.to_timedelta(texto.where(texto != '', None), errors='coerce')
+    # Horas leídas como fecha y hora (p. ej. 1900-01-01 08:30:00)
+    faltan = hora.isna() & (texto != '')
+    if faltan.any():
+        marca = pd.to_datetime(texto[faltan], errors='coerce', format='mixed')
+        hora[faltan] = marca - marca.dt.normalize()
+    return inicio + hora.fillna(pd.Timedelta(0))
+
+
+def _claves(originales):
+    """
+    ATM, inicio y WO de un bloque de la hoja original
+    """
+    atm = originales['ATM'] if 'ATM' in originales else \
+        pd.Series('', index=originales.index)
+    wo = originales['WO'] if 'WO' in originales else \
+        pd.Series('', index=originales.index)
+    return pd.DataFrame({'ATM': _texto(atm).str.strip(),
+                         'Inicio': _inicio(originales),
+                         'WO': _texto(wo).str.strip()})
+
+
+def _seguidas(resultados):
+    """
+    Estado, ticket TH y categoría de un bloque de resultados
+    """
+    estado = columna_estado(resultados)
+    categoria = next((c for c in COLUMNAS_CATEGORIA if c in resultados), None)
+    vacia = pd.Series('', index=resultados.index)
+    return pd.DataFrame({
+        'Estado': _texto(resultados[estado]) if estado else vacia,
+        'TK TH': _texto(resultados['TK TH']) if 'TK TH' in resultados else vacia,
+        'Categoría': _texto(resultados[categoria]) if categoria else vacia,
+    })
+
+
+def instantanea(originales, resultados):
+    """
+    Instantánea de una corrida para compararla con la siguiente
+
+    Las filas de resultados se alinean por posición con la hoja original,
+    de donde salen ATM, inicio y WO. Si dos filas comparten la clave se
+    distinguen por su número de aparición.
+
+    Args:
+        originales: Hoja original (DataFrame, función o bloques)
+        resultados: Resultados del proceso (DataFrame, spool o bloques)
+
+    Returns:
+        pd.DataFrame: Columnas COLUMNAS_INSTANTANEA, una fila por resultado
+    """
+    claves = [_claves(b) for b in _bloques(originales)]
+    seguidas = [_seguidas(b) for b in _bloques(resultados)]
+    claves = pd.concat(claves, ignore_index=True) if claves else \
+        _claves(pd.DataFrame())
+    seguidas = pd.concat(seguidas, ignore_index=True) if seguidas else \
+        _seguidas(pd.DataFrame())
+    n = min(len(claves), len(seguidas))
+    df = pd.concat([claves.iloc[:n], seguidas.iloc[:n]], axis=1)
+
+    norm = pd.DataFrame({'atm': normalizar_id(df['ATM']).fillna(df['ATM']),
+                         'inicio': df['Inicio'], 'wo': df['WO']})
+    norm['base'] = huellas_filas(norm, ['atm', 'inicio', 'wo'])
+    norm['ocurrencia'] = norm.groupby('base').cumcount()
+    df.insert(0, 'clave', huellas_filas(norm, ['base', 'ocurrencia']))
+    return df[COLUMNAS_INSTANTANEA]
+
+
+def diferencias(anterior, actual):
+    """
+    Filas nuevas, resueltas o con cambio de estado entre dos instantáneas
+
+    Args:
+        anterior (pd.DataFrame): Instantánea de la corrida anterior
+        actual (pd.DataFrame): Instantánea de esta corrida
+
+    Returns:
+        pd.DataFrame: Columnas COLUMNAS_CAMBIOS (sin WO si ningún proceso lo
+            tiene), ordenadas por tipo de cambio, ATM e inicio
+    """
+    unido = anterior.merge(actual, on='clave', how='outer',
+                           suffixes=(' anterior', ''), indicator=True)
+    cambio = np.zeros(len(unido), dtype=bool)
+    for col in SEGUIDAS:
+        cambio |= (unido[f'{col} anterior'] != unido[col]).to_numpy()
+    tipo = np.select([unido['_merge'] == 'right_only', unido['_merge'] == 'left_only',
+                      cambio], TIPOS_CAMBIO, default='')
+    unido = unido[tipo != ''].assign(Cambio=tipo[tipo != ''])
+    for col in ['ATM', 'Inicio', 'WO']:
+        unido[col] = unido[col].fillna(unido[f'{col} anterior'])
+    for col in SEGUIDAS:
+        unido[[f'{col} anterior', col]] = unido[[f'{col} anterior', col]].fillna('')
+
+    cambios = unido[COLUMNAS_CAMBIOS]
+    cambios = cambios.assign(
+        Cambio=pd.Categorical(cambios['Cambio'], categories=TIPOS_CAMBIO)) \
+        .sort_values(['Cambio', 'ATM', 'Inicio'], kind='stable') \
+        .astype({'Cambio': str}).reset_index(drop=True)
+    if not (cambios['WO'] != '').any():
+        cambios = cambios.drop(columns='WO')
+    return cambios
+
+
+def conteos(cambios):
+    """
+    Cantidad de filas por tipo de cambio (todos los tipos, aunque sean 0)
+    """
+    if cambios is None:
+        return dict.fromkeys(TIPOS_CAMBIO, 0)
+    por_tipo = cambios['Cambio'].value_counts()
+    return {tipo: int(por_tipo.get(tipo, 0)) for tipo in TIPOS_CAMBIO}
+
+
+class RegistroCorridas:
+    """
+    Última instantánea de cada libro y proceso, para comparar la corrida
+    siguiente
+
+    Con un directorio las instantáneas se guardan en Parquet
+    (<libro>__<proceso>.parquet) y sobreviven entre ejecuciones; sin él
+    quedan en memoria (p. ej. durante una sesión de la app). comparar()
+    lee y reemplaza la instantánea de una clave como una sola operación:
+    con un lock entre hilos y, con directorio, un archivo .lock entre
+    procesos que comparten la carpeta.
+    """
+
+    def __init__(self, directorio=None):
+        """
+        Args:
+            directorio (str): Carpeta de las instantáneas (opcional)
+        """
+        self.directorio = directorio
+        self._memoria = {}
+        self._lock = threading.Lock()
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+    @classmethod
+    def desde_config(cls, config=None):
+        """
+        Crea el registro según la sección [cambios] de atm_config.toml
+        """
+        return cls(seccion_config('cambios', config).get('directorio') or None)
+
+    @staticmethod
+    def clave(nombre, fuente=None):
+        """
+        Clave de la instantánea: libro de origen y proceso
+        """
+        return f'{fuente}__{nombre}' if fuente else nombre
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio, re.sub(r'[^\w-]+', '_', nombre) + '.parquet')
+
+    def anterior(self, nombre):
+        """
+        Instantánea de la corrida anterior de un proceso (None si no hay)
+        """
+        if not self.directorio:
+            return self._memoria.get(nombre)
+        try:
+            return pd.read_parquet(self._ruta(nombre))
+        except (OSError, ValueError):
+            return None
+
+    def guardar(self, nombre, actual):
+        """
+        Registra la instantánea de esta corrida (escritura atómica)
+        """
+        if not self.directorio:
+            self._memoria[nombre] = actual
+            return
+        temporal = f'{self._ruta(nombre)}.{os.getpid()}.tmp'
+        actual.to_parquet(temporal, index=False)
+        os.replace(temporal, self._ruta(nombre))
+
+    def comparar(self, nombre, originales, resultados, fuente=None):
+        """
+        Compara una corrida con la anterior y la deja registrada
+
+        Args:
+            nombre (str): Proceso (p. ej. 'Base Fallas')
+            originales: Hoja original (ver instantanea)
+            resultados: Resultados del proceso (ver instantanea)
+            fuente (str): Libro de origen (ver fuente_libro); sin él la
+                instantánea es solo por proceso
+
+        Returns:
+            pd.DataFrame: Cambios (ver diferencias); None si es la primera
+                corrida del proceso
+        """
+        actual = instantanea(originales, resultados)
+        clave = self.clave(nombre, fuente)
+        with self._lock, (_bloqueo_archivo(self._ruta(clave) + '.lock')
+                          if self.directorio else contextlib.nullcontext()):
+            previa = self.anterior(clave)
+            self.guardar(clave, actual)
+        return None if previa is None else diferencias(previa, actual)
@@ -0,0 +1,471 @@
+"""
+Prueba de carga de la aplicación Streamlit con sesiones concurrentes
+
+Uso:
+    python -m utils.carga --sesiones 8 --filas-th 20000 --filas-datos 5000
+    python -m utils.carga --sesiones 4 --perfil --limite-p95 30 --salida carga.json
+
+Cada sesión simulada maneja main.py con el AppTest de Streamlit como lo
+haría un analista: sube un TH y un libro ATM sintéticos, elige las hojas,
+procesa, mueve la tolerancia con los resultados en pantalla y descarga el
+reporte. Se mide la latencia de cada interacción (percentiles), la memoria
+residente y la CPU de las sesiones y, con --perfil, en qué funciones de la
+aplicación se va el tiempo de cada rerun.
+
+Todas las sesiones corren como hilos de un mismo proceso, igual que en un
+servidor de Streamlit: comparten el GIL, el almacén de resultados y el pool
+de lectura, así que las latencias incluyen la contención entre sesiones. El
+runtime de prueba de AppTest se reemplaza por uno único para todo el
+proceso (AppTest crea y descarta uno global en cada rerun). La memoria y la
+CPU son las del proceso, sin los procesos del pool de lectura; el
+incremento por sesión es (pico - base) / sesiones.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import warnings
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from streamlit.runtime.scriptrunner_utils.script_run_context import \
+    SCRIPT_RUN_CONTEXT_ATTR_NAME
+
+from utils.sinteticos import libros_sinteticos
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUTA_APP = os.path.join(RAIZ, 'main.py')
+MIME_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+INTERACCIONES = ['carga inicial', 'subir archivos', 'elegir hojas', 'procesar',
+                 'mover tolerancia', 'descargar reporte']
+PERCENTILES = [50, 90, 95, 99]
+INTERVALO_RECURSOS = 0.25  # segundos entre muestras de RSS y CPU
+INTERVALO_PERFIL = 0.005   # segundos entre muestras de pila
+
+
+# Perfil por muestreo
+
+class MuestreadorPila(threading.Thread):
+    """
+    Perfil por muestreo de las funciones de la aplicación
+
+    Cada INTERVALO_PERFIL toma la pila de todos los hilos del proceso y
+    cuenta las funciones de main.py y utils/ de los hilos que ejecutan el
+    script de una sesión, en la interacción en curso de esa sesión:
+    'inclusivo' cuenta cada función presente en la pila y 'propio', la
+    función de la aplicación más interna.
+    """
+
+    def __init__(self, intervalo=INTERVALO_PERFIL):
+        super().__init__(daemon=True)
+        self.intervalo = intervalo
+        self.interacciones = {}  # estado de la sesión (id) -> interacción en curso
+        self.inclusivo = Counter()
+        self.propio = Counter()
+        self.muestras = Counter()
+        self._detener = threading.Event()
+
+    def _funciones(self, frame):
+        funciones = []
+        while frame is not None:
+            archivo = frame.f_code.co_filename
+            if archivo.startswith(RAIZ) and '/utils/carga.py' not in archivo:
+                funciones.append(f"{os.path.relpath(archivo, RAIZ)}:"
+                                 f"{frame.f_code.co_name}")
+            frame = frame.f_back
+        return funciones
+
+    def _interaccion(self, id_hilo):
+        """
+        Interacción en curso de la sesión cuyo script corre en el hilo
+        """
+        hilo = threading._active.get(id_hilo)
+        contexto = getattr(hilo, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+        if contexto is None:
+            return None
+        return self.interacciones.get(id(contexto.session_state._state))
+
+    def run(self):
+        while not self._detener.wait(self.intervalo):
+            if not any(self.interacciones.values()):
+                continue
+            for hilo, frame in sys._current_frames().items():
+                interaccion = self._interaccion(hilo)
+                if interaccion is None:
+                    continue
+                self.muestras[interaccion] += 1
+                funciones = self._funciones(frame)
+                if funciones:
+                    self.propio[(interaccion, funciones[0])] += 1
+                    for funcion in set(funciones):
+                        self.inclusivo[(interaccion, funcion)] += 1
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+
+# Sesiones simuladas (hilos de un mismo proceso)
+
+_DESCARGAS = None  # descargas por sesión, una vez preparado el runtime
+
+def _preparar_runtime():
+    """
+    Instala un único runtime de prueba para todas las sesiones del proceso
+
+    AppTest asigna Runtime._instance al empezar cada rerun y lo vuelve a
+    None al terminar, y activa la opción global.appTest solo durante el
+    rerun; con varias sesiones a la vez, la que termina primero se los
+    quita a las demás. Aquí ambos quedan fijos para todo el proceso, y las
+    sesiones comparten el administrador de archivos y descargas y la caché
+    del script compilado, como en un servidor real (AppTest compila main.py
+    en cada rerun, y compilarlo en varios hilos a la vez falla en CPython
+    3.11 con "AST constructor recursion depth mismatch"). Los callables de
+    descarga diferida se registran por sesión, para poder "hacer clic" en
+    ellos fuera del navegador.
+
+    Returns:
+        dict: Estado de la sesión (id) -> {nombre de archivo: callable}
+    """
+    global _DESCARGAS
+    if _DESCARGAS is not None:
+        return _DESCARGAS
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import \
+        MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage('/mock/media'))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    config.get_config_options()
+    config._set_option('global.appTest', True, 'utils.carga')
+    compartida = ScriptCache()
+    ScriptCache.__init__ = lambda self: self.__dict__.update(
+        _cache=compartida._cache, _lock=compartida._lock)
+
+    descargas = {}
+    original = MediaFileManager.add_deferred
+
+    def add_deferred(self, data_callable, mimetype, coordinates, file_name=None, **kwargs):
+        contexto = get_script_run_ctx()
+        if contexto is not None:
+            descargas.setdefault(id(contexto.session_state._state), {})[file_name] = \
+                data_callable
+        return original(self, data_callable, mimetype, coordinates,
+                        file_name=file_name, **kwargs)
+
+    MediaFileManager.add_deferred = add_deferred
+    _DESCARGAS = descargas
+    return descargas
+
+
+def _sesion(numero, libro_th, libro_datos, tol, muestreador, descargas, timeout):
+    """
+    Recorre las interacciones de un analista
+
+    Returns:
+        dict: Número de sesión, tiempos por interacción y errores
+    """
+    from streamlit.testing.v1 import AppTest
+
+    tiempos, errores = [], []
+    at = AppTest.from_file(RUTA_APP, default_timeout=timeout)
+    clave = id(at._session_state._state)
+    ultima = ['carga inicial']
+
+    def medir(interaccion, accion):
+        ultima[0] = interaccion
+        if muestreador:
+            muestreador.interacciones[clave] = interaccion
+        inicio = time.perf_counter()
+        try:
+            resultado = accion()
+            if getattr(resultado, 'exception', None):
+                errores.append(f"{interaccion}: {resultado.exception[0].value}")
+        finally:
+            tiempos.append((interaccion, time.perf_counter() - inicio))
+            if muestreador:
+                muestreador.interacciones[clave] = None
+        return resultado
+
+    try:
+        medir('carga inicial', at.run)
+
+        at.file_uploader[0].set_value(('datos.xlsx', libro_datos, MIME_XLSX))
+        at.file_uploader[1].set_value(('th.xlsx', libro_th, MIME_XLSX))
+        medir('subir archivos', at.run)
+
+        at.selectbox(key='excl').set_value('CMM')
+        at.selectbox(key='base').set_value('BF')
+        at.selectbox(key='ncr').set_value('NCR')
+        medir('elegir hojas', at.run)
+
+        boton = next(b for b in at.button if 'INICIAR' in b.label)
+        boton.click()
+        medir('procesar', at.run)
+        if not at.session_state['resultados']:
+            errores.append('procesar: sin resultados')
+
+        at.slider(key='tol').set_value(tol)
+        medir('mover tolerancia', at.run)
+
+        reporte = next((f for nombre, f in descargas.get(clave, {}).items()
+                        if nombre and nombre.endswith('.xlsx')), None)
+        if reporte is None:
+            errores.append('descargar reporte: botón no encontrado')
+        else:
+            medir('descargar reporte', reporte)
+    except Exception as e:
+        # La sesión se interrumpe en la interacción que falló o en la siguiente
+        errores.append(f"{ultima[0]}: {e!r}")
+    return {'sesion': numero, 'tiempos': tiempos, 'errores': errores}
+
+
+# Recursos del proceso (Linux: /proc)
+
+def _leer_proc(pid):
+    """
+    (RSS en bytes, segundos de CPU) de un proceso; None si no está disponible
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        with open(f'/proc/{pid}/stat') as f:
+            campos = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(campos[11]) + int(campos[12])) / os.sysconf('SC_CLK_TCK')
+        return rss, cpu
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MonitorRecursos(threading.Thread):
+    """
+    Muestrea RSS y CPU del proceso de las sesiones
+    """
+
+    def __init__(self, pid=None, intervalo=INTERVALO_RECURSOS):
+        super().__init__(daemon=True)
+        self.pid = pid or os.getpid()
+        self.intervalo = intervalo
+        self.muestras = []  # (segundos, RSS, CPU acumulada, sesiones vivas)
+        self.vivas = 0
+        self._detener = threading.Event()
+
+    def run(self):
+        inicio = time.perf_counter()
+        while not self._detener.is_set():
+            lectura = _leer_proc(self.pid)
+            if lectura:
+                self.muestras.append((time.perf_counter() - inicio, *lectura, self.vivas))
+            self._detener.wait(self.intervalo)
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+
+# Informe
+
+def percentiles(tiempos):
+    """
+    Percentiles de latencia por interacción
+
+    Args:
+        tiempos (list): [(interacción, segundos)]
+
+    Returns:
+        pd.DataFrame: Una fila por interacción (n, p50, p90, p95, p99, máx.)
+    """
+    df = pd.DataFrame(tiempos, columns=['Interacción', 'Segundos'])
+    filas = []
+    for interaccion in INTERACCIONES:
+        valores = df.loc[df['Interacción'] == interaccion, 'Segundos'].to_numpy()
+        if not len(valores):
+            continue
+        fila = {'Interacción': interaccion, 'n': len(valores)}
+        fila.update({f'p{p}': round(float(np.percentile(valores, p)), 3)
+                     for p in PERCENTILES})
+        fila['máx.'] = round(float(valores.max()), 3)
+        filas.append(fila)
+    return pd.DataFrame(filas).set_index('Interacción') if filas else pd.DataFrame()
+
+
+def perfil_funciones(muestreadores, top=15):
+    """
+    Funciones de la aplicación con más tiempo por interacción
+
+    Args:
+        muestreadores (list): MuestreadorPila ya detenidos
+
+    Returns:
+        pd.DataFrame: Interacción, Función, % inclusivo y % propio (sobre
+            las muestras tomadas durante esa interacción)
+    """
+    inclusivo, propio, muestras = Counter(), Counter(), Counter()
+    for m in muestreadores:
+        inclusivo.update(m.inclusivo)
+        propio.update(m.propio)
+        muestras.update(m.muestras)
+    filas = [{'Interacción': interaccion, 'Función': funcion,
+              '% inclusivo': round(100 * n / muestras[interaccion], 1),
+              '% propio': round(100 * propio[(interaccion, funcion)] / muestras[interaccion], 1)}
+             for (interaccion, funcion), n in inclusivo.items()]
+    if not filas:
+        return pd.DataFrame()
+    df = pd.DataFrame(filas)
+    df['orden'] = df['Interacción'].map(INTERACCIONES.index)
+    df = df.sort_values(['orden', '% inclusivo'], ascending=[True, False])
+    return df.groupby('orden').head(top).drop(columns='orden').reset_index(drop=True)
+
+
+def ejecutar_carga(sesiones=4, filas_th=5000, filas_datos=2000, rampa=0.0,
+                   perfil=False, timeout=600, semilla=0):
+    """
+    Lanza sesiones concurrentes contra main.py y reúne las mediciones
+
+    Args:
+        sesiones (int): Sesiones simultáneas (hilos del proceso actual)
+        filas_th (int): Tickets del TH sintético
+        filas_datos (int): Filas por hoja del libro ATM sintético
+        rampa (float): Segundos entre el inicio de una sesión y la siguiente
+        perfil (bool): Muestrear las pilas para el perfil por función
+        timeout (float): Límite en segundos de cada rerun
+        semilla (int): Semilla de los libros y de las tolerancias
+
+    Returns:
+        dict: 'latencias' (DataFrame), 'recursos' (dict), 'perfil'
+            (DataFrame), 'errores' (list), 'segundos' (float)
+    """
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+
+    logging.disable(logging.CRITICAL)
+    warnings.filterwarnings('ignore')
+    if RAIZ not in sys.path:
+        sys.path.insert(0, RAIZ)
+    libro_th, libro_datos = libros_sinteticos(filas_th, filas_datos, semilla)
+    rng = np.random.default_rng(semilla)
+    tolerancias = [int(rng.choice(range(0, 125, 5))) for _ in range(sesiones)]
+    descargas = _preparar_runtime()
+
+    muestreador = MuestreadorPila() if perfil else None
+    if muestreador:
+        muestreador.start()
+    monitor = MonitorRecursos()
+    monitor.start()
+    base = _leer_proc(os.getpid())
+
+    def correr(numero):
+        monitor.vivas += 1
+        try:
+            return _sesion(numero, libro_th, libro_datos, tolerancias[numero],
+                           muestreador, descargas, timeout)
+        finally:
+            monitor.vivas -= 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sesiones, thread_name_prefix='sesion') as pool:
+        futuros = []
+        for numero in range(sesiones):
+            futuros.append(pool.submit(correr, numero))
+            if rampa:
+                time.sleep(rampa)
+        resultados, errores = [], []
+        for numero, futuro in enumerate(futuros):
+            try:
+                resultados.append(futuro.result())
+            except Exception as e:
+                errores.append(f"sesión {numero}: {e!r}")
+    segundos = time.perf_counter() - inicio
+    monitor.detener()
+    if muestreador:
+        muestreador.detener()
+
+    errores = [f"sesión {r['sesion']}: {e}" for r in resultados for e in r['errores']] + errores
+    pico = max((m[1] for m in monitor.muestras), default=0)
+    cpu_total = monitor.muestras[-1][2] - base[1] if base and monitor.muestras else 0
+    recursos = {
+        'RSS pico (MB)': round(pico / 2**20, 1),
+        'RSS base (MB)': round(base[0] / 2**20, 1) if base else None,
+        'Incremento RSS por sesión (MB)': round((pico - base[0]) / sesiones / 2**20, 1)
+        if base and pico else None,
+        'CPU total (s)': round(cpu_total, 1),
+        'Núcleos ocupados (promedio)': round(cpu_total / segundos, 2) if segundos else None,
+    }
+    return {
+        'latencias': percentiles([t for r in resultados for t in r['tiempos']]),
+        'recursos': recursos,
+        'perfil': perfil_funciones([muestreador]) if muestreador else pd.DataFrame(),
+        'errores': errores,
+        'segundos': segundos,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Prueba de carga de la app con sesiones concurrentes (AppTest)')
+    parser.add_argument('--sesiones', type=int, default=4)
+    parser.add_argument('--filas-th', type=int, default=5000)
+    parser.add_argument('--filas-datos', type=int, default=2000)
+    parser.add_argument('--rampa', type=float, default=0.0,
+                        help='Segundos entre el inicio de cada sesión')
+    parser.add_argument('--perfil', action='store_true',
+                        help='Perfil por muestreo de las funciones de la app')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='Límite en segundos de cada rerun')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--limite-p95', type=float,
+                        help='Falla (código 1) si el p95 de alguna interacción lo supera')
+    parser.add_argument('--salida', help='Archivo JSON con el informe')
+    args = parser.parse_args(argv)
+
+    informe = ejecutar_carga(args.sesiones, args.filas_th, args.filas_datos,
+                             args.rampa, args.perfil, args.timeout, args.semilla)
+    print(f"{args.sesiones} sesiones en {informe['segundos']:.1f} s\n")
+    print(informe['latencias'].to_string())
+    print()
+    for clave, valor in informe['recursos'].items():
+        print(f"{clave}: {valor}")
+    if not informe['perfil'].empty:
+        print()
+        print(informe['perfil'].to_string(index=False))
+    for error in informe['errores']:
+        print(f"ERROR {error}")
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump({
+                'sesiones': args.sesiones,
+                'segundos': informe['segundos'],
+                'latencias': informe['latencias'].reset_index().to_dict('records'),
+                'recursos': informe['recursos'],
+                'perfil': informe['perfil'].to_dict('records'),
+                'errores': informe['errores'],
+            }, f, ensure_ascii=False, indent=2)
+
+    lentas = []
+    if args.limite_p95 is not None and not informe['latencias'].empty:
+        lentas = informe['latencias'].index[
+            informe['latencias']['p95'] > args.limite_p95].tolist()
+        for interaccion in lentas:
+            print(f"p95 de '{interaccion}' sobre el límite de {args.limite_p95} s")
+    return 1 if informe['errores'] or lentas else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
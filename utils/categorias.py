@@ -0,0 +1,97 @@
+import re
+import numpy as np
+import pandas as pd
+
+from utils.config import seccion_config
+
+
+class MatrizCategoriasNCR:
+    """
+    Tabla de compatibilidad entre categorías NCR y valores CATEGORY de TH
+
+    Se construye una vez por ejecución sobre los valores distintos de CATEGORY.
+    Cada categoría NCR recibe un bit, y cada ticket TH una máscara con los bits
+    de las categorías NCR compatibles, de modo que el filtro por categoría
+    dentro del loop NCR es un AND entero.
+    """
+
+    def __init__(self, categorias_th, categorias_ncr, overrides=None):
+        """
+        Args:
+            categorias_th (pd.Series): Columna CATEGORY de TH
+            categorias_ncr (list): Categorías posibles de categoria_por_falla_ncr
+            overrides (dict): {categoria_ncr: {'agregar': [...], 'quitar': [...]}}
+                con valores CATEGORY de TH (sin distinguir mayúsculas)
+        """
+        self.categorias_ncr = list(dict.fromkeys(categorias_ncr))
+        if len(self.categorias_ncr) > 63:
+            raise ValueError("Se admiten como máximo 63 categorías NCR")
+        self.bits = {cat: 1 << i for i, cat in enumerate(self.categorias_ncr)}
+
+        valores = pd.Series(categorias_th).dropna()
+        valores = valores[valores.map(lambda v: isinstance(v, str))]
+        self.valores_th = list(pd.unique(valores))
+
+        self.tabla = self._construir_tabla(overrides or {})
+        pesos = np.array([self.bits[cat] for cat in self.categorias_ncr], dtype=np.int64)
+        self._mascara_por_valor = dict(zip(
+            self.valores_th,
+            (self.tabla.to_numpy(dtype=np.int64) * pesos[:, None]).sum(axis=0)
+        ))
+
+    @classmethod
+    def desde_config(cls, categorias_th, categorias_ncr, config=None):
+        """
+        Construye la matriz aplicando la sección [compatibilidad_ncr] de la configuración
+        """
+        return cls(categorias_th, categorias_ncr,
+                   overrides=seccion_config('compatibilidad_ncr', config))
+
+    def _construir_tabla(self, overrides):
+        """
+        Regla por defecto: el valor TH contiene la categoría NCR (igual que
+        str.contains(cat, case=False)); luego se aplican los overrides
+        """
+        tabla = pd.DataFrame(
+            [[re.search(cat, valor, flags=re.IGNORECASE) is not None
+              for valor in self.valores_th]
+             for cat in self.categorias_ncr],
+            index=pd.Index(self.categorias_ncr, name='Categoría NCR'),
+            columns=pd.Index(self.valores_th, name='CATEGORY TH'),
+            dtype=bool
+        )
+
+        por_clave = {}
+        for valor in self.valores_th:
+            por_clave.setdefault(valor.strip().upper(), []).append(valor)
+
+        for cat, regla in overrides.items():
+            if cat not in tabla.index:
+                raise ValueError(f"Categoría NCR desconocida en configuración: {cat}")
+            for accion, flag in (('agregar', True), ('quitar', False)):
+                for valor in regla.get(accion, []):
+                    for columna in por_clave.get(str(valor).strip().upper(), []):
+                        tabla.loc[cat, columna] = flag
+
+        return tabla
+
+    def bit(self, categoria_ncr):
+        """
+        Bit asignado a una categoría NCR (0 si no es una categoría conocida)
+        """
+        return self.bits.get(categoria_ncr, 0)
+
+    def mascaras(self, categorias_th):
+        """
+        Máscara de categorías NCR compatibles para cada ticket TH
+
+        Args:
+            categorias_th (pd.Series): Columna CATEGORY de TH
+
+        Returns:
+            np.ndarray: Máscara int64 por fila (0 para valores nulos o desconocidos)
+        """
+        codigos, unicos = pd.factorize(pd.Series(categorias_th), use_na_sentinel=True)
+        por_codigo = np.array(
+            [self._mascara_por_valor.get(v, 0) for v in unicos] + [0], dtype=np.int64)
+        return por_codigo[codigos]
@@ -0,0 +1,36 @@
+import os
+import tomllib
+
+# Archivo de configuración opcional en la raíz del repositorio;
+# la variable de entorno ATM_CONFIG permite apuntar a otro archivo
+RUTA_CONFIG_DEFECTO = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'atm_config.toml')
+
+
+def cargar_config(ruta=None):
+    """
+    Carga la configuración TOML del sistema
+
+    Args:
+        ruta (str): Ruta del archivo; por defecto ATM_CONFIG o atm_config.toml
+
+    Returns:
+        dict: Configuración cargada (vacía si el archivo no existe)
+    """
+    ruta = ruta or os.environ.get('ATM_CONFIG', RUTA_CONFIG_DEFECTO)
+    if not os.path.exists(ruta):
+        return {}
+
+    try:
+        with open(ruta, 'rb') as f:
+            return tomllib.load(f)
+    except tomllib.TOMLDecodeError as e:
+        raise Exception(f"Error leyendo configuración {ruta}: {str(e)}")
+
+
+def seccion_config(nombre, config=None):
+    """
+    Devuelve una sección de la configuración (dict vacío si no existe)
+    """
+    config = cargar_config() if config is None else config
+    return config.get(nombre, {}) or {}
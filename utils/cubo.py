@@ -0,0 +1,157 @@
+"""
+Cubo pre-agregado de un resultado: ATM × día × categoría × estado
+"""
+import numpy as np
+import pandas as pd
+
+from utils.visor import columna_estado
+
+DIMENSIONES = ['ATM', 'Día', 'Categoría', 'Estado']
+MEDIDAS = ['Registros', 'Horas']
+SIN_DATO = '(sin dato)'
+
+# Columnas de cada proceso que alimentan las dimensiones, en orden de preferencia
+COLUMNAS_CATEGORIA = ['Status Orig', 'Status', 'Status (Categoría)']
+# (inicio, fin): el día es el del inicio y las horas, la duración
+COLUMNAS_PERIODO = [('Ini Orig', 'Fin Orig'), ('Inicio TH', 'Fin TH'),
+                    ('Ini TH', 'Fin TH')]
+
+
+def detalle(resultado, posiciones):
+    """
+    Filas de un resultado (DataFrame o SpoolResultados) por posición
+    """
+    if isinstance(resultado, pd.DataFrame):
+        return resultado.iloc[posiciones]
+    return resultado.tomar(posiciones)
+
+
+def _bloques(resultado):
+    if isinstance(resultado, pd.DataFrame):
+        return [resultado]
+    return resultado.iter_bloques()
+
+
+class CuboDowntime:
+    """
+    Conteos y horas de downtime agregados por ATM, día, categoría y estado
+
+    Se construye una vez al terminar el procesamiento. Solo guarda las
+    celdas con datos (tabla agrupada) y, para cada celda, la lista de
+    filas del resultado que la forman: las tablas dinámicas se resuelven
+    sobre las celdas y el detalle se obtiene sin volver a recorrer el
+    resultado.
+    """
+
+    def __init__(self, codigos, etiquetas, horas):
+        """
+        Args:
+            codigos (dict): Dimensión -> código por fila (np.ndarray)
+            etiquetas (dict): Dimensión -> etiquetas de los códigos
+            horas (np.ndarray): Horas de downtime por fila (NaN = sin dato)
+        """
+        self.etiquetas = etiquetas
+        tamanos = [len(etiquetas[d]) for d in DIMENSIONES]
+        clave = np.ravel_multi_index([codigos[d] for d in DIMENSIONES], tamanos) \
+            if len(horas) else np.empty(0, dtype=np.int64)
+        celda_fila, claves = pd.factorize(clave, sort=True)
+
+        # Filas agrupadas por celda (listas contiguas dentro de self._filas)
+        self._filas = np.argsort(celda_fila, kind='stable')
+        registros = np.bincount(celda_fila, minlength=len(claves))
+        self._inicios = np.concatenate([[0], np.cumsum(registros)])
+
+        self.celdas = pd.DataFrame(
+            dict(zip(DIMENSIONES, np.unravel_index(claves, tamanos))))
+        self.celdas['Registros'] = registros
+        self.celdas['Horas'] = np.bincount(
+            celda_fila, weights=np.nan_to_num(horas), minlength=len(claves))
+
+    @classmethod
+    def desde_resultado(cls, resultado):
+        """
+        Construye el cubo de un resultado (DataFrame o SpoolResultados)
+        """
+        columnas = {d: [] for d in DIMENSIONES}
+        horas = []
+        for bloque in _bloques(resultado):
+            categoria = next((c for c in COLUMNAS_CATEGORIA if c in bloque), None)
+            estado = columna_estado(bloque)
+            inicio, fin = next((p for p in COLUMNAS_PERIODO
+                                if p[0] in bloque and p[1] in bloque), (None, None))
+            nulos = pd.Series(None, index=bloque.index, dtype=object)
+
+            ini = pd.to_datetime(bloque[inicio], errors='coerce') \
+                if inicio else pd.Series(pd.NaT, index=bloque.index)
+            columnas['ATM'].append(bloque['ATM'].astype(str) if 'ATM' in bloque else nulos)
+            columnas['Día'].append(ini.dt.normalize())
+            columnas['Categoría'].append(bloque[categoria] if categoria else nulos)
+            columnas['Estado'].append(bloque[estado] if estado else nulos)
+            if inicio:
+                duracion = pd.to_datetime(bloque[fin], errors='coerce') - ini
+                horas.append((duracion.dt.total_seconds() / 3600).clip(lower=0)
+                             .to_numpy(dtype=float))
+            else:
+                horas.append(np.full(len(bloque), np.nan))
+
+        codigos, etiquetas = {}, {}
+        for dimension, partes in columnas.items():
+            serie = pd.concat(partes, ignore_index=True) if partes else pd.Series([], dtype=object)
+            codigo, unicos = pd.factorize(serie, sort=True)
+            etiquetas[dimension] = list(unicos) + [SIN_DATO]
+            # Los valores faltantes (-1) van a la etiqueta SIN_DATO
+            codigos[dimension] = np.where(codigo < 0, len(unicos), codigo)
+        etiquetas['Día'] = [d.date() if isinstance(d, pd.Timestamp) else d
+                            for d in etiquetas['Día']]
+        return cls(codigos, etiquetas, np.concatenate(horas) if horas else np.empty(0))
+
+    def __len__(self):
+        return int(self.celdas['Registros'].sum())
+
+    def _seleccion(self, filtros):
+        mascara = np.ones(len(self.celdas), dtype=bool)
+        for dimension, valores in (filtros or {}).items():
+            codigos = [self.etiquetas[dimension].index(v) for v in valores
+                       if v in self.etiquetas[dimension]]
+            mascara &= self.celdas[dimension].isin(codigos).to_numpy()
+        return mascara
+
+    def tabla(self, filas, columnas=None, medida='Registros', filtros=None):
+        """
+        Tabla dinámica de una medida
+
+        Args:
+            filas (str): Dimensión de las filas
+            columnas (str): Dimensión de las columnas (None = solo totales)
+            medida (str): 'Registros' u 'Horas'
+            filtros (dict): Dimensión -> valores a incluir
+
+        Returns:
+            pd.DataFrame: Índice con las etiquetas de `filas`
+        """
+        celdas = self.celdas[self._seleccion(filtros)]
+        dimensiones = [filas] + ([columnas] if columnas else [])
+        agregado = celdas.groupby(dimensiones)[medida].sum()
+        if columnas:
+            agregado = agregado.unstack(columnas, fill_value=0)
+            agregado.columns = [self.etiquetas[columnas][c] for c in agregado.columns]
+        else:
+            agregado = agregado.to_frame()
+        agregado.index = pd.Index([self.etiquetas[filas][c] for c in agregado.index],
+                                  name=filas)
+        if medida == 'Horas':
+            agregado = agregado.round(2)
+        return agregado
+
+    def filas(self, filtros=None):
+        """
+        Posiciones (en el resultado) de las filas que cumplen los filtros
+
+        Returns:
+            np.ndarray: Posiciones ordenadas
+        """
+        celdas = np.flatnonzero(self._seleccion(filtros))
+        if not len(celdas):
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(
+            [self._filas[self._inicios[c]:self._inicios[c + 1]] for c in celdas]))
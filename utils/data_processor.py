@@ -1,30 +1,110 @@
+import sys
+import weakref
+
 import pandas as pd
 import numpy as np
 from datetime import datetime
-import streamlit as st
+
+from utils.ingesta import IngestaExcel
+from utils.dedupe import RegistroVistos, huellas_filas
+from utils.frame_backend import CleaningSpec, get_backend
+from utils.data_profile import (build_report, profile_downtime, profile_work_orders,
+                                use_approximate)
+
+
+def warn_in_app(issue):
+    """
+    Muestra un aviso de calidad con st.warning cuando se procesa dentro de la
+    app de Streamlit, como las validaciones anteriores; fuera de ella no hace
+    nada (la línea de comandos usa DataQualityReport.lines)
+    """
+    if 'streamlit' not in sys.modules:
+        return
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return
+    import streamlit as st
+    st.warning(issue.message)
+
 
 class DataProcessor:
     """
     Clase para procesar archivos Excel de órdenes de trabajo y downtime
     """
     
-    def __init__(self):
+    def __init__(self, seen_registry=None, backend=None, on_issue=warn_in_app):
+        """
+        Args:
+            seen_registry (RegistroVistos): Registro persistente de filas ya
+                procesadas; con él, cada carga solo procesa las filas nuevas
+                y las registra al llamar a commit_seen().
+                Por defecto se usa la sección [dedupe] de atm_config.toml
+                (sin esa sección no se filtra entre cargas)
+            backend (str): Motor de la limpieza, 'pandas' o 'polars' (ver
+                utils.frame_backend); por defecto, el de la sección
+                [dataframes] de atm_config.toml
+            on_issue (callable): Recibe cada aviso de calidad (QualityIssue)
+                al procesar un archivo; por defecto, warn_in_app. None para
+                no mostrarlos (quedan en self.profiles)
+        """
         self.required_work_order_columns = ['ATM_ID', 'Fecha_Hora', 'Descripcion']
         self.required_downtime_columns = ['ATM_ID', 'Fecha_Inicio', 'Fecha_Fin', 'Causa']
+        self.work_order_keys = ['ATM_ID', 'Fecha_Hora', 'Descripcion']
+        self.downtime_keys = ['ATM_ID', 'Fecha_Inicio', 'Fecha_Fin']
+        self.seen_registry = seen_registry if seen_registry is not None \
+            else RegistroVistos.desde_config()
+        self.backend = get_backend(backend)
+        self.skipped_rows = {}
+        self._pending_hashes = {}
+        # Perfil de calidad del último archivo de cada tipo (ver _profile)
+        self.profiles = {}
+        self._profiled = {}
+        self.on_issue = on_issue
+    
+    def process_files(self, work_orders_file, downtime_file):
+        """
+        Procesa ambos archivos leyéndolos en paralelo
+        
+        Args:
+            work_orders_file: Archivo Excel de órdenes de trabajo
+            downtime_file: Archivo Excel de downtime
+            
+        Returns:
+            tuple: (órdenes de trabajo, downtime) procesados; las filas nuevas
+                se registran como vistas solo al llamar a commit_seen()
+        """
+        ingesta = IngestaExcel()
+        ingesta.leer('work_orders', work_orders_file)
+        ingesta.leer('downtime', downtime_file)
+        ingesta.iniciar()
+        
+        try:
+            work_orders_df = ingesta.resultado('work_orders')
+        except Exception as e:
+            raise Exception(f"Error procesando archivo de órdenes de trabajo: {str(e)}")
+        work_orders_df = self.process_work_orders(work_orders_df)
+        
+        try:
+            downtime_df = ingesta.resultado('downtime')
+        except Exception as e:
+            raise Exception(f"Error procesando archivo de downtime: {str(e)}")
+        downtime_df = self.process_downtime(downtime_df)
+        
+        return work_orders_df, downtime_df
     
     def process_work_orders(self, file):
         """
         Procesa el archivo de órdenes de trabajo
         
         Args:
-            file: Archivo Excel cargado
+            file: Archivo Excel cargado (o DataFrame ya leído)
             
         Returns:
             pandas.DataFrame: DataFrame procesado con órdenes de trabajo
         """
         try:
             # Leer archivo Excel
-            df = pd.read_excel(file)
+            df = self._read_excel(file)
             
             # Verificar columnas requeridas
             self._validate_columns(df, self.required_work_order_columns, "órdenes de trabajo")
@@ -32,9 +112,12 @@ class DataProcessor:
             # Limpiar y procesar datos
             df = self._clean_work_orders_data(df)
             
-            # Validar datos procesados
-            self._validate_work_orders_data(df)
+            # Una carga incremental sin filas nuevas no es un error
+            if len(df) == 0 and self.skipped_rows.get('work_orders'):
+                return df
             
+            # Perfil de calidad (una pasada); sin filas válidas es un error
+            self._profile('work_orders', df)
             return df
             
         except Exception as e:
@@ -45,14 +128,14 @@ class DataProcessor:
         Procesa el archivo de registros de downtime
         
         Args:
-            file: Archivo Excel cargado
+            file: Archivo Excel cargado (o DataFrame ya leído)
             
         Returns:
             pandas.DataFrame: DataFrame procesado con registros de downtime
         """
         try:
             # Leer archivo Excel
-            df = pd.read_excel(file)
+            df = self._read_excel(file)
             
             # Verificar columnas requeridas
             self._validate_columns(df, self.required_downtime_columns, "downtime")
@@ -60,14 +143,25 @@ class DataProcessor:
             # Limpiar y procesar datos
             df = self._clean_downtime_data(df)
             
-            # Validar datos procesados
-            self._validate_downtime_data(df)
+            # Una carga incremental sin filas nuevas no es un error
+            if len(df) == 0 and self.skipped_rows.get('downtime'):
+                return df
             
+            # Perfil de calidad (una pasada); sin filas válidas es un error
+            self._profile('downtime', df)
             return df
             
         except Exception as e:
             raise Exception(f"Error procesando archivo de downtime: {str(e)}")
     
+    def _read_excel(self, file):
+        """
+        Lee el archivo Excel (los DataFrames ya leídos se usan tal cual)
+        """
+        if isinstance(file, pd.DataFrame):
+            return file
+        return pd.read_excel(file)
+    
     def _validate_columns(self, df, required_columns, file_type):
         """
         Valida que el DataFrame contenga las columnas requeridas
@@ -84,103 +178,129 @@ class DataProcessor:
     def _clean_work_orders_data(self, df):
         """
         Limpia y procesa los datos de órdenes de trabajo
-        """
-        # Crear una copia para no modificar el original
-        df = df.copy()
-        
-        # Limpiar ATM_ID
-        df['ATM_ID'] = df['ATM_ID'].astype(str).str.strip().str.upper()
         
-        # Convertir fecha_hora a datetime
-        df['Fecha_Hora'] = pd.to_datetime(df['Fecha_Hora'], errors='coerce')
-        
-        # Limpiar descripción
-        df['Descripcion'] = df['Descripcion'].astype(str).str.strip()
-        
-        # Eliminar filas con datos críticos faltantes
-        df = df.dropna(subset=['ATM_ID', 'Fecha_Hora'])
-        
-        # Eliminar duplicados
-        df = df.drop_duplicates(subset=['ATM_ID', 'Fecha_Hora', 'Descripcion'])
-        
-        return df
+        ATM_ID en mayúsculas, Fecha_Hora como fecha, sin filas sin ATM o
+        fecha, sin duplicados ni filas ya procesadas en cargas anteriores.
+        """
+        spec = CleaningSpec(upper=['ATM_ID'], text=['Descripcion'], dates=['Fecha_Hora'],
+                            required=['ATM_ID', 'Fecha_Hora'], keys=self.work_order_keys)
+        df = self.backend.clean(
+            df, spec, lambda df: self._filter_seen(df, 'work_orders', self.work_order_keys))
+        return self._keep_pending(df, 'work_orders')
     
     def _clean_downtime_data(self, df):
         """
         Limpia y procesa los datos de downtime
-        """
-        # Crear una copia para no modificar el original
-        df = df.copy()
-        
-        # Limpiar ATM_ID
-        df['ATM_ID'] = df['ATM_ID'].astype(str).str.strip().str.upper()
         
-        # Convertir fechas a datetime
-        df['Fecha_Inicio'] = pd.to_datetime(df['Fecha_Inicio'], errors='coerce')
-        df['Fecha_Fin'] = pd.to_datetime(df['Fecha_Fin'], errors='coerce')
-        
-        # Limpiar causa
-        df['Causa'] = df['Causa'].astype(str).str.strip()
-        
-        # Eliminar filas con datos críticos faltantes
-        df = df.dropna(subset=['ATM_ID', 'Fecha_Inicio', 'Fecha_Fin'])
+        Igual que las órdenes de trabajo, y además calcula Duracion_Horas y
+        descarta los registros con duración negativa o cero.
+        """
+        spec = CleaningSpec(upper=['ATM_ID'], text=['Causa'],
+                            dates=['Fecha_Inicio', 'Fecha_Fin'],
+                            required=['ATM_ID', 'Fecha_Inicio', 'Fecha_Fin'],
+                            keys=self.downtime_keys,
+                            duration=('Fecha_Inicio', 'Fecha_Fin', 'Duracion_Horas'))
+        df = self.backend.clean(
+            df, spec, lambda df: self._filter_seen(df, 'downtime', self.downtime_keys))
+        return self._keep_pending(df, 'downtime')
+    
+    def _filter_seen(self, df, kind, keys):
+        """
+        Marca las filas que no se procesaron en cargas anteriores
         
-        # Calcular duración del downtime en horas
-        df['Duracion_Horas'] = (df['Fecha_Fin'] - df['Fecha_Inicio']).dt.total_seconds() / 3600
+        Se llama con solo las claves normalizadas, antes del resto de la
+        limpieza. Las huellas de las filas nuevas quedan pendientes hasta que
+        quien usa los datos confirma la carga completa (ver commit_seen).
         
-        # Eliminar registros con duración negativa o cero
-        df = df[df['Duracion_Horas'] > 0]
+        Returns:
+            np.ndarray: Máscara de las filas nuevas
+        """
+        self.skipped_rows[kind] = 0
+        self._pending_hashes.pop(kind, None)
+        if self.seen_registry is None:
+            return np.ones(len(df), dtype=bool)
         
-        # Eliminar duplicados
-        df = df.drop_duplicates(subset=['ATM_ID', 'Fecha_Inicio', 'Fecha_Fin'])
+        hashes = huellas_filas(df, keys)
+        new = ~self.seen_registry.contiene(kind, hashes)
+        self.skipped_rows[kind] = int(len(df) - new.sum())
+        self._pending_hashes[kind] = pd.Series(hashes[new], index=df.index[new])
+        return new
+    
+    def _keep_pending(self, df, kind):
+        """
+        Deja pendientes solo las huellas de las filas que siguen en df
         
+        Las filas nuevas que la limpieza descarta después del filtro (p. ej.
+        downtime con duración <= 0) no llegan a los datos, así que no se
+        registran como procesadas.
+        """
+        hashes = self._pending_hashes.get(kind)
+        if hashes is not None:
+            self._pending_hashes[kind] = \
+                hashes[hashes.index.isin(df.index)].to_numpy(np.uint64)
         return df
     
-    def _validate_work_orders_data(self, df):
+    def commit_seen(self):
         """
-        Valida los datos procesados de órdenes de trabajo
-        """
-        if len(df) == 0:
-            raise Exception("No hay datos válidos en el archivo de órdenes de trabajo después del procesamiento")
-        
-        # Verificar que hay fechas válidas
-        invalid_dates = df['Fecha_Hora'].isna().sum()
-        if invalid_dates > 0:
-            st.warning(f"Se encontraron {invalid_dates} órdenes con fechas inválidas que fueron excluidas")
+        Registra como procesadas las filas nuevas de la carga actual
         
-        # Verificar rango de fechas razonable
-        min_date = df['Fecha_Hora'].min()
-        max_date = df['Fecha_Hora'].max()
+        Se llama recién cuando toda la carga (ambos archivos y lo que se haga
+        con ellos) terminó sin errores; si algo falla antes, las filas se
+        vuelven a procesar en el próximo intento.
         
-        if min_date < pd.Timestamp('2000-01-01'):
-            st.warning("Se encontraron fechas muy antiguas en las órdenes de trabajo")
-        
-        if max_date > pd.Timestamp.now() + pd.Timedelta(days=365):
-            st.warning("Se encontraron fechas futuras en las órdenes de trabajo")
+        Returns:
+            dict: Filas registradas por tipo de archivo
+        """
+        committed = {}
+        for kind, hashes in self._pending_hashes.items():
+            if self.seen_registry is not None:
+                self.seen_registry.agregar(kind, hashes)
+            committed[kind] = len(hashes)
+        self._pending_hashes.clear()
+        return committed
     
-    def _validate_downtime_data(self, df):
+    def discard_seen(self):
         """
-        Valida los datos procesados de downtime
+        Descarta las huellas pendientes de la carga actual (carga fallida)
         """
-        if len(df) == 0:
-            raise Exception("No hay datos válidos en el archivo de downtime después del procesamiento")
-        
-        # Verificar que hay fechas válidas
-        invalid_start_dates = df['Fecha_Inicio'].isna().sum()
-        invalid_end_dates = df['Fecha_Fin'].isna().sum()
+        self._pending_hashes.clear()
+    
+    def _profile(self, kind, df):
+        """
+        Calcula el perfil de calidad de un archivo procesado
         
-        if invalid_start_dates > 0 or invalid_end_dates > 0:
-            st.warning(f"Se encontraron registros con fechas inválidas que fueron excluidos")
+        Los avisos quedan en self.profiles[kind].issues (ver quality_report)
+        y se pasan a self.on_issue; solo un error (archivo sin filas
+        válidas) interrumpe el procesamiento.
+        """
+        profiler = profile_work_orders if kind == 'work_orders' else profile_downtime
+        profile = profiler(df, approximate=use_approximate(df))
+        self.profiles[kind] = profile
+        # Referencia débil: identifica el DataFrame sin retenerlo en memoria
+        self._profiled[kind] = weakref.ref(df)
+        errors = [issue for issue in profile.issues if issue.level == 'error']
+        if errors:
+            raise Exception(errors[0].message)
+        if self.on_issue is not None:
+            for issue in profile.issues:
+                self.on_issue(issue)
+        return profile
+    
+    def quality_report(self, work_orders_df, downtime_df):
+        """
+        Reporte de calidad de los datos procesados
         
-        # Verificar duraciones razonables
-        max_duration = df['Duracion_Horas'].max()
-        if max_duration > 24 * 30:  # Más de 30 días
-            st.warning("Se encontraron registros de downtime con duración muy larga (>30 días)")
+        Reutiliza los perfiles calculados al procesar cada archivo; los
+        DataFrames que no pasaron por este procesador se perfilan aquí.
         
-        # Verificar que fecha_fin > fecha_inicio
-        invalid_ranges = df[df['Fecha_Fin'] <= df['Fecha_Inicio']]
-        if len(invalid_ranges) > 0:
-            st.warning(f"Se encontraron {len(invalid_ranges)} registros con rangos de fecha inválidos que fueron excluidos")
+        Returns:
+            DataQualityReport: Resumen, avisos y ATMs en común
+        """
+        profiles = [self.profiles[kind] if kind in self._profiled
+                    and self._profiled[kind]() is df else df
+                    for kind, df in (('work_orders', work_orders_df),
+                                     ('downtime', downtime_df))]
+        return build_report(*profiles)
     
     def get_data_summary(self, work_orders_df, downtime_df):
         """
@@ -189,25 +309,4 @@ class DataProcessor:
         Returns:
             dict: Resumen de estadísticas de los datos
         """
-        summary = {
-            'work_orders': {
-                'total_records': len(work_orders_df),
-                'unique_atms': work_orders_df['ATM_ID'].nunique(),
-                'date_range': {
-                    'min': work_orders_df['Fecha_Hora'].min(),
-                    'max': work_orders_df['Fecha_Hora'].max()
-                }
-            },
-            'downtime': {
-                'total_records': len(downtime_df),
-                'unique_atms': downtime_df['ATM_ID'].nunique(),
-                'date_range': {
-                    'min': downtime_df['Fecha_Inicio'].min(),
-                    'max': downtime_df['Fecha_Fin'].max()
-                },
-                'avg_duration_hours': downtime_df['Duracion_Horas'].mean()
-            },
-            'common_atms': len(set(work_orders_df['ATM_ID']) & set(downtime_df['ATM_ID']))
-        }
-        
-        return summary
+        return self.quality_report(work_orders_df, downtime_df).summary()
@@ -0,0 +1,390 @@
+"""
+Perfil de calidad de datos de DataProcessor en una sola pasada por archivo
+
+Uso:
+    python -m utils.data_profile --filas 1000000
+    python -m utils.data_profile --filas 20000000 --aproximado
+
+Cada archivo se recorre una vez sobre sus arreglos (fechas como enteros
+int64, sin copias filtradas del DataFrame): fechas faltantes, rango de
+fechas, fechas antiguas o futuras, duraciones y rangos inválidos salen de
+las mismas máscaras. Los ATMs distintos se cuentan factorizando la columna
+(tabla hash) y los ATMs en común, factorizando juntos los valores distintos
+de ambos archivos. Con archivos enormes se puede usar HyperLogLog, que
+estima ambos conteos con memoria fija (2**precision registros).
+
+El resultado es un DataQualityReport con los avisos como datos (nivel,
+código, mensaje, cantidad): la interfaz o la línea de comandos deciden cómo
+mostrarlos.
+"""
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from utils.config import seccion_config
+
+HLL_PRECISION = 14           # 16384 registros, error típico ~0,8 %
+APPROXIMATE_FROM = 5_000_000  # filas desde las que se usa HyperLogLog
+
+OLD_DATE = pd.Timestamp('2000-01-01')
+FUTURE_DAYS = 365
+LONG_DOWNTIME_HOURS = 24 * 30
+
+_NAT = np.iinfo(np.int64).min
+_MAX = np.iinfo(np.int64).max
+
+# level: 'error' (el archivo no se puede usar) o 'warning'
+QualityIssue = namedtuple('QualityIssue', ['level', 'code', 'message', 'count'])
+# min / max: pd.Timestamp (NaT si no hay fechas); missing: fechas nulas
+DateStats = namedtuple('DateStats', ['min', 'max', 'missing', 'old', 'future'])
+# kind: 'work_orders' o 'downtime'; dates: {columna: DateStats};
+# duration: (máxima, media, > LONG_DOWNTIME_HOURS) o None; atms: valores
+# distintos (np.ndarray) o HyperLogLog
+FrameProfile = namedtuple('FrameProfile', ['kind', 'total_records', 'unique_atms',
+                                           'dates', 'duration', 'invalid_ranges',
+                                           'issues', 'atms'])
+
+
+class HyperLogLog:
+    """
+    Estimador de cantidad de valores distintos con memoria fija
+    """
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) \
+            if registers is None else registers
+
+    @classmethod
+    def from_values(cls, values, precision=HLL_PRECISION):
+        """
+        Sketch de un arreglo de valores (los nulos no cuentan)
+        """
+        values = pd.Series(values).dropna()
+        sketch = cls(precision)
+        if len(values) == 0:
+            return sketch
+        # Los textos (o tipos mezclados) se comparan como str, como en factorize
+        values = values.astype(str).to_numpy(dtype=object) if values.dtype == object \
+            else values.to_numpy()
+        hashes = pd.util.hash_array(values, categorize=False)
+        resto = 64 - precision
+        index = (hashes >> np.uint64(resto)).astype(np.int64)
+        bits = hashes & np.uint64((1 << resto) - 1)
+        # Posición del primer 1 en los bits restantes: frexp es exacto
+        # porque los valores caben en la mantisa (resto <= 53)
+        _, exponent = np.frexp(bits.astype(np.float64))
+        rank = np.where(bits == 0, resto + 1, resto - exponent + 1).astype(np.uint8)
+        maximos = pd.Series(rank).groupby(index).max()
+        sketch.registers[maximos.index.to_numpy()] = maximos.to_numpy()
+        return sketch
+
+    def union(self, other):
+        """
+        Sketch de la unión (misma precisión)
+        """
+        if other.precision != self.precision:
+            raise ValueError("Los sketches deben tener la misma precisión")
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+    def count(self):
+        """
+        Cantidad estimada de valores distintos
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Conteo lineal para cardinalidades chicas
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class DataQualityReport:
+    """
+    Perfil de calidad de órdenes de trabajo y downtime
+    """
+
+    def __init__(self, work_orders, downtime, common_atms, approximate):
+        """
+        Args:
+            work_orders (FrameProfile): Perfil de las órdenes de trabajo
+            downtime (FrameProfile): Perfil del downtime
+            common_atms (int): ATMs presentes en ambos archivos
+            approximate (bool): Conteos de ATMs estimados con HyperLogLog
+        """
+        self.work_orders = work_orders
+        self.downtime = downtime
+        self.common_atms = common_atms
+        self.approximate = approximate
+
+    @property
+    def issues(self):
+        """
+        Avisos de ambos archivos, primero los errores
+        """
+        issues = [i for p in (self.work_orders, self.downtime) for i in p.issues]
+        return sorted(issues, key=lambda i: i.level != 'error')
+
+    def summary(self):
+        """
+        Resumen con el formato de DataProcessor.get_data_summary
+        """
+        wo, dt = self.work_orders, self.downtime
+        return {
+            'work_orders': {
+                'total_records': wo.total_records,
+                'unique_atms': wo.unique_atms,
+                'date_range': {'min': wo.dates['Fecha_Hora'].min,
+                               'max': wo.dates['Fecha_Hora'].max},
+            },
+            'downtime': {
+                'total_records': dt.total_records,
+                'unique_atms': dt.unique_atms,
+                'date_range': {'min': dt.dates['Fecha_Inicio'].min,
+                               'max': dt.dates['Fecha_Fin'].max},
+                'avg_duration_hours': dt.duration[1] if dt.duration else np.nan,
+            },
+            'common_atms': self.common_atms,
+        }
+
+    def lines(self):
+        """
+        Reporte como texto (para la línea de comandos o un log)
+        """
+        aprox = '~' if self.approximate else ''
+        titulos = {'work_orders': 'Órdenes de trabajo', 'downtime': 'Downtime'}
+        lineas = []
+        for profile in (self.work_orders, self.downtime):
+            lineas.append(f"{titulos[profile.kind]}: {profile.total_records} registros, "
+                          f"{aprox}{profile.unique_atms} ATMs")
+            for columna, stats in profile.dates.items():
+                lineas.append(f"  {columna}: {stats.min} a {stats.max}")
+            if profile.duration:
+                lineas.append(f"  Duración: media {profile.duration[1]:.2f} h, "
+                              f"máxima {profile.duration[0]:.2f} h")
+        lineas.append(f"ATMs en común: {aprox}{self.common_atms}")
+        for issue in self.issues:
+            marca = 'ERROR' if issue.level == 'error' else 'AVISO'
+            lineas.append(f"{marca} {issue.message}")
+        return lineas
+
+
+def _date_stats(series, now):
+    """
+    Mínimo, máximo, nulos, antiguas y futuras de una columna de fechas,
+    sobre su vista int64 (sin filtrar el DataFrame)
+    """
+    ints = series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    valid = ints != _NAT
+    count = int(np.count_nonzero(valid))
+    if count == 0:
+        return DateStats(pd.NaT, pd.NaT, len(ints), 0, 0), ints, valid
+    limite = (now + pd.Timedelta(days=FUTURE_DAYS)).value
+    stats = DateStats(pd.Timestamp(np.min(ints, where=valid, initial=_MAX)),
+                      pd.Timestamp(np.max(ints, where=valid, initial=_NAT + 1)),
+                      len(ints) - count,
+                      int(np.count_nonzero(valid & (ints < OLD_DATE.value))),
+                      int(np.count_nonzero(ints > limite)))
+    return stats, ints, valid
+
+
+def _distinct(series, approximate, precision):
+    """
+    Valores distintos (exactos, por factorización) o sketch HyperLogLog
+
+    Returns:
+        tuple: (cantidad, valores distintos o HyperLogLog)
+    """
+    if approximate:
+        sketch = HyperLogLog.from_values(series, precision)
+        return sketch.count(), sketch
+    _, uniques = pd.factorize(series)
+    return len(uniques), np.asarray(uniques)
+
+
+def profile_frame(df, kind, dates, range_columns=None, duration=None, atm='ATM_ID',
+                  approximate=False, precision=HLL_PRECISION, now=None):
+    """
+    Perfil de calidad de un archivo en una pasada
+
+    Args:
+        df (pd.DataFrame): Archivo procesado
+        kind (str): 'work_orders' o 'downtime'
+        dates (list): Columnas de fecha
+        range_columns (tuple): (inicio, fin) que deben cumplir fin > inicio
+        duration (str): Columna de duración en horas
+        atm (str): Columna de ATM
+        approximate (bool): Contar ATMs con HyperLogLog
+        precision (int): Precisión de HyperLogLog
+        now (pd.Timestamp): Fecha de referencia para las fechas futuras
+
+    Returns:
+        FrameProfile
+    """
+    now = pd.Timestamp.now() if now is None else now
+    stats, arrays = {}, {}
+    for columna in dates:
+        stats[columna], ints, valid = _date_stats(df[columna], now)
+        arrays[columna] = (ints, valid)
+
+    invalid_ranges = 0
+    if range_columns:
+        (inicio, valid_inicio), (fin, valid_fin) = (arrays[c] for c in range_columns)
+        invalid_ranges = int(np.count_nonzero(valid_inicio & valid_fin & (fin <= inicio)))
+
+    duration_stats = None
+    if duration and len(df):
+        horas = df[duration].to_numpy(dtype=np.float64)
+        duration_stats = (float(np.nanmax(horas)), float(np.nanmean(horas)),
+                          int(np.count_nonzero(horas > LONG_DOWNTIME_HOURS)))
+
+    unique_atms, atms = _distinct(df[atm], approximate, precision)
+    profile = FrameProfile(kind, len(df), unique_atms, stats, duration_stats,
+                           invalid_ranges, [], atms)
+    profile.issues.extend(_ISSUES[kind](profile))
+    return profile
+
+
+def _work_order_issues(profile):
+    if profile.total_records == 0:
+        yield QualityIssue('error', 'sin_datos', "No hay datos válidos en el archivo de "
+                           "órdenes de trabajo después del procesamiento", 0)
+        return
+    fechas = profile.dates['Fecha_Hora']
+    if fechas.missing:
+        yield QualityIssue('warning', 'fechas_invalidas', f"Se encontraron {fechas.missing} "
+                           "órdenes con fechas inválidas que fueron excluidas", fechas.missing)
+    if fechas.old:
+        yield QualityIssue('warning', 'fechas_antiguas', "Se encontraron fechas muy "
+                           "antiguas en las órdenes de trabajo", fechas.old)
+    if fechas.future:
+        yield QualityIssue('warning', 'fechas_futuras', "Se encontraron fechas futuras "
+                           "en las órdenes de trabajo", fechas.future)
+
+
+def _downtime_issues(profile):
+    if profile.total_records == 0:
+        yield QualityIssue('error', 'sin_datos', "No hay datos válidos en el archivo de "
+                           "downtime después del procesamiento", 0)
+        return
+    faltantes = profile.dates['Fecha_Inicio'].missing + profile.dates['Fecha_Fin'].missing
+    if faltantes:
+        yield QualityIssue('warning', 'fechas_invalidas', "Se encontraron registros con "
+                           "fechas inválidas que fueron excluidos", faltantes)
+    if profile.duration and profile.duration[2]:
+        yield QualityIssue('warning', 'duracion_larga', "Se encontraron registros de "
+                           "downtime con duración muy larga (>30 días)", profile.duration[2])
+    if profile.invalid_ranges:
+        yield QualityIssue('warning', 'rangos_invalidos', f"Se encontraron "
+                           f"{profile.invalid_ranges} registros con rangos de fecha "
+                           "inválidos que fueron excluidos", profile.invalid_ranges)
+
+
+_ISSUES = {'work_orders': _work_order_issues, 'downtime': _downtime_issues}
+
+
+def profile_work_orders(df, approximate=False, precision=HLL_PRECISION, now=None):
+    """
+    Perfil de órdenes de trabajo limpias (ver profile_frame)
+    """
+    return profile_frame(df, 'work_orders', ['Fecha_Hora'], approximate=approximate,
+                         precision=precision, now=now)
+
+
+def profile_downtime(df, approximate=False, precision=HLL_PRECISION, now=None):
+    """
+    Perfil de downtime limpio (ver profile_frame)
+    """
+    return profile_frame(df, 'downtime', ['Fecha_Inicio', 'Fecha_Fin'],
+                         range_columns=('Fecha_Inicio', 'Fecha_Fin'),
+                         duration='Duracion_Horas' if 'Duracion_Horas' in df else None,
+                         approximate=approximate, precision=precision, now=now)
+
+
+def use_approximate(*frames, config=None):
+    """
+    Indica si conviene HyperLogLog según el tamaño de los archivos
+    ([calidad] aproximado_desde de atm_config.toml)
+    """
+    desde = seccion_config('calidad', config).get('aproximado_desde', APPROXIMATE_FROM)
+    return bool(desde) and max(len(f) for f in frames) >= desde
+
+
+def common_atms(a, b):
+    """
+    ATMs presentes en ambos perfiles
+
+    Exacto: se factorizan juntos los valores distintos de ambos archivos
+    (|A ∩ B| = |A| + |B| - |A ∪ B|). Si alguno es un sketch, se estima
+    con la unión de los HyperLogLog.
+    """
+    if isinstance(a.atms, HyperLogLog) or isinstance(b.atms, HyperLogLog):
+        sketch_a, sketch_b = (
+            p.atms if isinstance(p.atms, HyperLogLog) else
+            HyperLogLog.from_values(p.atms, (q.atms.precision if isinstance(
+                q.atms, HyperLogLog) else HLL_PRECISION))
+            for p, q in ((a, b), (b, a)))
+        union = sketch_a.union(sketch_b).count()
+        return max(sketch_a.count() + sketch_b.count() - union, 0)
+    _, union = pd.factorize(np.concatenate([a.atms, b.atms]))
+    return len(a.atms) + len(b.atms) - len(union)
+
+
+def build_report(work_orders, downtime, approximate=None, precision=HLL_PRECISION):
+    """
+    Reporte de calidad de ambos archivos
+
+    Args:
+        work_orders (pd.DataFrame | FrameProfile): Órdenes de trabajo limpias
+            o su perfil ya calculado
+        downtime (pd.DataFrame | FrameProfile): Downtime limpio o su perfil
+        approximate (bool): Usar HyperLogLog (por defecto, según
+            use_approximate)
+        precision (int): Precisión de HyperLogLog
+
+    Returns:
+        DataQualityReport
+    """
+    frames = [f for f in (work_orders, downtime) if isinstance(f, pd.DataFrame)]
+    if approximate is None:
+        approximate = use_approximate(*frames) if frames else False
+    if isinstance(work_orders, pd.DataFrame):
+        work_orders = profile_work_orders(work_orders, approximate, precision)
+    if isinstance(downtime, pd.DataFrame):
+        downtime = profile_downtime(downtime, approximate, precision)
+    approximate = any(isinstance(p.atms, HyperLogLog) for p in (work_orders, downtime))
+    return DataQualityReport(work_orders, downtime, common_atms(work_orders, downtime),
+                             approximate)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Perfil de calidad de datos sintéticos de órdenes y downtime')
+    parser.add_argument('--filas', type=int, default=100000)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--aproximado', action='store_true',
+                        help='Contar ATMs con HyperLogLog')
+    args = parser.parse_args(argv)
+
+    from utils.data_processor import DataProcessor
+    from utils.frame_backend import raw_data
+
+    orders, downtime = raw_data(args.filas, args.semilla)
+    processor = DataProcessor()
+    processor.seen_registry = None  # sin filtrar entre cargas
+    orders = processor._clean_work_orders_data(orders)
+    downtime = processor._clean_downtime_data(downtime)
+    inicio = time.perf_counter()
+    report = build_report(orders, downtime, approximate=args.aproximado or None)
+    segundos = time.perf_counter() - inicio
+    print('\n'.join(report.lines()))
+    print(f"Perfil calculado en {segundos:.3f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Registro persistente de filas ya procesadas entre cargas incrementales
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.config import seccion_config
+
+
+def huellas_filas(df, columnas):
+    """
+    Hash de 64 bits por fila a partir de las columnas clave
+
+    Args:
+        df (pd.DataFrame): Datos (con las claves ya normalizadas)
+        columnas (list): Columnas que identifican una fila
+
+    Returns:
+        np.ndarray: Huellas uint64, una por fila
+    """
+    return pd.util.hash_pandas_object(df[columnas], index=False).to_numpy(np.uint64)
+
+
+class RegistroVistos:
+    """
+    Conjunto persistente de huellas de filas ya procesadas
+
+    Cada tipo de archivo (órdenes de trabajo, downtime, ...) guarda sus
+    huellas en un arreglo ordenado en disco (<tipo>.npy), que se abre
+    mapeado en memoria y se consulta por búsqueda binaria: la verificación
+    es exacta y su costo no depende de cuántas cargas se hicieron antes.
+    """
+
+    def __init__(self, directorio):
+        """
+        Args:
+            directorio (str): Carpeta donde se guardan los arreglos
+        """
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+        self._arreglos = {}
+
+    @classmethod
+    def desde_config(cls, config=None):
+        """
+        Crea el registro según la sección [dedupe] de atm_config.toml
+
+        Returns:
+            RegistroVistos: None si no hay directorio configurado
+        """
+        directorio = seccion_config('dedupe', config).get('directorio')
+        return cls(directorio) if directorio else None
+
+    def _ruta(self, tipo):
+        return os.path.join(self.directorio, f'{tipo}.npy')
+
+    def vistos(self, tipo):
+        """
+        Huellas registradas de un tipo (arreglo ordenado, sin repetidos)
+        """
+        if tipo not in self._arreglos:
+            ruta = self._ruta(tipo)
+            self._arreglos[tipo] = np.load(ruta, mmap_mode='r') \
+                if os.path.exists(ruta) else np.empty(0, dtype=np.uint64)
+        return self._arreglos[tipo]
+
+    def contiene(self, tipo, huellas):
+        """
+        Máscara de las huellas que ya están registradas
+        """
+        vistos = self.vistos(tipo)
+        if not len(vistos):
+            return np.zeros(len(huellas), dtype=bool)
+        posiciones = np.searchsorted(vistos, huellas)
+        return vistos[np.minimum(posiciones, len(vistos) - 1)] == huellas
+
+    def agregar(self, tipo, huellas):
+        """
+        Registra huellas nuevas (escritura atómica del arreglo ordenado)
+        """
+        huellas = np.asarray(huellas, dtype=np.uint64)
+        if not len(huellas):
+            return
+        combinadas = np.union1d(self.vistos(tipo), huellas)
+        temporal = self._ruta(tipo) + '.tmp.npy'
+        np.save(temporal, combinadas)
+        # Soltar el mapeo anterior antes de reemplazar el archivo
+        self._arreglos.pop(tipo, None)
+        os.replace(temporal, self._ruta(tipo))
+
+    def filtrar_nuevas(self, tipo, df, columnas):
+        """
+        Deja solo las filas cuyas claves no se registraron antes
+
+        Args:
+            tipo (str): Tipo de archivo
+            df (pd.DataFrame): Datos con las claves normalizadas
+            columnas (list): Columnas clave
+
+        Returns:
+            tuple: (filas nuevas, huellas de esas filas)
+        """
+        huellas = huellas_filas(df, columnas)
+        nuevas = ~self.contiene(tipo, huellas)
+        return df[nuevas], huellas[nuevas]
+
+    def limpiar(self, tipo=None):
+        """
+        Olvida las huellas de un tipo (o de todos)
+        """
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith('.npy') and (tipo is None or nombre == f'{tipo}.npy'):
+                os.remove(os.path.join(self.directorio, nombre))
+        self._arreglos.clear()
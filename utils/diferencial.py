@@ -0,0 +1,499 @@
+"""
+Pruebas diferenciales de los motores de matching contra la referencia
+
+Uso:
+    python -m utils.diferencial --casos 50 --filas 300
+    python -m utils.diferencial --motor "Base Fallas NCR" --semilla 7 --salida /tmp/casos
+
+Genera casos aleatorios con entradas adversas (fechas vacías o inválidas,
+IDs con ceros a la izquierda o prefijos de letras, empates de horario,
+ATMs sin tickets en el TH, WO 'nan'...) y con los modos opcionales de
+cada motor (Base Fallas as-of, asignación greedy u óptima del matcher y
+motor de DataFrames polars, si está instalado), ejecuta el motor de referencia
+fila por fila (utils.referencia) y el motor actual sobre el mismo caso,
+compara las salidas celda por celda y registra la aceleración. Cada caso
+con diferencias se reduce a un reproductor mínimo.
+"""
+import argparse
+import importlib.util
+import math
+import os
+import time
+import warnings
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils import referencia
+from utils.matcher import WorkOrderMatcher
+from utils.procesamiento import (procesar_base_fallas, procesar_base_fallas_ncr,
+                                 procesar_exclusiones_cmm)
+
+# generar(rng, filas) -> caso (dict de DataFrames y parámetros)
+Motor = namedtuple('Motor', ['generar', 'referencia', 'candidato'])
+
+_BASE = pd.Timestamp('2024-03-01')
+_FALLAS_NCR = ['Dispensador con falla', 'lector de tarjeta con falla',
+               'impresora con falla', 'hardware', 'BNA con falla',
+               'pantalla con fallas', 'otra', None]
+_CATEGORIAS_TH = ['Dispenser no paga SLMG', 'Lector de Tarjeta SLMG',
+                  'Impresora de recibos SLMG', 'BNA/SDM/Deposito SLMG',
+                  'Falla de HW / Servicio Técnico', 'Comunicaciones', '', None]
+_RESUMENES = ['dispensador con falla', 'HOST DOWN', 'impresora sin papel',
+              'cash out', 'sin clasificar', None]
+# Motores de DataFrames del matcher disponibles en este entorno
+_MOTORES_DF = ['pandas'] + (['polars'] if importlib.util.find_spec('polars') else [])
+
+
+# Generación de casos
+
+def _id_atm(rng, numero):
+    """ID de ATM en alguno de los formatos que aparecen en los archivos"""
+    formato = rng.integers(8)
+    if formato == 0:
+        return f'{numero:04d}'
+    if formato == 1:
+        return f'ATM{numero:03d}'
+    if formato == 2:
+        return f'S{numero}'
+    if formato == 3:
+        return f' {numero} '
+    if formato == 4:
+        return int(numero)
+    if formato == 5:
+        return f'CAJ-{numero:05d}'
+    if formato == 6:
+        return rng.choice(['SIN ID', '0', '', None])
+    return str(numero)
+
+
+def _instante(rng, dias=3):
+    # Grilla de 5 minutos: empates y bordes de tolerancia frecuentes
+    return _BASE + pd.Timedelta(minutes=5 * int(rng.integers(dias * 24 * 12)))
+
+
+def _fecha_y_hora(rng):
+    """(fecha, hora) de una fila de entrada, a veces vacías o inválidas"""
+    caso = rng.integers(10)
+    instante = _instante(rng)
+    if caso == 0:
+        return None, instante.time()
+    if caso == 1:
+        return instante.normalize(), None
+    if caso == 2:
+        return 'sin fecha', instante.time()
+    if caso == 3:
+        return instante.strftime('%Y-%m-%d'), instante.strftime('%H:%M')
+    return instante.normalize(), instante.time()
+
+
+def _generar_th(rng, filas, numeros):
+    if rng.random() < 0.05:
+        filas = 0
+    inicios, fines = [], []
+    for _ in range(filas):
+        if rng.random() < 0.08:
+            inicios.append(rng.choice(['', 'xx', None]))
+            fines.append(None)
+            continue
+        inicio = _instante(rng)
+        inicios.append(str(inicio))
+        fines.append(str(inicio + pd.Timedelta(minutes=int(rng.integers(-30, 600)))))
+    return pd.DataFrame({
+        'ID': [_id_atm(rng, int(rng.choice(numeros))) for _ in range(filas)],
+        'TICKET KEY': [f'TK{i}' for i in range(filas)],
+        'START TIME': inicios,
+        'END TIME': fines,
+        'REFERENCE': [rng.choice([f'WO{int(rng.integers(filas * 2 + 1))}', None, 'nan',
+                                  f' WO{int(rng.integers(filas + 1))} ', 1234])
+                      for _ in range(filas)],
+        'CATEGORY': [rng.choice(_CATEGORIAS_TH) for _ in range(filas)],
+    }, columns=['ID', 'TICKET KEY', 'START TIME', 'END TIME', 'REFERENCE', 'CATEGORY'])
+
+
+def _numeros(rng, filas):
+    # Pocos ATMs para que haya varios tickets por ATM (y ATMs sin tickets)
+    return np.arange(1, max(2, filas // 4) + 1)
+
+
+def _generar_cmm(rng, filas):
+    numeros = _numeros(rng, filas)
+    n = int(rng.integers(filas + 1))
+    fechas = [_fecha_y_hora(rng) for _ in range(n)]
+    fines = [_fecha_y_hora(rng) for _ in range(n)]
+    return {
+        'th': _generar_th(rng, filas, numeros),
+        'datos': pd.DataFrame({
+            'ATM': [_id_atm(rng, int(rng.choice(numeros) + rng.integers(2))) for _ in range(n)],
+            'FECHA INICIO': [f for f, _ in fechas],
+            'HORA INICIO': [h for _, h in fechas],
+            'FECHA TERMINO': [f for f, _ in fines],
+            'HORA TERMINO': [h for _, h in fines],
+            'CODIGO SBIF': [rng.choice([2, '6', 5.0, 3, 'x', None, 7]) for _ in range(n)],
+        }, columns=['ATM', 'FECHA INICIO', 'HORA INICIO', 'FECHA TERMINO',
+                    'HORA TERMINO', 'CODIGO SBIF']),
+        'tol': int(rng.choice([0, 5, 30, 120])),
+    }
+
+
+def _generar_base(rng, filas):
+    numeros = _numeros(rng, filas)
+    n = int(rng.integers(filas + 1))
+    fechas = [_fecha_y_hora(rng) for _ in range(n)]
+    return {
+        'th': _generar_th(rng, filas, numeros),
+        'datos': pd.DataFrame({
+            'ATM': [_id_atm(rng, int(rng.choice(numeros) + rng.integers(2))) for _ in range(n)],
+            'RESUMEN FALLA': [rng.choice(_RESUMENES) for _ in range(n)],
+            'FECHA INICIO': [f for f, _ in fechas],
+            'HORA INICIO': [h for _, h in fechas],
+        }, columns=['ATM', 'RESUMEN FALLA', 'FECHA INICIO', 'HORA INICIO']),
+        'modo': ['ultimo', 'asof'][int(rng.integers(2))],
+        'tol': int(rng.choice([0, 5, 30, 120])),
+    }
+
+
+def _generar_ncr(rng, filas):
+    numeros = _numeros(rng, filas)
+    n = int(rng.integers(filas + 1))
+    fechas = [_fecha_y_hora(rng) for _ in range(n)]
+    return {
+        'th': _generar_th(rng, filas, numeros),
+        'datos': pd.DataFrame({
+            'ATM': [_id_atm(rng, int(rng.choice(numeros) + rng.integers(2))) for _ in range(n)],
+            'WO': [rng.choice([f'WO{int(rng.integers(filas * 2 + 1))}', 'nan', '', np.nan,
+                               ' WO1 ', 'NaN']) for _ in range(n)],
+            'FALLA NCR': [rng.choice(_FALLAS_NCR) for _ in range(n)],
+            'FECHA INICIAL': [f for f, _ in fechas],
+            'HORA INICIAL': [h for _, h in fechas],
+        }, columns=['ATM', 'WO', 'FALLA NCR', 'FECHA INICIAL', 'HORA INICIAL']),
+        'tol': int(rng.choice([0, 5, 30, 120])),
+    }
+
+
+def _generar_matcher(rng, filas):
+    tol = int(rng.choice([0, 5, 30, 120]))
+    atms = [f'ATM{i:03d}' for i in range(max(2, filas // 5))]
+    n_ordenes, n_downtime = int(rng.integers(filas + 1)), int(rng.integers(filas + 1))
+    inicios = [_instante(rng) for _ in range(n_downtime)]
+    fines = [i + pd.Timedelta(minutes=int(rng.integers(-10, 300))) for i in inicios]
+    ordenes = []
+    for _ in range(n_ordenes):
+        if inicios and rng.random() < 0.4:
+            # Justo en el borde de la ventana de tolerancia de un downtime
+            ordenes.append(inicios[int(rng.integers(len(inicios)))] +
+                           pd.Timedelta(minutes=int(rng.choice([-tol, tol, tol + 5]))))
+        else:
+            ordenes.append(pd.NaT if rng.random() < 0.05 else _instante(rng))
+    return {
+        'ordenes': pd.DataFrame({
+            'ATM_ID': [rng.choice(atms) for _ in range(n_ordenes)],
+            'Fecha_Hora': pd.to_datetime(pd.Series(ordenes, dtype=object)),
+            'Descripcion': [f'Orden {i}' for i in range(n_ordenes)],
+        }),
+        'downtime': pd.DataFrame({
+            'ATM_ID': [rng.choice(atms) for _ in range(n_downtime)],
+            'Fecha_Inicio': pd.to_datetime(pd.Series(inicios, dtype=object)),
+            'Fecha_Fin': pd.to_datetime(pd.Series(fines, dtype=object)),
+            'Causa': [rng.choice(['Red', 'Energía', 'Hardware']) for _ in range(n_downtime)],
+            'Duracion_Horas': [(f - i).total_seconds() / 3600
+                               for i, f in zip(inicios, fines)],
+        }),
+        'tol': tol,
+        'assignment': [None, 'greedy', 'optimal'][int(rng.integers(3))],
+        'backend': _MOTORES_DF[int(rng.integers(len(_MOTORES_DF)))],
+    }
+
+
+def _referencia_base(caso):
+    if caso['modo'] == 'asof':
+        return referencia.procesar_base_fallas_asof(caso['datos'].copy(), caso['th'].copy(),
+                                                    caso['tol'])
+    return referencia.procesar_base_fallas(caso['datos'].copy(), caso['th'].copy())
+
+
+def _resumen_asignacion(matches):
+    # La asignación óptima puede no ser única: se comparan pares y
+    # diferencia total por ATM (ver referencia.asignacion_optima)
+    return matches.groupby('ATM_ID', sort=True)['Diferencia_Tiempo_Minutos']\
+                  .agg(Pares='size', Diferencia_Total='sum').reset_index()
+
+
+def _referencia_matcher(caso):
+    if caso['assignment'] == 'optimal':
+        return referencia.asignacion_optima(caso['ordenes'], caso['downtime'], caso['tol'])
+    if caso['assignment'] == 'greedy':
+        return referencia.find_matches_greedy(caso['ordenes'], caso['downtime'], caso['tol'])
+    return referencia.find_matches(caso['ordenes'], caso['downtime'], caso['tol'])
+
+
+def _candidato_matcher(caso):
+    matches = WorkOrderMatcher(caso['tol'], backend=caso['backend']).find_matches(
+        caso['ordenes'], caso['downtime'], assignment=caso['assignment'])
+    return _resumen_asignacion(matches) if caso['assignment'] == 'optimal' else matches
+
+
+MOTORES = {
+    'Exclusiones-CMM': Motor(
+        _generar_cmm,
+        lambda c: referencia.procesar_exclusiones_cmm(c['datos'].copy(), c['th'].copy(), c['tol']),
+        lambda c: procesar_exclusiones_cmm(c['datos'].copy(), c['th'].copy(), c['tol'])),
+    'Base Fallas': Motor(
+        _generar_base,
+        _referencia_base,
+        lambda c: procesar_base_fallas(c['datos'].copy(), c['th'].copy(), c['modo'], c['tol'])),
+    'Base Fallas NCR': Motor(
+        _generar_ncr,
+        lambda c: referencia.procesar_base_fallas_ncr(c['datos'].copy(), c['th'].copy(), c['tol']),
+        lambda c: procesar_base_fallas_ncr(c['datos'].copy(), c['th'].copy(), c['tol'])),
+    'WorkOrderMatcher': Motor(
+        _generar_matcher,
+        _referencia_matcher,
+        _candidato_matcher),
+}
+
+
+# Comparación
+
+def _normalizar(valor):
+    if valor is None or (pd.api.types.is_scalar(valor) and pd.isna(valor)):
+        return None
+    if isinstance(valor, (datetime, np.datetime64)):
+        return pd.Timestamp(valor)
+    if isinstance(valor, np.generic):
+        return valor.item()
+    return valor
+
+
+def _iguales(a, b):
+    a, b = _normalizar(a), _normalizar(b)
+    if isinstance(a, float) and isinstance(b, (int, float)) or \
+            isinstance(b, float) and isinstance(a, (int, float)):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+    return type(a) is type(b) and a == b or \
+        isinstance(a, (int, float)) and isinstance(b, (int, float)) and a == b
+
+
+def _resumen(salida):
+    if isinstance(salida, Exception):
+        return repr(salida)
+    return f'DataFrame de {len(salida)} filas'
+
+
+def diferencias(esperado, obtenido):
+    """
+    Compara dos salidas celda por celda (por posición y nombre de columna)
+
+    Las celdas vacías (None, NaN, NaT) son iguales entre sí; las fechas se
+    comparan como Timestamp y los números con tolerancia relativa 1e-9.
+    Dos salidas sin filas son iguales aunque sus columnas difieran: la
+    referencia arma algunos resultados vacíos sin columnas.
+
+    Returns:
+        list: [{'fila', 'columna', 'esperado', 'obtenido'}]
+    """
+    if isinstance(esperado, Exception) or isinstance(obtenido, Exception):
+        if type(esperado) is type(obtenido):
+            return []
+        return [{'fila': None, 'columna': 'excepción',
+                 'esperado': _resumen(esperado), 'obtenido': _resumen(obtenido)}]
+
+    salida = []
+    if len(esperado) != len(obtenido):
+        salida.append({'fila': None, 'columna': 'filas',
+                       'esperado': len(esperado), 'obtenido': len(obtenido)})
+    if not len(esperado) or not len(obtenido):
+        return salida
+    for columna in obtenido.columns.difference(esperado.columns, sort=False):
+        salida.append({'fila': None, 'columna': columna,
+                       'esperado': 'faltante', 'obtenido': 'columna'})
+    for columna in esperado.columns:
+        if columna not in obtenido.columns:
+            salida.append({'fila': None, 'columna': columna,
+                           'esperado': 'columna', 'obtenido': 'faltante'})
+            continue
+        for fila, (a, b) in enumerate(zip(esperado[columna].tolist(),
+                                          obtenido[columna].tolist())):
+            if not _iguales(a, b):
+                salida.append({'fila': fila, 'columna': columna,
+                               'esperado': a, 'obtenido': b})
+    return salida
+
+
+# Ejecución
+
+def _medir(funcion, caso):
+    inicio = time.perf_counter()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            resultado = funcion(caso)
+    except Exception as e:
+        resultado = e
+    return resultado, time.perf_counter() - inicio
+
+
+def _estado(esperado, obtenido, difs):
+    if not difs:
+        return 'igual'
+    if isinstance(esperado, Exception) and not isinstance(obtenido, Exception):
+        # Errores conocidos de la referencia (p. ej. idxmin sobre fechas
+        # vacías) que el motor actual ya no tiene: no son regresiones
+        return 'error referencia'
+    if isinstance(obtenido, Exception):
+        return 'error candidato'
+    return 'diferente'
+
+
+def ejecutar_caso(motor, caso):
+    """
+    Ejecuta la referencia y el candidato sobre un caso
+
+    Returns:
+        tuple: (estado, diferencias, segundos referencia, segundos candidato);
+            estado es 'igual', 'diferente', 'error candidato' o 'error referencia'
+    """
+    esperado, t_ref = _medir(motor.referencia, caso)
+    obtenido, t_cand = _medir(motor.candidato, caso)
+    difs = diferencias(esperado, obtenido)
+    return _estado(esperado, obtenido, difs), difs, t_ref, t_cand
+
+
+def es_regresion(estado):
+    return estado in ('diferente', 'error candidato')
+
+
+def _variante(caso):
+    # Parámetros opcionales del caso (modo, asignación, motor de DataFrames)
+    partes = [f"{clave}={caso[clave]}" for clave in ('modo', 'assignment', 'backend')
+              if clave in caso]
+    return ', '.join(partes)
+
+
+def _tablas(caso):
+    return [clave for clave, valor in caso.items() if isinstance(valor, pd.DataFrame)]
+
+
+def reducir(motor, caso, estado, max_intentos=2000):
+    """
+    Reduce un caso con diferencias a un reproductor mínimo
+
+    Quita filas de cada tabla por bisección (delta debugging) mientras se
+    mantenga el mismo estado de la comparación, hasta que ninguna fila se
+    pueda quitar.
+
+    Returns:
+        dict: Caso reducido
+    """
+    intentos = [0]
+
+    def falla(prueba):
+        intentos[0] += 1
+        return ejecutar_caso(motor, prueba)[0] == estado
+
+    cambio = True
+    while cambio and intentos[0] < max_intentos:
+        cambio = False
+        for clave in _tablas(caso):
+            partes = 2
+            while len(caso[clave]) and intentos[0] < max_intentos:
+                df = caso[clave]
+                partes = min(partes, len(df))
+                reducido = False
+                for trozo in np.array_split(np.arange(len(df)), partes):
+                    prueba = dict(caso)
+                    prueba[clave] = df.drop(df.index[trozo]).reset_index(drop=True)
+                    if falla(prueba):
+                        caso, reducido, cambio = prueba, True, True
+                        partes = max(partes - 1, 2)
+                        break
+                if not reducido:
+                    if partes >= len(df):
+                        break
+                    partes = min(partes * 2, len(df))
+    return caso
+
+
+def ejecutar(motores=None, casos=25, semilla=0, filas=200, salida=None):
+    """
+    Corre la prueba diferencial
+
+    Args:
+        motores (list): Nombres de MOTORES a probar (por defecto, todos)
+        casos (int): Casos por motor
+        semilla (int): Semilla del primer caso (el caso i usa semilla + i)
+        filas (int): Tamaño máximo de cada tabla generada
+        salida (str): Carpeta para guardar los reproductores mínimos
+
+    Returns:
+        tuple: (DataFrame con una fila por caso, {(motor, semilla): caso
+            reducido} solo para las regresiones)
+    """
+    registros, reproductores = [], {}
+    for nombre in motores or list(MOTORES):
+        motor = MOTORES[nombre]
+        for i in range(casos):
+            caso = motor.generar(np.random.default_rng(semilla + i), filas)
+            estado, difs, t_ref, t_cand = ejecutar_caso(motor, caso)
+            registros.append({
+                'Motor': nombre,
+                'Semilla': semilla + i,
+                'Variante': _variante(caso),
+                'Filas': sum(len(caso[c]) for c in _tablas(caso)),
+                'Resultado': estado,
+                'Diferencias': len(difs),
+                'Seg. referencia': round(t_ref, 4),
+                'Seg. candidato': round(t_cand, 4),
+                'Aceleración': round(t_ref / t_cand, 1) if t_cand else None,
+            })
+            if es_regresion(estado):
+                minimo = reducir(motor, caso, estado)
+                reproductores[(nombre, semilla + i)] = minimo
+                if salida:
+                    os.makedirs(salida, exist_ok=True)
+                    pd.to_pickle(minimo, os.path.join(
+                        salida, f"{nombre.replace(' ', '_')}_{semilla + i}.pkl"))
+    return pd.DataFrame(registros), reproductores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Prueba diferencial de los motores de matching contra la referencia')
+    parser.add_argument('--motor', action='append', choices=list(MOTORES),
+                        help='Motor a probar (se puede repetir; por defecto, todos)')
+    parser.add_argument('--casos', type=int, default=25)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--filas', type=int, default=200)
+    parser.add_argument('--salida', help='Carpeta para los reproductores mínimos (.pkl)')
+    args = parser.parse_args(argv)
+
+    informe, reproductores = ejecutar(args.motor, args.casos, args.semilla,
+                                      args.filas, args.salida)
+    resumen = informe.groupby('Motor', sort=False).agg(
+        Casos=('Semilla', 'size'),
+        Regresiones=('Resultado', lambda r: int(r.map(es_regresion).sum())),
+        Errores_referencia=('Resultado', lambda r: int((r == 'error referencia').sum())),
+        Aceleración_mediana=('Aceleración', 'median'),
+        Aceleración_mínima=('Aceleración', 'min'))
+    print(resumen.to_string())
+
+    for (nombre, semilla), caso in reproductores.items():
+        print(f"\n{nombre} (semilla {semilla}): reproductor mínimo")
+        for clave, valor in caso.items():
+            print(f"  {clave}:" if isinstance(valor, pd.DataFrame) else f"  {clave} = {valor}")
+            if isinstance(valor, pd.DataFrame):
+                print(valor.to_string(max_rows=20))
+        for d in diferencias(*_salidas(MOTORES[nombre], caso))[:10]:
+            print(f"  fila {d['fila']}, {d['columna']}: "
+                  f"esperado {d['esperado']!r}, obtenido {d['obtenido']!r}")
+    return 1 if reproductores else 0
+
+
+def _salidas(motor, caso):
+    return _medir(motor.referencia, caso)[0], _medir(motor.candidato, caso)[0]
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
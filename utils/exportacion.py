@@ -0,0 +1,227 @@
+"""
+Exportación de resultados para otros sistemas (Parquet, CSV comprimido, Arrow)
+
+A diferencia del reporte Excel, estos formatos no llevan estilos: se
+escriben por bloques directamente desde los DataFrames o el spool, de modo
+que exportar resultados grandes toma segundos y no requiere tenerlos
+completos en memoria.
+"""
+import gzip
+import io
+import zipfile
+from collections.abc import Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+FILAS_EXPORTACION = 100_000  # filas por bloque escrito
+SUFIJO_ORIGINAL = ' (original)'
+
+# Formato -> (extensión, descripción)
+FORMATOS = {
+    'parquet': ('.parquet', 'Parquet'),
+    'csv.gz': ('.csv.gz', 'CSV comprimido (gzip)'),
+    'arrow': ('.arrow', 'Arrow IPC'),
+}
+
+
+def _bloques(fuente):
+    """
+    Normaliza una fuente (DataFrame, iterable de bloques o función que
+    devuelve uno) a un iterador de DataFrames de hasta FILAS_EXPORTACION filas
+    """
+    if fuente is None:
+        return
+    if callable(fuente) and not isinstance(fuente, pd.DataFrame):
+        fuente = fuente()
+    if isinstance(fuente, pd.DataFrame):
+        fuente = [fuente]
+    for bloque in fuente:
+        for inicio in range(0, len(bloque), FILAS_EXPORTACION):
+            yield bloque.iloc[inicio:inicio + FILAS_EXPORTACION]
+
+
+def _combinar(originales, resultados):
+    """
+    Une originales y resultados por posición, como el reporte Excel
+    (las columnas originales llevan el sufijo ' (original)')
+
+    Los bloques de cada fuente pueden tener tamaños distintos, así que se
+    recortan para avanzar juntos; la fuente más corta se completa con
+    valores vacíos.
+    """
+    izq, der = _bloques(originales), _bloques(resultados)
+    a, b = next(izq, None), next(der, None)
+    cols_a = list(a.columns) if a is not None else []
+    cols_b = list(b.columns) if b is not None else []
+    while a is not None or b is not None:
+        n = min(len(x) for x in (a, b) if x is not None)
+        partes = []
+        for bloque, columnas, sufijo in ((a, cols_a, SUFIJO_ORIGINAL), (b, cols_b, '')):
+            parte = bloque.iloc[:n] if bloque is not None else \
+                pd.DataFrame(index=range(n), columns=columnas)
+            parte = parte.reset_index(drop=True)
+            parte.columns = [f'{c}{sufijo}' for c in columnas]
+            partes.append(parte)
+        yield pd.concat(partes, axis=1)
+
+        a = a.iloc[n:] if a is not None else None
+        b = b.iloc[n:] if b is not None else None
+        if a is not None and not len(a):
+            a = next(izq, None)
+        if b is not None and not len(b):
+            b = next(der, None)
+
+
+def _esquema_bloque(df):
+    """
+    Esquema Arrow de un bloque según sus dtypes: las columnas object (y las
+    que no tienen ningún valor) se escriben como texto
+    """
+    base = pa.Schema.from_pandas(df.head(0), preserve_index=False)
+    campos = []
+    for col, campo in zip(df.columns, base):
+        if df[col].dtype == object or pa.types.is_null(campo.type):
+            campo = campo.with_type(pa.string())
+        campos.append(campo)
+    return pa.schema(campos)
+
+
+def _unir_esquemas(esquemas):
+    """
+    Une los esquemas de todos los bloques de una fuente, ampliando cada
+    columna al tipo que admite todos sus valores (int -> float, etc.); las
+    columnas con tipos incompatibles (números y texto) quedan como texto
+    """
+    esquemas = list(esquemas)
+    if not esquemas:
+        return None
+    campos = []
+    for campo in esquemas[0]:
+        for otro in esquemas[1:]:
+            i = otro.get_field_index(campo.name)
+            if i < 0 or otro.field(i).type == campo.type:
+                continue
+            try:
+                campo = pa.unify_schemas(
+                    [pa.schema([campo]), pa.schema([otro.field(i).with_name(campo.name)])],
+                    promote_options='permissive').field(0)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, NotImplementedError):
+                campo = campo.with_type(pa.string())
+        if pa.types.is_null(campo.type):
+            campo = campo.with_type(pa.string())
+        campos.append(campo)
+    return pa.schema(campos)
+
+
+def _esquema(fuente):
+    """
+    Esquema Arrow de una fuente completa (None si no tiene filas)
+
+    Un DataFrame aporta sus dtypes y un spool los esquemas de sus partes
+    (solo el pie de cada Parquet); las demás fuentes se recorren una vez.
+    """
+    if fuente is None:
+        return None
+    if isinstance(fuente, pd.DataFrame):
+        return _esquema_bloque(fuente) if len(fuente) else None
+    if hasattr(fuente, 'partes'):
+        return _unir_esquemas(
+            pq.read_schema(parte).remove_metadata() for parte in fuente.partes)
+    return _unir_esquemas(_esquema_bloque(b) for b in _bloques(fuente) if len(b))
+
+
+def _esquema_exportacion(originales, resultados):
+    """
+    Esquema de lo que escribe exportar (originales con sufijo y resultados)
+    """
+    esquema = _esquema(resultados)
+    if originales is None:
+        return esquema
+    campos = [c.with_name(f'{c.name}{SUFIJO_ORIGINAL}')
+              for c in (_esquema(originales) or [])]
+    return pa.schema(campos + list(esquema or []))
+
+
+def _tabla(df, esquema):
+    """
+    Convierte un bloque a Arrow con el esquema de la fuente completa (los
+    tipos solo se amplían, nunca se recortan valores)
+    """
+    df = df.reset_index(drop=True)
+    for col, campo in zip(df.columns, esquema):
+        if pa.types.is_string(campo.type):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    df.columns = esquema.names
+    return pa.Table.from_pandas(df, schema=esquema, preserve_index=False) \
+        .replace_schema_metadata(None)
+
+
+def exportar(destino, resultados, formato='parquet', originales=None):
+    """
+    Escribe un resultado por bloques en un formato de intercambio
+
+    Args:
+        destino: Ruta o archivo binario de salida
+        resultados: DataFrame, iterable de bloques (p. ej. SpoolResultados)
+            o función que devuelve uno
+        formato (str): 'parquet', 'csv.gz' o 'arrow'
+        originales: Datos originales a unir por posición (opcional)
+
+    Returns:
+        int: Filas escritas
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de exportación inválido: {formato}")
+    if formato != 'csv.gz':
+        # El esquema se fija antes de escribir: un iterador de un solo uso
+        # se guarda para recorrerlo de nuevo
+        originales, resultados = (
+            list(f) if isinstance(f, Iterator) else f for f in (originales, resultados))
+        esquema = _esquema_exportacion(originales, resultados) or pa.schema([])
+    bloques = _combinar(originales, resultados) if originales is not None \
+        else _bloques(resultados)
+
+    if formato == 'csv.gz':
+        filas = 0
+        with gzip.open(destino, 'wt', encoding='utf-8', newline='') as f:
+            for i, bloque in enumerate(bloques):
+                bloque.to_csv(f, index=False, header=i == 0)
+                filas += len(bloque)
+        return filas
+
+    escritor = pq.ParquetWriter(destino, esquema) if formato == 'parquet' \
+        else pa.ipc.new_file(destino, esquema,
+                             options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    filas = 0
+    try:
+        for bloque in bloques:
+            tabla = _tabla(bloque, esquema)
+            escritor.write_table(tabla)
+            filas += tabla.num_rows
+    finally:
+        escritor.close()
+    return filas
+
+
+def paquete_exportacion(secciones, formato='parquet'):
+    """
+    Exporta varios resultados a un ZIP (un archivo por resultado)
+
+    Args:
+        secciones (list): [(nombre, originales, resultados)]; originales
+            puede ser None para exportar solo los resultados
+        formato (str): 'parquet', 'csv.gz' o 'arrow'
+
+    Returns:
+        bytes: Contenido del ZIP
+    """
+    extension = FORMATOS[formato][0]
+    buffer = io.BytesIO()
+    # Los tres formatos ya van comprimidos: el ZIP solo los agrupa
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+        for nombre, originales, resultados in secciones:
+            with zf.open(f'{nombre}{extension}', 'w', force_zip64=True) as f:
+                exportar(f, resultados, formato, originales)
+    return buffer.getvalue()
@@ -0,0 +1,463 @@
+"""
+Motores de DataFrames para DataProcessor y WorkOrderMatcher
+
+Uso (verificación de que ambos motores dan el mismo resultado):
+    python -m utils.frame_backend --filas 200000
+
+El motor 'pandas' (por defecto) ejecuta cada paso de la limpieza sobre el
+DataFrame como siempre. El motor 'polars' (opcional, requiere el paquete
+polars) arma la limpieza como un plan lazy de Polars: normalización de
+textos, descarte de nulos, duplicados y duración se fusionan en una sola
+consulta multihilo, sin copias intermedias del DataFrame; los pares
+candidatos del matcher salen de un join por ATM con las ventanas de
+tolerancia. En ambos casos la salida es un DataFrame de pandas idéntico
+(mismos valores, tipos, orden e índice).
+
+Las columnas de texto que no son solo str (números mezclados, nulos) y
+las fechas que no vienen como datetime64 se convierten en la frontera con
+las mismas reglas de pandas (astype(str), to_datetime), para que los
+resultados no dependan del motor.
+"""
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from utils.config import seccion_config
+
+BACKENDS = ('pandas', 'polars')
+
+_NAT = np.iinfo(np.int64).min
+_ROW = '__fila'
+
+# Pasos de limpieza de un archivo:
+#   upper: textos a recortar y pasar a mayúsculas; text: textos a recortar;
+#   dates: fechas (errores -> NaT); required: columnas que no pueden quedar
+#   nulas; keys: claves de duplicados; duration: (inicio, fin, columna) para
+#   la duración en horas (se descartan las <= 0), o None
+CleaningSpec = namedtuple('CleaningSpec',
+                          ['upper', 'text', 'dates', 'required', 'keys', 'duration'],
+                          defaults=[None])
+
+
+def get_backend(name=None, config=None):
+    """
+    Devuelve el motor de DataFrames
+
+    Args:
+        name (str | objeto): 'pandas', 'polars' o un motor ya creado; por
+            defecto, el de la sección [dataframes] de atm_config.toml
+        config (dict): Configuración (por defecto, atm_config.toml)
+
+    Returns:
+        PandasBackend | PolarsBackend
+    """
+    if name is not None and not isinstance(name, str):
+        return name
+    name = name or seccion_config('dataframes', config).get('motor', 'pandas')
+    if name == 'pandas':
+        return PandasBackend()
+    if name == 'polars':
+        return PolarsBackend()
+    raise ValueError(f"Motor de DataFrames inválido: {name}. Opciones: {BACKENDS}")
+
+
+def minutes_between(times, starts):
+    """
+    |times - starts| en minutos (misma aritmética que Timedelta.total_seconds() / 60)
+    """
+    return np.abs((times - starts) / 1e9 / 60)
+
+
+def window_candidates(times, starts, ends, tol):
+    """
+    Pares (orden, downtime) de un ATM cuya fecha de orden cae en la ventana
+    [inicio - tol, max(inicio + tol, fin)] del downtime
+
+    Con las órdenes ordenadas por fecha, cada ventana se resuelve con
+    searchsorted.
+
+    Args:
+        times (np.ndarray): Fecha_Hora de las órdenes en nanosegundos
+        starts (np.ndarray): Fecha_Inicio de los downtimes en nanosegundos
+        ends (np.ndarray): Fecha_Fin de los downtimes en nanosegundos
+        tol (int): Tolerancia en nanosegundos
+
+    Returns:
+        tuple: (posiciones de orden, posiciones de downtime, diferencia en minutos),
+            ordenados por orden y luego por downtime
+    """
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+             np.empty(0, dtype=float))
+
+    # Las fechas nulas nunca coinciden (las comparaciones con NaT son False)
+    valid_orders = np.flatnonzero(times != _NAT)
+    valid_downtimes = np.flatnonzero(starts != _NAT)
+    if len(valid_orders) == 0 or len(valid_downtimes) == 0:
+        return empty
+
+    sorter = valid_orders[np.argsort(times[valid_orders], kind='stable')]
+    sorted_times = times[sorter]
+
+    s = starts[valid_downtimes]
+    e = ends[valid_downtimes]
+    upper = np.where(e != _NAT, np.maximum(s + tol, e), s + tol)
+    lo = np.searchsorted(sorted_times, s - tol, side='left')
+    hi = np.searchsorted(sorted_times, upper, side='right')
+    counts = np.maximum(hi - lo, 0)
+
+    total = int(counts.sum())
+    if total == 0:
+        return empty
+
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    order_pos = sorter[np.repeat(lo, counts) + offsets]
+    downtime_pos = np.repeat(valid_downtimes, counts)
+
+    traversal = np.lexsort((downtime_pos, order_pos))
+    order_pos, downtime_pos = order_pos[traversal], downtime_pos[traversal]
+    return order_pos, downtime_pos, minutes_between(times[order_pos],
+                                                    starts[downtime_pos])
+
+
+def _first_columns(spec, processed, seen):
+    """
+    Columnas a normalizar antes del filtro de vistas: claves y requeridas
+    (sin filtro, todas en una sola pasada)
+    """
+    if seen is None:
+        return list(dict.fromkeys(processed + spec.keys + spec.required))
+    return list(dict.fromkeys(spec.keys + spec.required))
+
+
+class PandasBackend:
+    """
+    Motor por defecto: cada paso sobre el DataFrame de pandas
+    """
+
+    name = 'pandas'
+
+    def clean(self, df, spec, seen=None):
+        """
+        Limpia un archivo según spec
+
+        Args:
+            df (pd.DataFrame): Datos leídos (no se modifican)
+            spec (CleaningSpec): Pasos de limpieza
+            seen (callable): Filtro de filas ya procesadas (DataFrame ->
+                máscara de filas nuevas). Recibe las filas sin nulos ni
+                duplicados con solo las claves y columnas requeridas
+                normalizadas; el resto de la limpieza corre sobre las nuevas
+
+        Returns:
+            pd.DataFrame: Datos limpios, con el índice de las filas de origen
+        """
+        processed = list(dict.fromkeys(spec.upper + spec.dates + spec.text))
+        first = _first_columns(spec, processed, seen)
+        # Copia superficial: las columnas se reemplazan, el original no cambia
+        df = self._normalize(df.copy(deep=False), spec, first)
+
+        df = df.dropna(subset=spec.required)
+        df = df.drop_duplicates(subset=spec.keys)
+        if seen is not None:
+            df = self._normalize(df[seen(df)].copy(), spec,
+                                 [c for c in processed if c not in first])
+
+        if spec.duration:
+            start, end, column = spec.duration
+            df[column] = (df[end] - df[start]).dt.total_seconds() / 3600
+            df = df[df[column] > 0]
+        return df
+
+    def _normalize(self, df, spec, columns):
+        for col in spec.upper:
+            if col in columns:
+                df[col] = df[col].astype(str).str.strip().str.upper()
+        for col in spec.dates:
+            if col in columns:
+                df[col] = pd.to_datetime(df[col], errors='coerce')
+        for col in spec.text:
+            if col in columns:
+                df[col] = df[col].astype(str).str.strip()
+        return df
+
+    def candidates(self, atms, order_groups, downtime_groups, order_times, starts,
+                   ends, tol, order_atms=None, downtime_atms=None):
+        """
+        Pares candidatos de cada ATM, en el orden de atms
+
+        Args:
+            atms (iterable): ATMs a recorrer
+            order_groups (dict): ATM -> posiciones de sus órdenes
+            downtime_groups (dict): ATM -> posiciones de sus downtimes
+            order_times, starts, ends (np.ndarray): Fechas en nanosegundos
+            tol (int): Tolerancia en nanosegundos
+            order_atms, downtime_atms (np.ndarray): ATM_ID de cada orden y de
+                cada downtime (los usan los motores que no recorren por ATM)
+
+        Yields:
+            tuple: (ATM, posiciones de orden y de downtime dentro del ATM,
+                diferencia en minutos), ordenados por orden y downtime
+        """
+        for atm_id in atms:
+            if atm_id not in order_groups or atm_id not in downtime_groups:
+                continue
+            orders, downtimes = order_groups[atm_id], downtime_groups[atm_id]
+            yield (atm_id,) + window_candidates(
+                order_times[orders], starts[downtimes], ends[downtimes], tol)
+
+
+class PolarsBackend:
+    """
+    Motor lazy y multihilo sobre Polars (mismo resultado que PandasBackend)
+    """
+
+    name = 'polars'
+
+    def __init__(self):
+        try:
+            import polars
+        except ImportError:
+            raise ImportError(
+                "El motor de DataFrames 'polars' requiere el paquete polars "
+                "(pip install polars)") from None
+        self.pl = polars
+
+    def _text(self, series):
+        """
+        Columna de texto para Polars, como la dejaría astype(str)
+        """
+        pl = self.pl
+        if pd.api.types.is_integer_dtype(series.dtype) and \
+                not pd.api.types.is_extension_array_dtype(series.dtype):
+            return pl.from_pandas(series).cast(pl.String)
+        if series.dtype != object or \
+                pd.api.types.infer_dtype(series, skipna=False) != 'string':
+            series = series.astype(str)
+        return pl.from_pandas(series)
+
+    def _dates(self, series):
+        """
+        Columna de fechas para Polars, como la dejaría to_datetime(errors='coerce')
+        """
+        if not pd.api.types.is_datetime64_dtype(series.dtype):
+            series = pd.to_datetime(series, errors='coerce')
+        return self.pl.from_pandas(series)
+
+    def _to_pandas(self, df, out, processed, columns=None):
+        """
+        Filas sobrevivientes de df (por posición) con las columnas procesadas
+        reemplazadas por las de Polars, en el orden de columnas original
+        """
+        columns = list(df.columns) if columns is None else columns
+        positions = out[_ROW].to_numpy()
+        result = df[[c for c in columns if c not in processed]].take(positions)
+        for loc, col in enumerate(columns):
+            if col in processed:
+                result.insert(loc, col, out[col].to_pandas().to_numpy())
+        for col in out.columns:
+            if col != _ROW and col not in columns and col not in df.columns:
+                result[col] = out[col].to_pandas().to_numpy()
+        return result
+
+    def _plan(self, df, spec, columns, positions=None):
+        """
+        Plan lazy con las columnas indicadas de df (o de las filas en
+        positions) ya normalizadas, más la posición de origen de cada fila
+        """
+        pl = self.pl
+        source = df if positions is None else df.take(positions)
+        data = {_ROW: np.arange(len(df), dtype=np.int64) if positions is None
+                else np.asarray(positions, dtype=np.int64)}
+        data.update({col: self._text(source[col])
+                     for col in spec.upper + spec.text if col in columns})
+        data.update({col: self._dates(source[col]) for col in spec.dates if col in columns})
+        # Claves sin transformar: códigos con la igualdad de pandas (NaN == NaN)
+        for col in columns:
+            if col not in data:
+                codes = pd.factorize(source[col], use_na_sentinel=True)[0]
+                data[col] = pl.Series(col, codes).replace(-1, None)
+        return pl.LazyFrame(data).with_columns(
+            [pl.col(c).str.strip_chars().str.to_uppercase()
+             for c in spec.upper if c in columns] +
+            [pl.col(c).str.strip_chars() for c in spec.text if c in columns])
+
+    def clean(self, df, spec, seen=None):
+        """
+        Igual que PandasBackend.clean, como un plan lazy de Polars
+        """
+        pl = self.pl
+        processed = list(dict.fromkeys(spec.upper + spec.text + spec.dates))
+        first = _first_columns(spec, processed, seen)
+        plan = self._plan(df, spec, first).drop_nulls(subset=spec.required) \
+                   .unique(subset=spec.keys, keep='first', maintain_order=True)
+
+        if seen is not None:
+            # El registro de vistas usa las huellas de pandas de las claves
+            out = plan.collect()
+            keys = self._to_pandas(df, out, [c for c in processed if c in first],
+                                   spec.keys)
+            out = out.filter(pl.Series(np.asarray(seen(keys), dtype=bool)))
+            rest = [c for c in processed if c not in first]
+            if rest:
+                # El resto de las columnas, solo de las filas nuevas
+                late = self._plan(df, spec, rest, out[_ROW].to_numpy()).collect()
+                out = out.hstack(late.drop(_ROW))
+            plan = out.lazy()
+
+        if spec.duration:
+            # Duración > 0 equivale a fin > inicio en nanosegundos
+            start, end, column = spec.duration
+            plan = plan.filter(pl.col(end) > pl.col(start))
+        result = self._to_pandas(df, plan.select([_ROW] + processed).collect(), processed)
+        if spec.duration:
+            # Las horas se calculan con pandas: Polars divide por un escalar
+            # multiplicando por su inverso y el último decimal puede diferir
+            result[column] = (result[end] - result[start]).dt.total_seconds() / 3600
+        return result
+
+    def candidates(self, atms, order_groups, downtime_groups, order_times, starts,
+                   ends, tol, order_atms=None, downtime_atms=None):
+        """
+        Igual que PandasBackend.candidates, con un solo join por ATM en Polars
+        """
+        pl = self.pl
+        codes, uniques = pd.factorize(
+            np.concatenate([np.asarray(order_atms, dtype=object),
+                            np.asarray(downtime_atms, dtype=object)]))
+        n_orders = len(order_times)
+
+        orders = pl.LazyFrame({
+            'atm': codes[:n_orders], 'left': np.arange(n_orders), 't': order_times,
+        }).filter((pl.col('atm') >= 0) & (pl.col('t') != _NAT))
+        downtimes = pl.LazyFrame({
+            'atm': codes[n_orders:], 'right': np.arange(len(starts)),
+            's': starts, 'e': ends,
+        }).filter((pl.col('atm') >= 0) & (pl.col('s') != _NAT)).select(
+            'atm', 'right',
+            (pl.col('s') - tol).alias('lo'),
+            pl.when(pl.col('e') != _NAT)
+              .then(pl.max_horizontal(pl.col('s') + tol, pl.col('e')))
+              .otherwise(pl.col('s') + tol).alias('hi'))
+        pairs = orders.join(downtimes, on='atm') \
+            .filter((pl.col('t') >= pl.col('lo')) & (pl.col('t') <= pl.col('hi'))) \
+            .select('atm', 'left', 'right') \
+            .sort('atm', 'left', 'right') \
+            .collect()
+
+        atm = pairs['atm'].to_numpy()
+        left = pairs['left'].to_numpy()
+        right = pairs['right'].to_numpy()
+        bounds = np.flatnonzero(np.diff(atm)) + 1
+        segments = {int(atm[a]): (a, b) for a, b in
+                    zip(np.r_[0, bounds], np.r_[bounds, len(atm)]) if b > a}
+        code_of = {value: code for code, value in enumerate(uniques)}
+
+        for atm_id in atms:
+            segment = segments.get(code_of.get(atm_id, -1))
+            if segment is None or atm_id not in order_groups or \
+                    atm_id not in downtime_groups:
+                continue
+            a, b = segment
+            yield (atm_id,
+                   np.searchsorted(order_groups[atm_id], left[a:b]),
+                   np.searchsorted(downtime_groups[atm_id], right[a:b]),
+                   minutes_between(order_times[left[a:b]], starts[right[a:b]]))
+
+
+# Verificación entre motores
+
+def raw_data(rows=10000, seed=0):
+    """
+    Órdenes de trabajo y downtime sin limpiar, con los problemas de los
+    archivos reales (espacios, minúsculas, IDs numéricos, fechas inválidas,
+    duplicados y duraciones negativas)
+
+    Returns:
+        tuple: (órdenes de trabajo, downtime)
+    """
+    rng = np.random.default_rng(seed)
+    atms = np.array([f' atm{i:04d} ' if i % 7 else f'ATM{i:04d}'
+                     for i in range(max(10, rows // 50))], dtype=object)
+    base = np.datetime64('2024-01-01', 'ns')
+
+    def dates(n, invalid=0.02):
+        values = base + rng.integers(0, 60 * 24 * 60, n) * np.timedelta64(1, 'm')
+        values[rng.random(n) < invalid] = np.datetime64('NaT')
+        return values
+
+    atm_orders = rng.choice(atms, rows)
+    atm_orders[rng.random(rows) < 0.01] = 1234
+    orders = pd.DataFrame({
+        'ATM_ID': atm_orders,
+        'Fecha_Hora': dates(rows),
+        'Descripcion': rng.choice(np.array(['Cambio de dispensador ', ' sin papel',
+                                            'Falla de red', None], dtype=object), rows),
+        'Prioridad': rng.integers(1, 4, rows),
+    })
+    orders = pd.concat([orders, orders.iloc[:rows // 20]], ignore_index=True)
+
+    starts = dates(rows)
+    downtime = pd.DataFrame({
+        'ATM_ID': rng.choice(atms, rows),
+        'Fecha_Inicio': starts,
+        'Fecha_Fin': starts + rng.integers(-30, 600, rows) * np.timedelta64(1, 'm'),
+        'Causa': rng.choice(np.array([' Red', 'Energía ', 'Hardware'], dtype=object), rows),
+    })
+    downtime = pd.concat([downtime, downtime.iloc[:rows // 20]], ignore_index=True)
+    return orders, downtime
+
+
+def compare_backends(rows=10000, seed=0, tolerance=30):
+    """
+    Ejecuta la limpieza y el matching con ambos motores y verifica que los
+    resultados sean idénticos (pd.testing.assert_frame_equal exacto)
+
+    Returns:
+        pd.DataFrame: Segundos por paso y motor
+    """
+    from utils.data_processor import DataProcessor
+    from utils.matcher import WorkOrderMatcher
+
+    orders, downtime = raw_data(rows, seed)
+    times, results = {}, {}
+    for name in BACKENDS:
+        processor = DataProcessor(backend=name)
+        processor.seen_registry = None  # sin filtrar entre cargas
+        start = time.perf_counter()
+        clean_orders = processor._clean_work_orders_data(orders)
+        clean_downtime = processor._clean_downtime_data(downtime)
+        times[('Limpieza', name)] = time.perf_counter() - start
+        results[('Limpieza órdenes', name)] = clean_orders
+        results[('Limpieza downtime', name)] = clean_downtime
+        for assignment in WorkOrderMatcher.ASSIGNMENT_MODES:
+            matcher = WorkOrderMatcher(tolerance, backend=name)
+            start = time.perf_counter()
+            results[(f'Matching {assignment}', name)] = matcher.find_matches(
+                clean_orders, clean_downtime, assignment)
+            times[(f'Matching {assignment}', name)] = time.perf_counter() - start
+
+    for step, name in list(results):
+        if name == 'pandas':
+            pd.testing.assert_frame_equal(results[(step, 'pandas')],
+                                          results[(step, 'polars')], check_exact=True)
+    return pd.Series(times).unstack()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Verifica que los motores pandas y polars den resultados idénticos')
+    parser.add_argument('--filas', type=int, default=100000)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--tol', type=int, default=30)
+    args = parser.parse_args(argv)
+
+    tiempos = compare_backends(args.filas, args.semilla, args.tol)
+    print("Resultados idénticos en ambos motores. Segundos por paso:")
+    print(tiempos.round(3).to_string())
+
+
+if __name__ == '__main__':
+    main()
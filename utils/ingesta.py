@@ -0,0 +1,162 @@
+import atexit
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from utils.config import seccion_config
+
+# Con archivos chicos enviar los bytes a otro proceso cuesta más que leerlos aquí
+BYTES_MINIMOS_POOL = 512 * 1024
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _contenido(archivo):
+    """
+    Bytes de un archivo subido, buffer o ruta
+    """
+    if isinstance(archivo, (bytes, bytearray)):
+        return bytes(archivo)
+    if hasattr(archivo, 'getvalue'):
+        return archivo.getvalue()
+    if hasattr(archivo, 'read'):
+        archivo.seek(0)
+        return archivo.read()
+    with open(archivo, 'rb') as f:
+        return f.read()
+
+
+def _leer_excel(contenido, hoja, opciones):
+    """
+    Lee una hoja desde bytes (se ejecuta en un proceso del pool)
+    """
+    return pd.read_excel(io.BytesIO(contenido), sheet_name=hoja, **opciones)
+
+
+def procesos_ingesta(config=None):
+    """
+    Cantidad de procesos de lectura ([ingesta] procesos en atm_config.toml)
+    """
+    procesos = seccion_config('ingesta', config).get('procesos')
+    return int(procesos) if procesos else min(4, os.cpu_count() or 1)
+
+
+def obtener_pool():
+    """
+    Pool de procesos compartido entre ejecuciones (se crea la primera vez)
+
+    Los procesos se inician con 'spawn': la app y el servicio corren hilos
+    (Streamlit, servidor HTTP) y un fork heredaría sus locks tomados.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(
+                max_workers=procesos_ingesta(),
+                mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(_POOL.shutdown, cancel_futures=True)
+        return _POOL
+
+
+def _descartar_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = None
+
+
+class IngestaExcel:
+    """
+    Lectura concurrente de hojas Excel en un pool de procesos
+
+    openpyxl retiene el GIL mientras descomprime y parsea el XML, por eso
+    cada hoja se lee en un proceso aparte. Las lecturas se registran con una
+    clave y se esperan por separado, de modo que quien las consume puede
+    empezar a trabajar con la primera que termine.
+    """
+
+    def __init__(self, pool=None, bytes_minimos=BYTES_MINIMOS_POOL):
+        """
+        Args:
+            pool (Executor): Pool a usar (por defecto, el compartido)
+            bytes_minimos (int): Tamaño total desde el que se usa el pool
+        """
+        self._pool = pool
+        self.bytes_minimos = bytes_minimos
+        self._lecturas = {}
+        self._futuros = {}
+
+    def leer(self, clave, archivo, hoja=0, **opciones):
+        """
+        Registra la lectura de una hoja
+
+        Args:
+            clave (str): Identificador de la lectura
+            archivo: Archivo subido, buffer, bytes o ruta
+            hoja (str|int): Hoja a leer
+            **opciones: Argumentos adicionales de pd.read_excel
+        """
+        self._lecturas[clave] = (_contenido(archivo), hoja, opciones)
+        return self
+
+    def iniciar(self, claves=None):
+        """
+        Envía las lecturas registradas al pool
+
+        Si el volumen total es chico o el pool no está disponible, cada hoja
+        se lee en este proceso recién cuando se pide su resultado.
+
+        Args:
+            claves (list): Lecturas a adelantar (por defecto, todas)
+        """
+        claves = [c for c in (self._lecturas if claves is None else claves)
+                  if c in self._lecturas]
+        total = sum(len(self._lecturas[c][0]) for c in claves)
+        if total < self.bytes_minimos:
+            return self
+        try:
+            pool = self._pool or obtener_pool()
+            for clave in claves:
+                self._futuros[clave] = pool.submit(_leer_excel,
+                                                   *self._lecturas[clave])
+        except (BrokenProcessPool, OSError, RuntimeError):
+            self._futuros = {}
+            if self._pool is None:
+                _descartar_pool()
+        return self
+
+    def resultado(self, clave):
+        """
+        DataFrame de una lectura (espera a que termine si está en curso)
+        """
+        futuro = self._futuros.get(clave)
+        if futuro is not None:
+            try:
+                return futuro.result()
+            except BrokenProcessPool:
+                if self._pool is None:
+                    _descartar_pool()
+        return _leer_excel(*self._lecturas[clave])
+
+    def en_orden_de_llegada(self, claves):
+        """
+        Recorre las claves a medida que sus lecturas terminan
+
+        Las lecturas que se hacen en este proceso se entregan en el orden
+        recibido. Los errores de lectura se levantan al pedir resultado().
+        """
+        pendientes = {self._futuros[c]: c for c in claves if c in self._futuros}
+        for clave in claves:
+            if clave not in self._futuros:
+                yield clave
+        while pendientes:
+            listos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                yield pendientes.pop(futuro)
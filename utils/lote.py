@@ -0,0 +1,109 @@
+"""
+Utilidades del modo lote: varios libros de datos ATM contra un mismo TH
+"""
+import io
+import os
+import zipfile
+
+import pandas as pd
+
+
+COLUMNAS_RESUMEN = ['Libro', 'Proceso', 'Registros', 'Encontrados',
+                    'No Encontrados', '% Encontrados']
+
+
+def etiquetas_libros(nombres):
+    """
+    Etiquetas únicas para los libros de un lote (nombre sin extensión)
+
+    Args:
+        nombres (list): Nombres de archivo, en el orden de carga
+
+    Returns:
+        list: Una etiqueta por archivo ('Norte', 'Norte (2)', ...)
+    """
+    etiquetas, usadas = [], set()
+    for nombre in nombres:
+        base = os.path.splitext(os.path.basename(nombre))[0] or 'Libro'
+        etiqueta, n = base, 2
+        while etiqueta in usadas:
+            etiqueta = f'{base} ({n})'
+            n += 1
+        usadas.add(etiqueta)
+        etiquetas.append(etiqueta)
+    return etiquetas
+
+
+def hojas_del_libro(hojas_sel, hojas_libro):
+    """
+    Procesos seleccionados que se pueden ejecutar en un libro
+
+    Un libro sin la hoja elegida para un proceso simplemente no lo ejecuta.
+
+    Args:
+        hojas_sel (dict): Nombre de proceso -> hoja elegida
+        hojas_libro (list): Hojas presentes en el libro
+    """
+    return {nombre: hoja for nombre, hoja in hojas_sel.items()
+            if hoja in hojas_libro}
+
+
+def resumen_lote(metricas):
+    """
+    Tabla resumen de un lote (una fila por libro y proceso, más el total)
+
+    Args:
+        metricas (dict): (libro, proceso) -> métricas de metricas_resultado
+
+    Returns:
+        pd.DataFrame: Columnas COLUMNAS_RESUMEN
+    """
+    filas = []
+    for (libro, proceso), m in metricas.items():
+        encontrados = m.get('encontrados')
+        filas.append([libro, proceso, m['total'], encontrados,
+                      m.get('no_encontrados'), _porcentaje(encontrados, m['total'])])
+    resumen = pd.DataFrame(filas, columns=COLUMNAS_RESUMEN)
+
+    if len(resumen):
+        encontrados = resumen['Encontrados'].sum(min_count=1)
+        total = int(resumen['Registros'].sum())
+        resumen.loc[len(resumen)] = [
+            'Total', f'{resumen["Libro"].nunique()} libro(s)', total,
+            encontrados, resumen['No Encontrados'].sum(min_count=1),
+            _porcentaje(encontrados, total)]
+    return resumen
+
+
+def _porcentaje(encontrados, total):
+    if encontrados is None or pd.isna(encontrados) or not total:
+        return None
+    return round(100 * encontrados / total, 1)
+
+
+def reportes_por_libro(secciones, tol, resumen=None, fecha=None):
+    """
+    Un reporte Excel por libro, empaquetados en un ZIP
+
+    Cada reporte incluye la hoja 'Resumen' del lote completo.
+
+    Args:
+        secciones (dict): Libro -> [(proceso, originales, resultados)]
+        tol (int): Tolerancia utilizada
+        resumen (pd.DataFrame): Resumen del lote (ver resumen_lote)
+        fecha (datetime): Fecha de los reportes
+
+    Returns:
+        bytes: Contenido del ZIP
+    """
+    # openpyxl se carga recién al generar el primer reporte
+    from utils.reporte import escribir_reporte
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for libro, secciones_libro in secciones.items():
+            reporte = io.BytesIO()
+            escribir_reporte(reporte, secciones_libro, tol, fecha, resumen)
+            zf.writestr(f'Resultados_ATM_{libro}.xlsx', reporte.getvalue())
+    return buffer.getvalue()
+
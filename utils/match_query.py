@@ -0,0 +1,139 @@
+import pandas as pd
+import numpy as np
+
+
+class MatchQuery:
+    """
+    Consulta indexada sobre un conjunto de coincidencias
+
+    Construye una sola vez (y solo para las columnas que se consultan) arreglos
+    ordenados para las columnas numéricas y de fecha, y códigos de categoría
+    para ATM y causa. Cada criterio se resuelve con searchsorted o con una
+    búsqueda de códigos y se combina como máscara booleana; solo se
+    materializan las filas finales.
+    """
+    
+    RANGE_COLUMNS = ('Duracion_Downtime_Horas', 'Diferencia_Tiempo_Minutos', 'Fecha_Orden')
+    CATEGORY_COLUMNS = ('ATM_ID', 'Causa_Downtime')
+    
+    def __init__(self, matches_df):
+        """
+        Args:
+            matches_df (pd.DataFrame): DataFrame con coincidencias
+        """
+        self.matches_df = matches_df
+        self._sorted = {}
+        self._codes = {}
+    
+    def __len__(self):
+        return len(self.matches_df)
+    
+    def _sorted_column(self, column):
+        """
+        Devuelve (valores ordenados, posiciones) de una columna de rango, sin nulos
+        """
+        if column not in self._sorted:
+            series = self.matches_df[column]
+            if column == 'Fecha_Orden':
+                values = pd.to_datetime(series, errors='coerce')\
+                           .to_numpy(dtype='datetime64[ns]').view(np.int64)
+                valid = values != np.iinfo(np.int64).min
+            else:
+                values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float)
+                valid = ~np.isnan(values)
+            positions = np.flatnonzero(valid)
+            positions = positions[np.argsort(values[positions], kind='stable')]
+            self._sorted[column] = (values[positions], positions)
+        return self._sorted[column]
+    
+    def _category_codes(self, column):
+        """
+        Devuelve (códigos por fila, {valor: código}) de una columna categórica
+        """
+        if column not in self._codes:
+            codes, uniques = pd.factorize(self.matches_df[column])
+            self._codes[column] = (codes, {v: i for i, v in enumerate(uniques)})
+        return self._codes[column]
+    
+    def _range_mask(self, column, low=None, high=None):
+        """
+        Máscara de filas con low <= valor <= high usando searchsorted
+        """
+        values, positions = self._sorted_column(column)
+        lo = 0 if low is None else np.searchsorted(values, low, side='left')
+        hi = len(values) if high is None else np.searchsorted(values, high, side='right')
+        mask = np.zeros(len(self.matches_df), dtype=bool)
+        mask[positions[lo:hi]] = True
+        return mask
+    
+    def _isin_mask(self, column, wanted):
+        """
+        Máscara de filas cuyo valor está en la lista (incluye nulos si la lista los tiene)
+        """
+        codes, lookup = self._category_codes(column)
+        wanted_codes = [lookup[v] for v in wanted if v in lookup]
+        if any(pd.isna(v) for v in wanted if np.ndim(v) == 0):
+            wanted_codes.append(-1)
+        return np.isin(codes, wanted_codes)
+    
+    @staticmethod
+    def _to_ns(value):
+        return pd.Timestamp(pd.to_datetime(value)).as_unit('ns').value
+    
+    def mask(self, criteria):
+        """
+        Calcula la máscara booleana de los criterios (mismas reglas que
+        WorkOrderMatcher.filter_matches_by_criteria)
+        
+        Args:
+            criteria (dict): Criterios de filtrado
+            
+        Returns:
+            np.ndarray: Máscara booleana por fila
+        """
+        masks = []
+        
+        if 'atm_ids' in criteria and criteria['atm_ids']:
+            masks.append(self._isin_mask('ATM_ID', criteria['atm_ids']))
+        
+        if 'min_duration_hours' in criteria or 'max_duration_hours' in criteria:
+            masks.append(self._range_mask('Duracion_Downtime_Horas',
+                                          criteria.get('min_duration_hours'),
+                                          criteria.get('max_duration_hours')))
+        
+        if 'start_date' in criteria and 'end_date' in criteria:
+            masks.append(self._range_mask('Fecha_Orden',
+                                          self._to_ns(criteria['start_date']),
+                                          self._to_ns(criteria['end_date'])))
+        
+        if 'max_time_diff_minutes' in criteria:
+            masks.append(self._range_mask('Diferencia_Tiempo_Minutos',
+                                          high=criteria['max_time_diff_minutes']))
+        
+        if 'downtime_causes' in criteria and criteria['downtime_causes']:
+            masks.append(self._isin_mask('Causa_Downtime', criteria['downtime_causes']))
+        
+        if not masks:
+            return np.ones(len(self.matches_df), dtype=bool)
+        return np.logical_and.reduce(masks)
+    
+    def indices(self, criteria):
+        """
+        Posiciones (en orden original) de las filas que cumplen los criterios
+        """
+        return np.flatnonzero(self.mask(criteria))
+    
+    def count(self, criteria):
+        """
+        Cantidad de filas que cumplen los criterios, sin materializarlas
+        """
+        return int(np.count_nonzero(self.mask(criteria)))
+    
+    def filter(self, criteria):
+        """
+        Materializa las filas que cumplen los criterios
+        
+        Returns:
+            pd.DataFrame: DataFrame filtrado
+        """
+        return self.matches_df.iloc[self.indices(criteria)].reset_index(drop=True)
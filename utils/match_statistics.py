@@ -0,0 +1,246 @@
+import math
+import numpy as np
+import pandas as pd
+
+
+class TDigest:
+    """
+    Sketch t-digest (variante merging) para cuantiles aproximados y combinables
+    
+    Mientras la cantidad de valores no supera buffer_size se conservan los
+    valores exactos, por lo que los cuantiles de conjuntos chicos son exactos.
+    """
+    
+    def __init__(self, compression=100, buffer_size=500):
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self._buffer = []
+        self._buffered = 0
+    
+    @property
+    def count(self):
+        return float(self.weights.sum()) + self._buffered
+    
+    def update(self, values):
+        """
+        Agrega un arreglo de valores (se ignoran los nulos)
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self._buffer.append(values)
+        self._buffered += len(values)
+        if self._buffered > self.buffer_size:
+            self._compress()
+    
+    def merge(self, other):
+        """
+        Combina otro digest en este
+        """
+        self._buffer.extend(other._buffer)
+        self._buffered += other._buffered
+        if len(other.means):
+            self.means = np.concatenate([self.means, other.means])
+            self.weights = np.concatenate([self.weights, other.weights])
+        if self._buffered > self.buffer_size or len(other.means):
+            self._compress()
+        return self
+    
+    def _compress(self):
+        """
+        Fusiona buffer y centroides respetando el límite de la función de escala k1
+        """
+        if self._buffer:
+            values = np.concatenate(self._buffer)
+            means = np.concatenate([self.means, values])
+            weights = np.concatenate([self.weights, np.ones(len(values))])
+        else:
+            means, weights = self.means, self.weights
+        self._buffer, self._buffered = [], 0
+        
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        
+        def k(q):
+            return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+        
+        new_means, new_weights = [], []
+        cur_mean, cur_weight = means[0], weights[0]
+        cumulative = 0.0
+        k_left = k(0.0)
+        for mean, weight in zip(means[1:], weights[1:]):
+            if k((cumulative + cur_weight + weight) / total) - k_left <= 1:
+                cur_mean += (mean - cur_mean) * weight / (cur_weight + weight)
+                cur_weight += weight
+            else:
+                new_means.append(cur_mean)
+                new_weights.append(cur_weight)
+                cumulative += cur_weight
+                k_left = k(cumulative / total)
+                cur_mean, cur_weight = mean, weight
+        new_means.append(cur_mean)
+        new_weights.append(cur_weight)
+        
+        self.means = np.array(new_means)
+        self.weights = np.array(new_weights)
+    
+    def quantile(self, q, minimum, maximum):
+        """
+        Cuantil q (exacto si no se compactó; interpolado entre centroides si no)
+        """
+        if not len(self.means):
+            if not self._buffered:
+                return np.nan
+            return float(np.quantile(np.concatenate(self._buffer), q))
+        if self._buffer:
+            self._compress()
+        
+        total = self.weights.sum()
+        target = q * total
+        centers = np.cumsum(self.weights) - self.weights / 2
+        points = np.concatenate([[0.0], centers, [total]])
+        values = np.concatenate([[minimum], self.means, [maximum]])
+        return float(np.interp(target, points, values))
+
+
+class RunningStatistics:
+    """
+    Cantidad, media y varianza (Welford/Chan), mínimo y máximo exactos y
+    cuantiles por t-digest de una variable, actualizables por bloques
+    """
+    
+    def __init__(self, compression=100):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.nan
+        self.max = np.nan
+        self.digest = TDigest(compression)
+    
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self._combine(len(values), values.mean(), ((values - values.mean()) ** 2).sum(),
+                      values.min(), values.max())
+        self.digest.update(values)
+    
+    def merge(self, other):
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+            self.digest.merge(other.digest)
+        return self
+    
+    def _combine(self, count, mean, m2, minimum, maximum):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = minimum if np.isnan(self.min) else min(self.min, minimum)
+        self.max = maximum if np.isnan(self.max) else max(self.max, maximum)
+    
+    def summary(self):
+        """
+        Resumen con la forma de duration_stats / time_diff_stats
+        """
+        return {
+            'min': self.min,
+            'max': self.max,
+            'median': self.digest.quantile(0.5, self.min, self.max),
+            'std': math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+        }
+
+
+class MatchStatistics:
+    """
+    Acumulador combinable de las estadísticas de WorkOrderMatcher.get_match_statistics
+    
+    Se actualiza bloque a bloque mientras corre el matching y se puede combinar
+    entre workers, de modo que las estadísticas están listas al terminar sin
+    materializar ni recorrer de nuevo todas las coincidencias.
+    """
+    
+    def __init__(self, compression=100):
+        self.total_matches = 0
+        self.atm_ids = set()
+        self.duration = RunningStatistics(compression)
+        self.time_diff = RunningStatistics(compression)
+    
+    def update(self, matches_df):
+        """
+        Agrega un bloque de coincidencias
+        
+        Args:
+            matches_df (pd.DataFrame): Bloque con las columnas de find_matches
+        """
+        return self.update_arrays(
+            matches_df['ATM_ID'].dropna().unique(),
+            pd.to_numeric(matches_df['Duracion_Downtime_Horas'], errors='coerce'),
+            pd.to_numeric(matches_df['Diferencia_Tiempo_Minutos'], errors='coerce')
+        )
+    
+    def update_arrays(self, atm_ids, durations, time_diffs):
+        """
+        Agrega un bloque a partir de sus arreglos de columnas
+        
+        Args:
+            atm_ids (iterable): ATMs presentes en el bloque
+            durations (np.ndarray): Duracion_Downtime_Horas de cada coincidencia
+            time_diffs (np.ndarray): Diferencia_Tiempo_Minutos de cada coincidencia
+        """
+        if len(time_diffs) == 0:
+            return self
+        self.total_matches += len(time_diffs)
+        self.atm_ids.update(atm_ids)
+        self.duration.update(durations)
+        self.time_diff.update(time_diffs)
+        return self
+    
+    def merge(self, other):
+        """
+        Combina el acumulador de otro worker o bloque
+        """
+        self.total_matches += other.total_matches
+        self.atm_ids |= other.atm_ids
+        self.duration.merge(other.duration)
+        self.time_diff.merge(other.time_diff)
+        return self
+    
+    @classmethod
+    def combine(cls, accumulators):
+        """
+        Combina una secuencia de acumuladores en uno nuevo
+        """
+        result = cls()
+        for accumulator in accumulators:
+            result.merge(accumulator)
+        return result
+    
+    def to_dict(self):
+        """
+        Devuelve el mismo diccionario que WorkOrderMatcher.get_match_statistics
+        """
+        if self.total_matches == 0:
+            return {
+                'total_matches': 0,
+                'unique_atms': 0,
+                'avg_duration_hours': 0,
+                'avg_time_diff_minutes': 0,
+                'duration_stats': {},
+                'time_diff_stats': {}
+            }
+        
+        return {
+            'total_matches': self.total_matches,
+            'unique_atms': len(self.atm_ids),
+            'avg_duration_hours': self.duration.mean if self.duration.count else np.nan,
+            'avg_time_diff_minutes': self.time_diff.mean if self.time_diff.count else np.nan,
+            'duration_stats': self.duration.summary(),
+            'time_diff_stats': self.time_diff.summary()
+        }
@@ -2,33 +2,144 @@ import pandas as pd
 import numpy as np
 from datetime import timedelta
 
+from utils.frame_backend import get_backend
+from utils.match_query import MatchQuery
+from utils.match_statistics import MatchStatistics
+from utils.result_builder import ResultBuilder
+
+_NAT = np.iinfo(np.int64).min
+
+
+def _to_ns(series):
+    """
+    Convierte una serie de fechas a enteros en nanosegundos (NaT -> _NAT)
+    """
+    values = pd.to_datetime(series, errors='coerce').to_numpy(dtype='datetime64[ns]')
+    return values.view(np.int64)
+
+
+def _min_cost_assignment(order_pos, downtime_pos, cost, n_orders, n_downtimes):
+    """
+    Asignación exacta de costo mínimo (algoritmo húngaro) para ATMs pequeños
+    
+    Los pares que no son candidatos reciben un costo mayor que la suma de todos
+    los candidatos, de modo que primero se maximiza la cantidad de pares y luego
+    se minimiza la diferencia total.
+    
+    Returns:
+        np.ndarray: Índices de los candidatos asignados
+    """
+    big = float(cost.sum()) + 1.0
+    matrix = np.full((n_orders, n_downtimes), big)
+    candidate = np.full((n_orders, n_downtimes), -1, dtype=np.int64)
+    matrix[order_pos, downtime_pos] = cost
+    candidate[order_pos, downtime_pos] = np.arange(len(cost))
+    
+    transposed = n_orders > n_downtimes
+    if transposed:
+        matrix = matrix.T
+    rows, cols = _hungarian(matrix)
+    if transposed:
+        rows, cols = cols, rows
+    
+    keep = candidate[rows, cols]
+    return keep[keep >= 0]
+
+
+def _hungarian(matrix):
+    """
+    Algoritmo húngaro con potenciales para una matriz n x m con n <= m
+    
+    Returns:
+        tuple: (filas, columnas) asignadas
+    """
+    n, m = matrix.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = matrix[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            masked = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(masked)) + 1
+            delta = masked[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+    
+    cols = np.flatnonzero(p[1:])
+    rows = p[1:][cols] - 1
+    return rows, cols
+
 class WorkOrderMatcher:
     """
     Clase para encontrar coincidencias entre órdenes de trabajo y registros de downtime
     """
     
-    def __init__(self, tolerance_minutes=30):
+    ASSIGNMENT_MODES = (None, 'greedy', 'optimal')
+    
+    def __init__(self, tolerance_minutes=30, exact_assignment_limit=60, backend=None):
         """
         Inicializa el matcher con tolerancia en minutos
         
         Args:
             tolerance_minutes (int): Tolerancia en minutos para considerar una coincidencia
+            exact_assignment_limit (int): Máximo de órdenes o downtimes por ATM para
+                resolver la asignación óptima exacta en modo 'optimal'
+            backend (str): Motor de la búsqueda de candidatos, 'pandas' o
+                'polars' (ver utils.frame_backend); por defecto, el de la
+                sección [dataframes] de atm_config.toml
         """
         self.tolerance_minutes = tolerance_minutes
         self.tolerance_delta = timedelta(minutes=tolerance_minutes)
+        self.exact_assignment_limit = exact_assignment_limit
+        self.backend = get_backend(backend)
+        self.last_statistics = MatchStatistics()
     
-    def find_matches(self, work_orders_df, downtime_df):
+    def find_matches(self, work_orders_df, downtime_df, assignment=None):
         """
         Encuentra coincidencias entre órdenes de trabajo y downtime
         
         Args:
             work_orders_df (pd.DataFrame): DataFrame con órdenes de trabajo
             downtime_df (pd.DataFrame): DataFrame con registros de downtime
+            assignment (str): None devuelve todos los pares que coinciden;
+                'greedy' o 'optimal' asignan cada orden a lo sumo a un downtime
+                y cada downtime a lo sumo a una orden, minimizando la suma de
+                Diferencia_Tiempo_Minutos
             
         Returns:
             pd.DataFrame: DataFrame con las coincidencias encontradas
         """
-        matches = []
+        if assignment not in self.ASSIGNMENT_MODES:
+            raise ValueError(
+                f"Modo de asignación inválido: {assignment}. "
+                f"Opciones: {self.ASSIGNMENT_MODES}"
+            )
+        
+        # Estadísticas acumuladas por ATM mientras corre el matching
+        self.last_statistics = MatchStatistics()
         
         # Obtener ATMs comunes entre ambos datasets
         common_atms = set(work_orders_df['ATM_ID']) & set(downtime_df['ATM_ID'])
@@ -37,102 +148,101 @@ class WorkOrderMatcher:
             # Retornar DataFrame vacío con la estructura esperada
             return self._create_empty_matches_df()
         
-        # Procesar cada ATM común
-        for atm_id in common_atms:
-            atm_matches = self._find_atm_matches(
-                work_orders_df[work_orders_df['ATM_ID'] == atm_id],
-                downtime_df[downtime_df['ATM_ID'] == atm_id],
-                atm_id
-            )
-            matches.extend(atm_matches)
+        # Posiciones por ATM y fechas en nanosegundos, calculadas una sola vez
+        order_groups = work_orders_df.groupby('ATM_ID', sort=False).indices
+        downtime_groups = downtime_df.groupby('ATM_ID', sort=False).indices
+        order_times = _to_ns(work_orders_df['Fecha_Hora'])
+        starts = _to_ns(downtime_df['Fecha_Inicio'])
+        ends = _to_ns(downtime_df['Fecha_Fin'])
+        durations = pd.to_numeric(downtime_df['Duracion_Horas'], errors='coerce')\
+                      .to_numpy(dtype=float)
         
-        # Convertir a DataFrame
-        if matches:
-            matches_df = pd.DataFrame(matches)
-            # Ordenar por ATM_ID y fecha de orden
-            matches_df = matches_df.sort_values(['ATM_ID', 'Fecha_Orden'])
-            matches_df = matches_df.reset_index(drop=True)
-        else:
-            matches_df = self._create_empty_matches_df()
-        
-        return matches_df
-    
-    def _find_atm_matches(self, work_orders, downtime_records, atm_id):
-        """
-        Encuentra coincidencias para un ATM específico
+        builder = ResultBuilder()
+        time_diffs = []
         
-        Args:
-            work_orders (pd.DataFrame): Órdenes de trabajo del ATM
-            downtime_records (pd.DataFrame): Registros de downtime del ATM
-            atm_id (str): ID del ATM
+        # Procesar cada ATM común
+        candidates = self.backend.candidates(
+            common_atms, order_groups, downtime_groups, order_times, starts, ends,
+            int(pd.Timedelta(self.tolerance_delta).value),
+            order_atms=work_orders_df['ATM_ID'].to_numpy(),
+            downtime_atms=downtime_df['ATM_ID'].to_numpy())
+        for atm_id, order_pos, downtime_pos, time_diff in candidates:
+            orders, downtimes = order_groups[atm_id], downtime_groups[atm_id]
+            if assignment is not None and len(time_diff):
+                keep = self._select_assignment(order_pos, downtime_pos, time_diff,
+                                               len(orders), len(downtimes), assignment)
+                order_pos, downtime_pos, time_diff = \
+                    order_pos[keep], downtime_pos[keep], time_diff[keep]
+            if len(time_diff) == 0:
+                continue
             
-        Returns:
-            list: Lista de coincidencias encontradas
-        """
-        matches = []
+            builder.extend(orders[order_pos], downtimes[downtime_pos])
+            time_diffs.append(time_diff)
+            self.last_statistics.update_arrays(
+                [atm_id], durations[downtimes[downtime_pos]], time_diff)
         
-        for _, order in work_orders.iterrows():
-            order_datetime = order['Fecha_Hora']
-            
-            # Buscar registros de downtime que coincidan temporalmente
-            for _, downtime in downtime_records.iterrows():
-                if self._is_temporal_match(order_datetime, downtime):
-                    match = self._create_match_record(order, downtime, atm_id)
-                    matches.append(match)
+        if len(builder) == 0:
+            return self._create_empty_matches_df()
+        
+        # Ordenar por ATM_ID y fecha de orden (empates: orden y downtime de origen)
+        atm_codes = pd.factorize(work_orders_df['ATM_ID'].to_numpy()[builder.left],
+                                 sort=True)[0]
+        order = np.lexsort((builder.right, builder.left,
+                            order_times[builder.left], atm_codes))
         
-        return matches
+        return builder.build({
+            'ATM_ID': ('left', work_orders_df['ATM_ID']),
+            'Fecha_Orden': ('left', work_orders_df['Fecha_Hora']),
+            'Descripcion_Orden': ('left', work_orders_df['Descripcion']),
+            'Inicio_Downtime': ('right', downtime_df['Fecha_Inicio']),
+            'Fin_Downtime': ('right', downtime_df['Fecha_Fin']),
+            'Causa_Downtime': ('right', downtime_df['Causa']),
+            'Duracion_Downtime_Horas': ('right', downtime_df['Duracion_Horas']),
+            'Diferencia_Tiempo_Minutos': np.concatenate(time_diffs),
+            'Tolerancia_Minutos': self.tolerance_minutes
+        }, order)
     
-    def _is_temporal_match(self, order_datetime, downtime_record):
+    def _select_assignment(self, order_pos, downtime_pos, cost, n_orders, n_downtimes,
+                           assignment):
         """
-        Verifica si hay coincidencia temporal entre una orden y un downtime
+        Selecciona la asignación uno a uno entre los candidatos de un ATM
+        
+        En modo 'optimal' los ATMs pequeños se resuelven de forma exacta; el
+        resto usa la pasada greedy, sin construir una matriz de costos densa.
         
-        Args:
-            order_datetime (pd.Timestamp): Fecha y hora de la orden
-            downtime_record (pd.Series): Registro de downtime
-            
         Returns:
-            bool: True si hay coincidencia temporal
+            np.ndarray: Índices de los candidatos asignados
         """
-        downtime_start = downtime_record['Fecha_Inicio']
-        downtime_end = downtime_record['Fecha_Fin']
-        
-        # Calcular ventana de tolerancia alrededor del inicio del downtime
-        tolerance_start = downtime_start - self.tolerance_delta
-        tolerance_end = downtime_start + self.tolerance_delta
-        
-        # Verificar si la orden está dentro de la ventana de tolerancia
-        # o si la orden está entre el inicio y fin del downtime
-        return (tolerance_start <= order_datetime <= tolerance_end) or \
-               (downtime_start <= order_datetime <= downtime_end)
+        if assignment == 'optimal' and \
+                max(n_orders, n_downtimes) <= self.exact_assignment_limit:
+            return _min_cost_assignment(order_pos, downtime_pos, cost,
+                                        n_orders, n_downtimes)
+        return self._greedy_assignment(order_pos, downtime_pos, cost,
+                                       n_orders, n_downtimes)
     
-    def _create_match_record(self, order, downtime, atm_id):
+    def _greedy_assignment(self, order_pos, downtime_pos, cost, n_orders, n_downtimes):
         """
-        Crea un registro de coincidencia
+        Asignación greedy: recorre los candidatos de menor a mayor diferencia
+        y toma cada par cuyos extremos sigan libres
         
-        Args:
-            order (pd.Series): Registro de orden de trabajo
-            downtime (pd.Series): Registro de downtime
-            atm_id (str): ID del ATM
-            
         Returns:
-            dict: Registro de coincidencia
-        """
-        # Calcular diferencia de tiempo en minutos
-        time_diff_minutes = abs((order['Fecha_Hora'] - downtime['Fecha_Inicio']).total_seconds() / 60)
-        
-        match_record = {
-            'ATM_ID': atm_id,
-            'Fecha_Orden': order['Fecha_Hora'],
-            'Descripcion_Orden': order['Descripcion'],
-            'Inicio_Downtime': downtime['Fecha_Inicio'],
-            'Fin_Downtime': downtime['Fecha_Fin'],
-            'Causa_Downtime': downtime['Causa'],
-            'Duracion_Downtime_Horas': downtime['Duracion_Horas'],
-            'Diferencia_Tiempo_Minutos': time_diff_minutes,
-            'Tolerancia_Minutos': self.tolerance_minutes
-        }
+            np.ndarray: Índices de los candidatos asignados
+        """
+        order_used = np.zeros(n_orders, dtype=bool)
+        downtime_used = np.zeros(n_downtimes, dtype=bool)
+        limit = min(n_orders, n_downtimes)
+        keep = []
+        
+        for k in np.lexsort((downtime_pos, order_pos, cost)):
+            o, d = order_pos[k], downtime_pos[k]
+            if order_used[o] or downtime_used[d]:
+                continue
+            order_used[o] = downtime_used[d] = True
+            keep.append(k)
+            if len(keep) == limit:
+                break
         
-        return match_record
+        return np.array(keep, dtype=np.int64)
     
     def _create_empty_matches_df(self):
         """
@@ -150,16 +260,21 @@ class WorkOrderMatcher:
         
         return pd.DataFrame(columns=columns)
     
-    def get_match_statistics(self, matches_df):
+    def get_match_statistics(self, matches_df=None):
         """
         Calcula estadísticas de las coincidencias encontradas
         
         Args:
-            matches_df (pd.DataFrame): DataFrame con coincidencias
+            matches_df (pd.DataFrame): DataFrame con coincidencias. Si se omite,
+                se devuelven las estadísticas acumuladas durante el último
+                find_matches (mediana aproximada por t-digest en conjuntos grandes)
             
         Returns:
             dict: Estadísticas de las coincidencias
         """
+        if matches_df is None:
+            return self.last_statistics.to_dict()
+        
         if len(matches_df) == 0:
             return {
                 'total_matches': 0,
@@ -191,58 +306,32 @@ class WorkOrderMatcher:
         
         return stats
     
+    def build_query(self, matches_df):
+        """
+        Crea una consulta indexada reutilizable sobre las coincidencias
+        
+        Args:
+            matches_df (pd.DataFrame): DataFrame con coincidencias
+            
+        Returns:
+            MatchQuery: Consulta para filtrar o contar repetidamente sin copias
+        """
+        return MatchQuery(matches_df)
+    
     def filter_matches_by_criteria(self, matches_df, criteria):
         """
         Filtra coincidencias basándose en criterios específicos
         
         Args:
-            matches_df (pd.DataFrame): DataFrame con coincidencias
+            matches_df (pd.DataFrame | MatchQuery): Coincidencias, o una consulta
+                creada con build_query para reutilizar sus índices
             criteria (dict): Criterios de filtrado
             
         Returns:
             pd.DataFrame: DataFrame filtrado
         """
-        filtered_df = matches_df.copy()
-        
-        # Filtrar por ATMs específicos
-        if 'atm_ids' in criteria and criteria['atm_ids']:
-            filtered_df = filtered_df[filtered_df['ATM_ID'].isin(criteria['atm_ids'])]
-        
-        # Filtrar por duración mínima
-        if 'min_duration_hours' in criteria:
-            filtered_df = filtered_df[
-                filtered_df['Duracion_Downtime_Horas'] >= criteria['min_duration_hours']
-            ]
-        
-        # Filtrar por duración máxima
-        if 'max_duration_hours' in criteria:
-            filtered_df = filtered_df[
-                filtered_df['Duracion_Downtime_Horas'] <= criteria['max_duration_hours']
-            ]
-        
-        # Filtrar por rango de fechas
-        if 'start_date' in criteria and 'end_date' in criteria:
-            start_date = pd.to_datetime(criteria['start_date'])
-            end_date = pd.to_datetime(criteria['end_date'])
-            
-            filtered_df = filtered_df[
-                (filtered_df['Fecha_Orden'] >= start_date) &
-                (filtered_df['Fecha_Orden'] <= end_date)
-            ]
-        
-        # Filtrar por diferencia de tiempo máxima
-        if 'max_time_diff_minutes' in criteria:
-            filtered_df = filtered_df[
-                filtered_df['Diferencia_Tiempo_Minutos'] <= criteria['max_time_diff_minutes']
-            ]
-        
-        # Filtrar por causa de downtime
-        if 'downtime_causes' in criteria and criteria['downtime_causes']:
-            filtered_df = filtered_df[
-                filtered_df['Causa_Downtime'].isin(criteria['downtime_causes'])
-            ]
-        
-        return filtered_df.reset_index(drop=True)
+        query = matches_df if isinstance(matches_df, MatchQuery) else MatchQuery(matches_df)
+        return query.filter(criteria)
     
     def update_tolerance(self, new_tolerance_minutes):
         """
@@ -0,0 +1,441 @@
+"""
+Métricas de operación en formato de texto de Prometheus
+
+Uso:
+    python -m utils.metricas --puerto 9108
+    python -m utils.metricas --archivo /var/lib/node_exporter/atm.prom
+
+Contadores e histogramas por corrida: filas leídas por hoja, filas del TH,
+resultados por estado, duración de cada etapa, tamaño y tiempo de armado
+del reporte y espera en cola; la memoria máxima del proceso es un gauge. Se actualizan una vez por
+corrida o por etapa (nunca por fila), a partir del resumen que ya arma cada
+corrida, así que no agregan costo a los procesos. Se publican en un
+endpoint local (/metrics) o en un archivo para el textfile collector de
+node_exporter, según la sección [metricas] de atm_config.toml.
+"""
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.config import seccion_config
+
+TIPO_CONTENIDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Límites de los histogramas
+LIMITES_SEGUNDOS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+LIMITES_BYTES = tuple(2**n for n in range(16, 34, 2))  # 64 KB a 8 GB
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _numero(valor):
+    if valor == math.inf:
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) and not valor.is_integer() \
+        else str(int(valor))
+
+
+def _etiquetas(nombres, valores, extra=''):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas, lock):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = lock
+        self._series = {}
+
+    def _clave(self, etiquetas):
+        faltan = set(self.etiquetas) ^ set(etiquetas)
+        if faltan:
+            raise ValueError(f"{self.nombre}: etiquetas esperadas {list(self.etiquetas)}")
+        return tuple(str(etiquetas[n]) for n in self.etiquetas)
+
+    def lineas(self):
+        yield f'# HELP {self.nombre} {self.ayuda}'
+        yield f'# TYPE {self.nombre} {self.tipo}'
+
+
+class Contador(_Metrica):
+    """
+    Contador acumulado por combinación de etiquetas
+    """
+    tipo = 'counter'
+
+    def sumar(self, valor=1, **etiquetas):
+        if valor < 0:
+            raise ValueError(f"{self.nombre}: un contador no puede disminuir")
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._series[clave] = self._series.get(clave, 0) + valor
+
+    def valor(self, **etiquetas):
+        return self._series.get(self._clave(etiquetas), 0)
+
+    def lineas(self):
+        yield from super().lineas()
+        for clave, valor in sorted(self._series.items()):
+            yield f'{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}'
+
+
+class Histograma(_Metrica):
+    """
+    Histograma con límites fijos por combinación de etiquetas
+    """
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas, lock, limites=LIMITES_SEGUNDOS):
+        super().__init__(nombre, ayuda, etiquetas, lock)
+        self.limites = tuple(sorted(limites)) + (math.inf,)
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        # Posición del primer límite >= valor (los conteos se acumulan al exportar)
+        posicion = next(i for i, limite in enumerate(self.limites) if valor <= limite)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * len(self.limites), 0, 0]
+            serie[0][posicion] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def conteo(self, **etiquetas):
+        serie = self._series.get(self._clave(etiquetas))
+        return serie[2] if serie else 0
+
+    def lineas(self):
+        yield from super().lineas()
+        for clave, (conteos, suma, total) in sorted(self._series.items()):
+            acumulado = 0
+            for limite, n in zip(self.limites, conteos):
+                acumulado += n
+                le = f'le="{_numero(limite)}"'
+                yield f'{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, le)} {acumulado}'
+            etiquetas = _etiquetas(self.etiquetas, clave)
+            yield f'{self.nombre}_sum{etiquetas} {_numero(suma)}'
+            yield f'{self.nombre}_count{etiquetas} {total}'
+
+
+class Medidor(_Metrica):
+    """
+    Gauge: último valor por combinación de etiquetas
+    """
+    tipo = 'gauge'
+
+    def fijar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._series[clave] = valor
+
+    def valor(self, **etiquetas):
+        return self._series.get(self._clave(etiquetas))
+
+    def lineas(self):
+        yield from super().lineas()
+        for clave, valor in sorted(self._series.items()):
+            yield f'{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}'
+
+
+class RegistroMetricas:
+    """
+    Conjunto de métricas de un proceso, exportable en formato Prometheus
+    """
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _agregar(self, metrica):
+        if metrica.nombre in self._metricas:
+            raise ValueError(f"Métrica duplicada: {metrica.nombre}")
+        self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._agregar(Contador(nombre, ayuda, etiquetas, self._lock))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), limites=LIMITES_SEGUNDOS):
+        return self._agregar(Histograma(nombre, ayuda, etiquetas, self._lock, limites))
+
+    def medidor(self, nombre, ayuda, etiquetas=()):
+        return self._agregar(Medidor(nombre, ayuda, etiquetas, self._lock))
+
+    def texto(self):
+        """
+        Todas las métricas en el formato de texto de Prometheus
+        """
+        with self._lock:
+            return ''.join(f'{linea}\n' for metrica in self._metricas.values()
+                           for linea in metrica.lineas())
+
+    def escribir(self, ruta):
+        """
+        Escribe las métricas en un archivo (escritura atómica, como pide el
+        textfile collector)
+        """
+        temporal = f'{ruta}.{os.getpid()}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.write(self.texto())
+        os.replace(temporal, ruta)
+
+    def servir(self, host='127.0.0.1', puerto=9108):
+        """
+        Publica las métricas en http://host:puerto/metrics (en un hilo aparte)
+
+        Returns:
+            ThreadingHTTPServer: Servidor en ejecución
+        """
+        registro = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def log_message(self, formato, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                cuerpo = registro.texto().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', TIPO_CONTENIDO)
+                self.send_header('Content-Length', str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+        servidor = ThreadingHTTPServer((host, puerto), Manejador)
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, daemon=True,
+                         name='metricas').start()
+        return servidor
+
+
+REGISTRO = RegistroMetricas()
+
+CORRIDAS = REGISTRO.contador(
+    'atm_corridas_total', 'Corridas de procesamiento', ['origen', 'resultado'])
+FILAS = REGISTRO.contador(
+    'atm_filas_leidas_total', 'Filas leídas por hoja procesada', ['origen', 'proceso'])
+FILAS_TH = REGISTRO.contador(
+    'atm_filas_th_total', 'Filas del TH Downtime indexadas', ['origen'])
+ESTADOS = REGISTRO.contador(
+    'atm_resultados_total', 'Filas de resultado por estado',
+    ['origen', 'proceso', 'estado'])
+ERRORES = REGISTRO.contador(
+    'atm_errores_total', 'Procesos de hoja que terminaron con error',
+    ['origen', 'proceso'])
+DURACION = REGISTRO.histograma(
+    'atm_corrida_segundos', 'Duración de una corrida completa', ['origen'])
+ETAPAS = REGISTRO.histograma(
+    'atm_etapa_segundos', 'Duración de cada etapa del pipeline',
+    ['origen', 'etapa', 'cache'])
+ESPERA = REGISTRO.histograma(
+    'atm_cola_espera_segundos', 'Espera en cola hasta empezar la corrida', ['origen'])
+REPORTE_BYTES = REGISTRO.histograma(
+    'atm_reporte_bytes', 'Tamaño del reporte generado', ['origen'], LIMITES_BYTES)
+REPORTE_SEGUNDOS = REGISTRO.histograma(
+    'atm_reporte_segundos', 'Tiempo de armado del reporte', ['origen'])
+# ru_maxrss es el máximo desde que arrancó el proceso, no el de cada corrida:
+# como histograma repetiría el pico de corridas anteriores
+MEMORIA = REGISTRO.medidor(
+    'atm_memoria_pico_bytes', 'Memoria residente máxima del proceso desde su '
+    'inicio, al terminar la última corrida', ['origen'])
+
+_exportacion = {'archivo': None, 'servidor': None}
+_lock_exportacion = threading.Lock()
+
+
+def memoria_pico():
+    """
+    Memoria residente máxima del proceso en bytes (None si no se puede medir)
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB; macOS, bytes
+    return maximo if sys.platform == 'darwin' else maximo * 1024
+
+
+def _proceso(etapa):
+    # En modo lote las etapas llevan el libro ('Lectura <libro> · <proceso>');
+    # se agrega por proceso para no crear una serie por libro
+    etapa = str(etapa)
+    if ' · ' not in etapa:
+        return etapa
+    cabeza, proceso = etapa.rsplit(' · ', 1)
+    prefijo = next((p for p in ('Lectura ', 'Cubo ') if cabeza.startswith(p)), '')
+    return prefijo + proceso
+
+
+def resumen_corrida(pipeline, resultados):
+    """
+    Datos de una corrida para registrar_corrida (serializable, para
+    devolverlo desde un proceso del pool)
+
+    Args:
+        pipeline (Pipeline): Pipeline ejecutado
+        resultados (dict): Nombre -> (df_in, df_out)
+
+    Returns:
+        dict: filas, estados, filas_th, etapas y memoria_pico
+    """
+    from utils.visor import columna_estado
+
+    estados = {}
+    for nombre, (_, df_out) in resultados.items():
+        columna = columna_estado(df_out)
+        if columna:
+            estados[nombre] = {str(k): int(v) for k, v in
+                               df_out[columna].value_counts(dropna=False).items()}
+    th = pipeline.resultado('Índice TH')
+    return {
+        'filas': {n: len(df_in) for n, (df_in, _) in resultados.items()},
+        'estados': estados,
+        'filas_th': len(th) if th is not None else None,
+        'etapas': pipeline.resumen().to_dict(orient='records'),
+        'memoria_pico': memoria_pico(),
+    }
+
+
+def registrar_corrida(resumen, origen, espera=None):
+    """
+    Registra una corrida terminada (una actualización por hoja y por etapa)
+
+    Args:
+        resumen (dict): filas, estados, filas_th, etapas, errores, segundos,
+            reporte_bytes, reporte_segundos y memoria_pico (todas opcionales)
+        origen (str): app, servicio o vigilancia
+        espera (float): Segundos en cola antes de empezar
+    """
+    errores = resumen.get('errores') or {}
+    CORRIDAS.sumar(origen=origen, resultado='con_errores' if errores else 'ok')
+    for nombre, filas in (resumen.get('filas') or {}).items():
+        FILAS.sumar(filas, origen=origen, proceso=_proceso(nombre))
+    for nombre, por_estado in (resumen.get('estados') or {}).items():
+        for estado, filas in por_estado.items():
+            ESTADOS.sumar(filas, origen=origen, proceso=_proceso(nombre), estado=estado)
+    for nombre in errores:
+        ERRORES.sumar(origen=origen, proceso=_proceso(nombre))
+    if resumen.get('filas_th') is not None:
+        FILAS_TH.sumar(resumen['filas_th'], origen=origen)
+    for etapa in resumen.get('etapas') or []:
+        ETAPAS.observar(etapa['Segundos'], origen=origen, etapa=_proceso(etapa['Etapa']),
+                        cache='si' if etapa['Estado'] == 'Caché' else 'no')
+    if resumen.get('segundos') is not None:
+        DURACION.observar(resumen['segundos'], origen=origen)
+    if espera is not None:
+        ESPERA.observar(max(espera, 0.0), origen=origen)
+    if resumen.get('memoria_pico') is not None:
+        MEMORIA.fijar(resumen['memoria_pico'], origen=origen)
+    if resumen.get('reporte_bytes') is not None:
+        REPORTE_BYTES.observar(resumen['reporte_bytes'], origen=origen)
+        REPORTE_SEGUNDOS.observar(resumen['reporte_segundos'], origen=origen)
+    exportar()
+
+
+def registrar_reporte(tamano, segundos, origen):
+    """
+    Registra un reporte generado fuera de una corrida (p. ej. al descargarlo
+    desde la app)
+    """
+    REPORTE_BYTES.observar(tamano, origen=origen)
+    REPORTE_SEGUNDOS.observar(segundos, origen=origen)
+    exportar()
+
+
+def configurar_exportacion(config=None, archivo=None, puerto=None, host=None):
+    """
+    Activa la publicación de las métricas según la sección [metricas]
+
+    El endpoint se inicia una sola vez por proceso; las llamadas siguientes
+    (p. ej. en cada rerun de la app) no hacen nada.
+
+    Args:
+        config (dict): Configuración (por defecto, atm_config.toml)
+        archivo (str): Archivo para el textfile collector ([metricas] archivo)
+        puerto (int): Puerto del endpoint /metrics ([metricas] puerto; 0 = no)
+        host (str): Interfaz del endpoint ([metricas] host)
+
+    Returns:
+        dict: 'archivo' y 'servidor' activos
+    """
+    seccion = seccion_config('metricas', config)
+    archivo = archivo or seccion.get('archivo') or None
+    puerto = puerto if puerto is not None else int(seccion.get('puerto', 0) or 0)
+    host = host or seccion.get('host', '127.0.0.1')
+    with _lock_exportacion:
+        if archivo:
+            _exportacion['archivo'] = archivo
+        if puerto and _exportacion['servidor'] is None:
+            try:
+                _exportacion['servidor'] = REGISTRO.servir(host, puerto)
+            except OSError:
+                # Otro proceso (p. ej. otra instancia de la app) ya lo publica
+                pass
+    exportar()
+    return dict(_exportacion)
+
+
+def exportar():
+    """
+    Escribe el archivo del textfile collector, si está configurado
+    """
+    archivo = _exportacion['archivo']
+    if archivo:
+        try:
+            REGISTRO.escribir(archivo)
+        except OSError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Publica las métricas de un procesamiento de ejemplo')
+    parser.add_argument('--puerto', type=int, help='Puerto del endpoint /metrics')
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--archivo', help='Archivo para el textfile collector')
+    parser.add_argument('--filas', type=int, default=2000,
+                        help='Filas de datos del libro sintético')
+    args = parser.parse_args(argv)
+
+    from utils.sinteticos import libros_sinteticos
+    from utils.pipeline import ejecutar_sin_interfaz
+
+    exportacion = configurar_exportacion(archivo=args.archivo, puerto=args.puerto,
+                                         host=args.host)
+    contenido_th, contenido_datos = libros_sinteticos(filas_datos=args.filas)
+    inicio = time.perf_counter()
+    pipeline, resultados, errores = ejecutar_sin_interfaz(
+        contenido_th, contenido_datos,
+        {'Exclusiones-CMM': 'CMM', 'Base Fallas': 'BF', 'Base Fallas NCR': 'NCR'}, 30)
+    resumen = resumen_corrida(pipeline, resultados)
+    registrar_corrida({**resumen, 'errores': errores,
+                       'segundos': time.perf_counter() - inicio}, 'ejemplo')
+    print(REGISTRO.texto(), end='')
+    if exportacion['servidor'] is not None:
+        servidor = exportacion['servidor']
+        print(f"# Métricas en http://{servidor.server_address[0]}:"
+              f"{servidor.server_port}/metrics (Ctrl+C para salir)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,626 @@
+import functools
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from utils.almacen import ResultadoGuardado
+from utils.bloques import leer_hoja_por_bloques, procesar_por_bloques
+from utils.config import seccion_config
+from utils.cubo import CuboDowntime
+from utils.ingesta import IngestaExcel
+from utils.procesamiento import (IndiceTH, construir_matriz_ncr,
+                                 limpiar_th_downtime, procesar_base_fallas,
+                                 procesar_base_fallas_ncr,
+                                 procesar_exclusiones_cmm)
+
+_FALTA = object()
+
+# Subir al cambiar el formato de los resultados guardados en disco
+VERSION_CACHE = '1'
+
+
+def _alimentar(h, valor):
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        h.update(b'b')
+        h.update(valor)
+    elif isinstance(valor, (pd.DataFrame, pd.Series)):
+        h.update(b'p')
+        etiquetas = valor.columns if isinstance(valor, pd.DataFrame) else [valor.name]
+        h.update(repr(list(etiquetas)).encode())
+        h.update(pd.util.hash_pandas_object(valor).to_numpy().tobytes())
+    elif isinstance(valor, dict):
+        h.update(b'd')
+        for clave in sorted(valor, key=repr):
+            _alimentar(h, clave)
+            _alimentar(h, valor[clave])
+    elif isinstance(valor, (list, tuple)):
+        h.update(b'l%d' % len(valor))
+        for v in valor:
+            _alimentar(h, v)
+    elif hasattr(valor, 'getvalue'):
+        _alimentar(h, valor.getvalue())
+    elif callable(valor):
+        h.update(f'{valor.__module__}.{valor.__qualname__}'.encode())
+        h.update(_version_modulo(valor.__module__))
+        codigo = getattr(valor, '__code__', None)
+        if codigo is not None:
+            _alimentar_codigo(h, codigo)
+    else:
+        h.update(repr(valor).encode())
+
+
+def _alimentar_codigo(h, codigo):
+    """
+    Bytecode y constantes de una función (incluidas las funciones anidadas):
+    cambiar un umbral o un texto literal también cambia la huella
+    """
+    h.update(codigo.co_code)
+    for constante in codigo.co_consts:
+        if hasattr(constante, 'co_code'):
+            _alimentar_codigo(h, constante)
+        else:
+            h.update(repr(constante).encode())
+
+
+@functools.lru_cache(maxsize=None)
+def _version_modulo(nombre):
+    """
+    Sal de versión del módulo de una función: VERSION_CACHE y el hash de su
+    código fuente, así un cambio en las funciones que llama (y que no forman
+    parte de su bytecode) invalida también los resultados guardados en disco
+    """
+    h = hashlib.blake2b(VERSION_CACHE.encode(), digest_size=8)
+    archivo = getattr(sys.modules.get(nombre), '__file__', None)
+    if archivo:
+        try:
+            with open(archivo, 'rb') as f:
+                h.update(f.read())
+        except OSError:
+            pass
+    return h.digest()
+
+
+def huella(valor):
+    """
+    Huella estable de un valor (bytes, archivos subidos, DataFrames,
+    funciones o estructuras de valores simples)
+
+    Returns:
+        str: Hash hexadecimal
+    """
+    h = hashlib.blake2b(digest_size=16)
+    _alimentar(h, valor)
+    return h.hexdigest()
+
+
+class CacheEtapas:
+    """
+    Caché de resultados de etapas indexada por huella
+
+    Mantiene en memoria las últimas entradas usadas (LRU) y, si se configura
+    un directorio, guarda además cada resultado serializable en disco para
+    reutilizarlo entre sesiones; en disco se eliminan las entradas sin uso
+    por más de ttl_horas y, si superan max_mb_disco, las de uso más
+    antiguo. Los resultados que administran archivos
+    propios (por ejemplo, SpoolResultados) quedan solo en memoria; al
+    desalojarse la caché solo suelta su referencia, y los archivos se
+    eliminan cuando ninguna sesión lo usa.
+
+    Con un AlmacenResultados, todo resultado serializable (DataFrames,
+    índice TH, cubos, matriz NCR...) se guarda comprimido en el almacén
+    (compartido, con vencimiento y tope de memoria) y la caché solo conserva
+    la referencia; un valor vencido en el almacén cuenta como ausente. Lo
+    que queda en memoria (spools, valores no serializables) vence con el
+    mismo TTL del almacén. Es segura entre hilos, así que una sola caché
+    puede servir a todas las sesiones de la app.
+    """
+
+    def __init__(self, max_entradas=32, directorio=None, almacen=None,
+                 max_mb_disco=2048, ttl_horas=168):
+        """
+        Args:
+            max_entradas (int): Entradas a mantener en memoria
+            directorio (str): Carpeta para la caché en disco (opcional)
+            almacen (AlmacenResultados): Almacén comprimido (opcional)
+            max_mb_disco (float): Tamaño máximo de la caché en disco
+            ttl_horas (float): Horas sin uso tras las que vence una entrada
+                en disco
+        """
+        self.max_entradas = max_entradas
+        self.directorio = directorio
+        self.almacen = almacen
+        self.max_bytes_disco = max_mb_disco * 2**20
+        self.ttl_disco = ttl_horas * 3600
+        self._memoria = OrderedDict()
+        # Último uso de los valores en memoria que no están en el almacén
+        self._usos = {}
+        self._lock = threading.RLock()
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+    @classmethod
+    def desde_config(cls, config=None, almacen=None):
+        """
+        Crea la caché según la sección [pipeline] de atm_config.toml
+        """
+        seccion = seccion_config('pipeline', config)
+        return cls(int(seccion.get('max_entradas', 32)),
+                   seccion.get('directorio_cache') or None, almacen,
+                   **limites_disco(config))
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f'{clave}.pkl')
+
+    def __contains__(self, clave):
+        with self._lock:
+            self._purgar()
+            if clave in self._memoria:
+                valor = self._memoria[clave]
+                return not isinstance(valor, ResultadoGuardado) or valor.disponible
+        return bool(self.directorio and os.path.exists(self._ruta(clave)))
+
+    def __len__(self):
+        return len(self._memoria)
+
+    def obtener(self, clave, defecto=None):
+        """
+        Resultado guardado para una huella (defecto si no está)
+        """
+        with self._lock:
+            self._purgar()
+            valor = self._memoria.get(clave, _FALTA)
+            if valor is not _FALTA:
+                self._memoria.move_to_end(clave)
+                if clave in self._usos:
+                    self._usos[clave] = time.monotonic()
+        if valor is not _FALTA:
+            if not isinstance(valor, ResultadoGuardado):
+                return valor
+            valor = self.almacen.obtener(clave, _FALTA)
+            if valor is not _FALTA:
+                return valor
+            with self._lock:
+                self._memoria.pop(clave, None)
+        if self.directorio and os.path.exists(self._ruta(clave)):
+            try:
+                with open(self._ruta(clave), 'rb') as f:
+                    valor = pickle.load(f)
+                # La fecha de modificación marca el último uso (ver podar_disco)
+                os.utime(self._ruta(clave))
+            except Exception:
+                return defecto
+            self._recordar(clave, valor)
+            return valor
+        return defecto
+
+    def guardar(self, clave, valor):
+        """
+        Guarda el resultado de una etapa
+        """
+        self._recordar(clave, valor)
+        if self.directorio and not hasattr(valor, 'cerrar'):
+            # Se escribe a un temporal y se renombra: otros procesos que
+            # comparten el directorio nunca ven un archivo a medio escribir
+            temporal = f'{self._ruta(clave)}.{os.getpid()}.tmp'
+            try:
+                with open(temporal, 'wb') as f:
+                    pickle.dump(valor, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temporal, self._ruta(clave))
+            except Exception:
+                # Resultados no serializables quedan solo en memoria
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+            self.podar_disco()
+
+    def podar_disco(self):
+        """
+        Elimina del directorio las entradas vencidas y, si la caché supera
+        su tamaño máximo, las de uso más antiguo
+
+        Returns:
+            int: Entradas eliminadas
+        """
+        if not self.directorio:
+            return 0
+        entradas = []
+        with os.scandir(self.directorio) as it:
+            for entrada in it:
+                if entrada.name.endswith('.pkl'):
+                    try:
+                        estado = entrada.stat()
+                    except OSError:
+                        continue
+                    entradas.append((estado.st_mtime, estado.st_size, entrada.path))
+        entradas.sort()
+        ahora = time.time()
+        total = sum(tamano for _, tamano, _ in entradas)
+        eliminadas = 0
+        for uso, tamano, ruta in entradas:
+            if ahora - uso <= self.ttl_disco and total <= self.max_bytes_disco:
+                break
+            try:
+                os.remove(ruta)
+            except OSError:
+                # Otro proceso que comparte el directorio ya la eliminó
+                pass
+            total -= tamano
+            eliminadas += 1
+        return eliminadas
+
+    def _recordar(self, clave, valor):
+        if self.almacen is not None and not hasattr(valor, 'cerrar'):
+            try:
+                valor = self.almacen.guardar(clave, valor)
+            except Exception:
+                # No serializable: queda en memoria, con el TTL del almacén
+                pass
+        with self._lock:
+            self._memoria[clave] = valor
+            self._memoria.move_to_end(clave)
+            if isinstance(valor, ResultadoGuardado):
+                self._usos.pop(clave, None)
+            else:
+                self._usos[clave] = time.monotonic()
+            while len(self._memoria) > self.max_entradas:
+                self._usos.pop(self._memoria.popitem(last=False)[0], None)
+
+    def _purgar(self):
+        """
+        Suelta los valores en memoria sin uso por más que el TTL del almacén
+        (los spools eliminan sus archivos cuando nadie más los usa)
+        """
+        ttl = getattr(self.almacen, 'ttl', None)
+        if ttl is None:
+            return
+        limite = time.monotonic() - ttl
+        for clave in [c for c, uso in self._usos.items() if uso <= limite]:
+            del self._usos[clave]
+            self._memoria.pop(clave, None)
+
+
+class Pipeline:
+    """
+    Grafo de etapas con resultados cacheados por huella
+
+    La huella de cada etapa combina su nombre, su función, sus parámetros y
+    las huellas de sus dependencias, así que se conoce antes de ejecutar
+    nada. Una etapa solo se ejecuta si su huella no está en la caché, y en
+    ese caso solo se resuelven las dependencias que necesita.
+    """
+
+    def __init__(self, cache=None):
+        """
+        Args:
+            cache (CacheEtapas): Caché compartida entre ejecuciones
+        """
+        self.cache = cache if cache is not None else CacheEtapas()
+        self.etapas = OrderedDict()
+        self.estado = OrderedDict()
+        self._huellas = {}
+        self._resultados = {}
+
+    def agregar(self, nombre, funcion, dependencias=(), parametros=None, claves=()):
+        """
+        Agrega una etapa al grafo
+
+        Args:
+            nombre (str): Nombre de la etapa
+            funcion (callable): Recibe los resultados de las dependencias
+                (en orden) y los parámetros como argumentos con nombre
+            dependencias (list): Nombres de las etapas de las que depende
+            parametros (dict): Parámetros de la función (forman parte de la huella)
+            claves (list): Valores que solo forman parte de la huella
+                (por ejemplo, el contenido de un archivo que la función lee)
+        """
+        for dependencia in dependencias:
+            if dependencia not in self.etapas:
+                raise ValueError(f"Etapa desconocida: {dependencia}")
+        self.etapas[nombre] = (funcion, tuple(dependencias),
+                               dict(parametros or {}), tuple(claves))
+        return self
+
+    def huella(self, nombre):
+        """
+        Huella de una etapa (sin ejecutarla)
+        """
+        if nombre not in self._huellas:
+            funcion, dependencias, parametros, claves = self.etapas[nombre]
+            self._huellas[nombre] = huella(
+                (nombre, funcion, parametros, claves,
+                 [self.huella(d) for d in dependencias]))
+        return self._huellas[nombre]
+
+    def pendientes(self, objetivos=None):
+        """
+        Etapas que habría que ejecutar para obtener los objetivos
+
+        Returns:
+            list: Nombres en orden de ejecución
+        """
+        faltan = []
+
+        def visitar(nombre):
+            if nombre in faltan or nombre in self._resultados or \
+                    self.huella(nombre) in self.cache:
+                return
+            for dependencia in self.etapas[nombre][1]:
+                visitar(dependencia)
+            faltan.append(nombre)
+
+        for nombre in (self.etapas if objetivos is None else objetivos):
+            visitar(nombre)
+        return faltan
+
+    def resultado(self, nombre):
+        """
+        Resultado de una etapa, desde la caché o ejecutándola
+        """
+        if nombre in self._resultados:
+            return self._resultados[nombre]
+
+        funcion, dependencias, parametros, _ = self.etapas[nombre]
+        clave = self.huella(nombre)
+        inicio = time.perf_counter()
+        valor = self.cache.obtener(clave, _FALTA)
+        if valor is _FALTA:
+            argumentos = [self.resultado(d) for d in dependencias]
+            inicio = time.perf_counter()
+            valor = funcion(*argumentos, **parametros)
+            self.cache.guardar(clave, valor)
+            origen = 'ejecutada'
+        else:
+            origen = 'cache'
+
+        self.estado[nombre] = (origen, time.perf_counter() - inicio)
+        self._resultados[nombre] = valor
+        return valor
+
+    def ejecutar(self, objetivos=None):
+        """
+        Resuelve los objetivos (por defecto, todas las etapas)
+
+        Returns:
+            dict: Resultado de cada objetivo
+        """
+        objetivos = list(self.etapas if objetivos is None else objetivos)
+        return {nombre: self.resultado(nombre) for nombre in objetivos}
+
+    def resumen(self):
+        """
+        Estado de las etapas resueltas en esta ejecución
+
+        Returns:
+            pd.DataFrame: Etapa, Estado (caché / ejecutada) y Segundos
+        """
+        etiquetas = {'cache': 'Caché', 'ejecutada': 'Ejecutada'}
+        return pd.DataFrame(
+            [(nombre, etiquetas[origen], round(segundos, 3))
+             for nombre, (origen, segundos) in self.estado.items()],
+            columns=['Etapa', 'Estado', 'Segundos'])
+
+
+# Procesos por tipo de hoja, en el orden de las pestañas de resultados
+PROCESOS = OrderedDict([
+    ('Exclusiones-CMM', procesar_exclusiones_cmm),
+    ('Base Fallas', procesar_base_fallas),
+    ('Base Fallas NCR', procesar_base_fallas_ncr),
+])
+
+# Separa el libro del proceso en los nombres de etapa del modo lote
+SEPARADOR_LOTE = ' · '
+
+
+def _indice_th(df_th):
+    # Un TH sin encabezado reconocible queda sin índice
+    return IndiceTH(df_th) if not df_th.empty else None
+
+
+def _etapa_hoja(procesar):
+    # Se procesa una copia: la hoja leída queda en la caché sin modificar
+    def etapa(df_in, th, matriz=None, **parametros):
+        if matriz is not None:
+            parametros['matriz'] = matriz
+        return procesar(df_in.copy(), th, **parametros)
+    return etapa
+
+
+def _etapa_bloques(procesar, archivo, hoja, bloques):
+    def etapa(th, matriz=None, **parametros):
+        if matriz is not None:
+            parametros['matriz'] = matriz
+        lector = leer_hoja_por_bloques(archivo, hoja,
+                                       bloques.get('filas_bloque'),
+                                       bloques.get('memoria_max_mb'),
+                                       th.nbytes())
+        return procesar_por_bloques(procesar, lector, th, **parametros)
+    return etapa
+
+
+def _etapas_th(pipeline, ingesta, archivo_th, con_ncr):
+    ingesta.leer('TH', archivo_th, header=None)
+    pipeline.agregar('Lectura TH', lambda: ingesta.resultado('TH'),
+                     claves=[huella(archivo_th)])
+    pipeline.agregar('Limpieza TH', limpiar_th_downtime, ['Lectura TH'])
+    pipeline.agregar('Índice TH', _indice_th, ['Limpieza TH'])
+    if con_ncr:
+        pipeline.agregar('Matriz NCR', construir_matriz_ncr, ['Índice TH'],
+                         claves=[seccion_config('compatibilidad_ncr')])
+
+
+def _etapas_hojas(pipeline, ingesta, archivo_datos, hojas, tol, modo_base,
+                  bloques, prefijo=''):
+    huella_datos = huella(archivo_datos)
+    for nombre, hoja in hojas.items():
+        procesar = PROCESOS[nombre]
+        etapa = prefijo + nombre
+        # En la huella solo entran los parámetros que el proceso usa: con
+        # Base Fallas 'ultimo', cambiar la tolerancia no la invalida
+        parametros = {}
+        if nombre == 'Base Fallas':
+            parametros['modo'] = modo_base
+        if nombre != 'Base Fallas' or modo_base == 'asof':
+            parametros['tol'] = tol
+        dependencias = ['Índice TH']
+        if nombre == 'Base Fallas NCR':
+            dependencias.append('Matriz NCR')
+
+        if bloques is None:
+            ingesta.leer(etapa, archivo_datos, hoja)
+            pipeline.agregar(f'Lectura {etapa}',
+                             lambda clave=etapa: ingesta.resultado(clave),
+                             claves=[huella_datos, hoja])
+            pipeline.agregar(etapa, _etapa_hoja(procesar),
+                             [f'Lectura {etapa}'] + dependencias, parametros,
+                             claves=[procesar])
+        else:
+            pipeline.agregar(etapa,
+                             _etapa_bloques(procesar, archivo_datos, hoja, bloques),
+                             dependencias, parametros,
+                             claves=[procesar, huella_datos, hoja, bloques])
+        # Agregados para tablas dinámicas y gráficos (se calculan solo si se piden)
+        pipeline.agregar(f'Cubo {etapa}', CuboDowntime.desde_resultado, [etapa])
+
+
+def construir_pipeline(cache, ingesta, archivo_th, archivo_datos, hojas, tol,
+                       modo_base='ultimo', bloques=None):
+    """
+    Arma el grafo de etapas de un procesamiento
+
+    Etapas: 'Lectura TH' -> 'Limpieza TH' -> 'Índice TH' [-> 'Matriz NCR'],
+    y por cada hoja seleccionada 'Lectura <nombre>' -> <nombre> ->
+    'Cubo <nombre>'. Las
+    lecturas se registran en la ingesta, pero solo se leen si su etapa
+    hace falta (ver Pipeline.pendientes). 'Índice TH' es None si el TH
+    no tiene un encabezado reconocible.
+
+    Args:
+        cache (CacheEtapas): Caché compartida entre ejecuciones
+        ingesta (IngestaExcel): Lector de hojas (la clave de cada lectura es
+            el nombre de su etapa sin el prefijo 'Lectura ')
+        archivo_th: Archivo TH Downtime
+        archivo_datos: Archivo de datos ATM
+        hojas (dict): Nombre de proceso -> hoja del archivo de datos
+        tol (int): Tolerancia en minutos
+        modo_base (str): Modo de Base Fallas
+        bloques (dict): filas_bloque / memoria_max_mb para procesar por
+            bloques (None = hojas completas en memoria)
+
+    Returns:
+        Pipeline: Grafo listo para resolver
+    """
+    pipeline = Pipeline(cache)
+    _etapas_th(pipeline, ingesta, archivo_th, 'Base Fallas NCR' in hojas)
+    _etapas_hojas(pipeline, ingesta, archivo_datos, hojas, tol, modo_base, bloques)
+    return pipeline
+
+
+def etapa_lote(libro, nombre):
+    """
+    Nombre de la etapa de un proceso de un libro en modo lote
+    """
+    return f'{libro}{SEPARADOR_LOTE}{nombre}'
+
+
+def construir_lote(cache, ingesta, archivo_th, libros, tol, modo_base='ultimo',
+                   bloques=None):
+    """
+    Arma el grafo de etapas de varios libros de datos contra un mismo TH
+
+    El TH se lee, limpia e indexa una sola vez; cada libro agrega sus
+    etapas con el nombre '<libro> · <proceso>' (ver etapa_lote).
+
+    Args:
+        libros (dict): Etiqueta del libro -> (archivo de datos, hojas), donde
+            hojas es un dict nombre de proceso -> hoja del libro
+        (el resto, como en construir_pipeline)
+
+    Returns:
+        Pipeline: Grafo listo para resolver
+    """
+    pipeline = Pipeline(cache)
+    _etapas_th(pipeline, ingesta, archivo_th,
+               any('Base Fallas NCR' in hojas for _, hojas in libros.values()))
+    for libro, (archivo, hojas) in libros.items():
+        _etapas_hojas(pipeline, ingesta, archivo, hojas, tol, modo_base, bloques,
+                      prefijo=etapa_lote(libro, ''))
+    return pipeline
+
+
+# Caché de etapas de un proceso trabajador (servicio HTTP, vigilancia de carpeta)
+_CACHE_PROCESO = None
+
+
+def limites_disco(config=None):
+    """
+    Límites de la caché en disco ([pipeline] max_mb_disco y ttl_horas)
+    """
+    seccion = seccion_config('pipeline', config)
+    return {'max_mb_disco': float(seccion.get('max_mb_disco', 2048)),
+            'ttl_horas': float(seccion.get('ttl_horas', 168))}
+
+
+def iniciar_cache_proceso(directorio=None, max_entradas=32, limites=None):
+    """
+    Inicializador de pool: crea la caché de etapas del proceso trabajador
+
+    Con un directorio compartido, los procesos del pool reutilizan entre sí
+    las etapas ya calculadas (por ejemplo, el índice de un mismo TH).
+
+    Args:
+        limites (dict): Límites de la caché en disco (ver limites_disco)
+    """
+    global _CACHE_PROCESO
+    _CACHE_PROCESO = CacheEtapas(max_entradas, directorio, **(limites or {}))
+
+
+def cache_proceso():
+    """
+    Caché de etapas del proceso actual (se crea en memoria si no se inicializó)
+    """
+    if _CACHE_PROCESO is None:
+        iniciar_cache_proceso()
+    return _CACHE_PROCESO
+
+
+def ejecutar_sin_interfaz(contenido_th, contenido_datos, hojas, tol,
+                          modo_base='ultimo', cache=None):
+    """
+    Ejecuta los procesos seleccionados fuera de Streamlit
+
+    Args:
+        contenido_th (bytes): Archivo TH Downtime
+        contenido_datos (bytes): Archivo de datos ATM
+        hojas (dict): Nombre de proceso -> hoja del archivo de datos
+        tol (int): Tolerancia en minutos
+        modo_base (str): Modo de Base Fallas
+        cache (CacheEtapas): Caché a usar (por defecto, la del proceso)
+
+    Returns:
+        tuple: (pipeline, {nombre: (df_in, df_out)}, {nombre: error})
+    """
+    # Las hojas se leen en el mismo proceso (ya se está dentro de un trabajador)
+    ingesta = IngestaExcel(bytes_minimos=float('inf'))
+    if cache is None:
+        cache = cache_proceso()
+    pipeline = construir_pipeline(cache, ingesta, contenido_th, contenido_datos,
+                                  hojas, tol, modo_base)
+    if pipeline.resultado('Índice TH') is None:
+        raise ValueError(
+            "No se pudo procesar el archivo TH Downtime. Verifica el formato.")
+
+    resultados, errores = {}, {}
+    for nombre in PROCESOS:
+        if nombre not in hojas:
+            continue
+        try:
+            resultados[nombre] = (pipeline.resultado(f'Lectura {nombre}'),
+                                  pipeline.resultado(nombre))
+        except Exception as e:
+            errores[nombre] = str(e)
+    return pipeline, resultados, errores
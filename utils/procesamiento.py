@@ -0,0 +1,369 @@
+import pandas as pd
+import numpy as np
+from datetime import datetime, time
+
+from utils.categorias import MatrizCategoriasNCR
+from utils.result_builder import ResultBuilder
+
+
+# Utilidades (mantengo toda la lógica original intacta)
+def normalizar_id(series):
+    return series.astype(str)\
+                 .str.extract(r"(\d+)\s*$", expand=False)\
+                 .str.lstrip('0')
+
+
+def combinar_fecha_hora(f_val, h_val):
+    try:
+        fecha = pd.to_datetime(f_val, errors='coerce').date()
+        if pd.isna(fecha):
+            return None
+        if pd.isna(h_val):
+            return datetime.combine(fecha, time.min)
+        hora = h_val if isinstance(h_val, time) else pd.to_datetime(
+            h_val, errors='coerce').time()
+        return datetime.combine(fecha, hora)
+    except:
+        return None
+
+
+def limpiar_th_downtime(df_raw):
+    header_idx = -1
+    for i, row in df_raw.head(5).iterrows():
+        texto = ' '.join(row.astype(str)).upper()
+        if 'TICKET KEY' in texto and 'START TIME' in texto:
+            header_idx = i
+            break
+    if header_idx < 0:
+        return pd.DataFrame()
+    df = df_raw.iloc[header_idx:].reset_index(drop=True)
+    df.columns = df.iloc[0].astype(str).str.strip()
+    df = df.drop(0).reset_index(drop=True)
+    df.columns = df.columns.str.strip()
+    return df.dropna(how='all').reset_index(drop=True)
+
+
+def _a_ns(serie):
+    """Fechas como enteros en nanosegundos (NaT -> mínimo int64)"""
+    return serie.to_numpy(dtype='datetime64[ns]').view('i8')
+
+
+def _diferencia_minutos(inicios_ns, fecha):
+    """Diferencia absoluta en minutos contra una fecha (NaN para NaT)"""
+    diff = np.abs((inicios_ns - pd.Timestamp(fecha).value) / 1e9 / 60)
+    return np.where(inicios_ns == np.iinfo(np.int64).min, np.nan, diff)
+
+
+def _primer_minimo(diff, mascara=None):
+    """Posición del primer mínimo (como idxmin); 0 si no hay valores válidos"""
+    validos = ~np.isnan(diff) if mascara is None else mascara & ~np.isnan(diff)
+    if not validos.any():
+        return 0
+    candidatos = np.flatnonzero(validos)
+    return candidatos[np.argmin(diff[candidatos])]
+
+
+# Funciones de categorización (sin cambios)
+def categoria_por_sbif(codigo):
+    try:
+        c = str(int(float(codigo))).strip()
+    except:
+        c = str(codigo).strip()
+    return {
+        '2': 'Exigidos por SBIF',
+        '6': 'Exigidos por SBIF',
+        '7': 'Exigidos por SBIF',
+        '5': 'Remodelación',
+        '3': 'Vandalismo'
+    }.get(c, 'Comunicaciones')
+
+
+def categoria_por_resumen_falla(falla):
+    m = str(falla).lower()
+    mapa = {
+        'dispensador con falla': 'Dispenser No Paga FLMG',
+        'impresora de recibos': 'Impresora Recibos FLMG',
+        'bna con falla': 'BNA/SDM/Deposito FLMG',
+        '4 gavetas': '4 Gavetas Indisponibles',
+        'host down': 'Aplicacion Fuera de Servicio',
+        'comunicación con falla': 'Comunicaciones',
+        'lector de tarjeta con falla': 'Lector de Tarjeta FLMG',
+        'impresora sin papel': 'Sin Papel Recibos',
+        'modo supervisor': 'Supervisor',
+        'cash out': 'Cash Out'
+    }
+    for k, v in mapa.items():
+        if k in m:
+            return v
+    return 'Comunicaciones'
+
+
+MAPA_FALLA_NCR = {
+    'falla de configuración': 'Falla de HW / Servicio Técnico',
+    'hardware': 'Falla de HW / Servicio Técnico',
+    'pantalla con fallas': 'Falla de HW / Servicio Técnico',
+    'lector de tarjeta con falla': 'Lector de Tarjeta SLMG',
+    'impresora con falla': 'Impresora de recibos SLMG',
+    'dispensador con falla': 'Dispenser no paga SLMG',
+    'bna con falla': 'BNA/SDM/Deposito SLMG'
+}
+CATEGORIAS_NCR = list(dict.fromkeys(MAPA_FALLA_NCR.values()))
+
+
+def categoria_por_falla_ncr(falla):
+    m = str(falla).lower()
+    for k, v in MAPA_FALLA_NCR.items():
+        if k in m:
+            return v
+    return 'Falla de HW / Servicio Técnico'
+
+
+def construir_matriz_ncr(df_th):
+    """Matriz de compatibilidad NCR x CATEGORY TH, construida una vez por ejecución"""
+    df_th = df_th.df if isinstance(df_th, IndiceTH) else df_th
+    return MatrizCategoriasNCR.desde_config(df_th['CATEGORY'], CATEGORIAS_NCR)
+
+
+class IndiceTH:
+    """
+    Índice de solo lectura sobre el TH Downtime limpio
+
+    Normaliza IDs, convierte fechas y agrupa las posiciones por ATM una sola
+    vez, de modo que cada proceso (o cada bloque en el modo por bloques)
+    consulta el TH sin copiarlo ni agregarle columnas.
+    """
+
+    def __init__(self, df_th):
+        self.df = df_th
+        self.id_norm = normalizar_id(df_th['ID'])
+        self.inicio = pd.to_datetime(df_th['START TIME'], errors='coerce')
+        self.fin = pd.to_datetime(df_th['END TIME'], errors='coerce')
+        self.inicio_ns = _a_ns(self.inicio)
+        self.grupos = self.id_norm.groupby(self.id_norm, sort=False).indices
+        self._referencias = None
+        self._por_wo = None
+        self._mascaras = (None, None)
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def referencias(self):
+        """Columna REFERENCE como texto sin espacios"""
+        if self._referencias is None:
+            self._referencias = self.df['REFERENCE'].astype(str).str.strip()
+        return self._referencias
+
+    @property
+    def por_wo(self):
+        """Primera posición de cada REFERENCE"""
+        if self._por_wo is None:
+            primeras = ~self.referencias.duplicated(keep='first')
+            self._por_wo = dict(
+                zip(self.referencias[primeras], np.flatnonzero(primeras)))
+        return self._por_wo
+
+    def mascaras(self, matriz):
+        """Máscaras de categoría NCR por ticket para una matriz de compatibilidad"""
+        if self._mascaras[0] is not matriz:
+            self._mascaras = (matriz, matriz.mascaras(self.df['CATEGORY']))
+        return self._mascaras[1]
+
+    def nbytes(self):
+        """Memoria aproximada del índice y del TH que referencia"""
+        return int(self.df.memory_usage(deep=True).sum() +
+                   self.id_norm.memory_usage(deep=True) +
+                   self.inicio.memory_usage() + self.fin.memory_usage() +
+                   self.inicio_ns.nbytes)
+
+
+def indice_th(df_th):
+    """Devuelve el IndiceTH de un TH (o el mismo índice si ya lo es)"""
+    return df_th if isinstance(df_th, IndiceTH) else IndiceTH(df_th)
+
+
+# Funciones de procesamiento (sin cambios en la lógica)
+def procesar_exclusiones_cmm(df_cmm, df_th, tol):
+    atm_col = 'ATM'
+    fini = next(c for c in df_cmm
+                if 'FECHA' in c.upper() and 'INICIO' in c.upper())
+    hini = next(c for c in df_cmm
+                if 'HORA' in c.upper() and 'INICIO' in c.upper())
+    ffin = next(
+        c for c in df_cmm
+        if 'FECHA' in c.upper() and any(k in c.upper()
+                                        for k in ['TERMINO', 'CIERRE', 'FIN']))
+    hfin = next(
+        c for c in df_cmm
+        if 'HORA' in c.upper() and any(k in c.upper()
+                                       for k in ['TERMINO', 'CIERRE', 'FIN']))
+    sbif = next(c for c in df_cmm
+                if 'SBIF' in c.upper() or 'CODIGO' in c.upper())
+
+    df_cmm['_ini'] = df_cmm.apply(
+        lambda r: combinar_fecha_hora(r[fini], r[hini]), axis=1)
+    df_cmm['_fin'] = df_cmm.apply(
+        lambda r: combinar_fecha_hora(r[ffin], r[hfin]), axis=1)
+
+    th = indice_th(df_th)
+    normas = normalizar_id(df_cmm[atm_col].astype(str))
+
+    res = ResultBuilder(len(df_cmm))
+    estados = []
+    for i, (ini, norm) in enumerate(zip(df_cmm['_ini'], normas)):
+        if pd.isna(ini): continue
+        pos = th.grupos.get(norm)
+
+        if pos is None:
+            res.append(i)
+            estados.append('No Encontrado')
+        else:
+            diff = _diferencia_minutos(th.inicio_ns[pos], ini)
+            k = _primer_minimo(diff)
+            res.append(i, pos[k])
+            estados.append('Encontrado' if diff[k] <= tol else 'Diferencia')
+
+    return res.build({
+        'ATM': ('left', df_cmm[atm_col]),
+        'Status Orig':
+        [categoria_por_sbif(c) for c in df_cmm[sbif].to_numpy()[res.left]],
+        'Estado': estados,
+        'TK TH': ('right', th.df['TICKET KEY'], 'N/A'),
+        'Ini Orig': ('left', df_cmm['_ini']),
+        'Fin Orig': ('left', df_cmm['_fin']),
+        'Ini TH': ('right', th.inicio),
+        'Fin TH': ('right', th.fin)
+    })
+
+
+MODOS_BASE_FALLAS = {
+    'ultimo': 'Último ticket global por ATM',
+    'asof': 'Último ticket a la fecha de la falla (as-of)'
+}
+
+
+def _th_base_fallas(th):
+    # Solo las columnas necesarias, sin copiar el TH completo
+    return pd.DataFrame({
+        'id_norm': th.id_norm,
+        'TICKET KEY': th.df['TICKET KEY'],
+        'Inicio TH': th.inicio,
+        'Fin TH': th.fin
+    })
+
+
+def _fecha_base_fallas(df_base):
+    fechas = [c for c in df_base if 'FECHA' in str(c).upper()]
+    horas = [c for c in df_base if 'HORA' in str(c).upper()]
+    if not fechas:
+        return None
+    fini = next((c for c in fechas if 'INICI' in str(c).upper()), fechas[0])
+    hini = next((c for c in horas if 'INICI' in str(c).upper()),
+                horas[0] if horas else None)
+    return pd.to_datetime(df_base.apply(
+        lambda r: combinar_fecha_hora(r[fini], r[hini] if hini else None),
+        axis=1),
+                          errors='coerce').astype('datetime64[ns]')
+
+
+def procesar_base_fallas(df_base, df_th, modo='ultimo', tol=0):
+    if modo not in MODOS_BASE_FALLAS:
+        raise ValueError(f"Modo de Base Fallas inválido: {modo}")
+    df_base['id_norm'] = normalizar_id(df_base['ATM'])
+    df_base['Status'] = df_base['RESUMEN FALLA'].apply(
+        categoria_por_resumen_falla)
+
+    th = _th_base_fallas(indice_th(df_th))
+    idx = th.groupby('id_norm')['Inicio TH'].idxmax()
+    df_lat = th.loc[idx]
+
+    m = pd.merge(df_base[['ATM', 'id_norm', 'Status']],
+                 df_lat,
+                 on='id_norm',
+                 how='left')
+
+    fechas = _fecha_base_fallas(df_base) if modo == 'asof' else None
+    if fechas is not None:
+        # As-of: ticket más reciente con inicio <= fecha de la falla + tol.
+        # Las filas sin fecha conservan el último ticket global.
+        clave = fechas + pd.Timedelta(minutes=tol)
+        izq = pd.DataFrame({
+            '_fila': np.arange(len(df_base)),
+            'id_norm': df_base['id_norm'].to_numpy(),
+            '_clave': clave.to_numpy()
+        })
+        izq = izq[izq['_clave'].notna() & izq['id_norm'].notna()]
+        der = th.dropna(subset=['id_norm', 'Inicio TH'])
+        der = der.assign(**{
+            'Inicio TH': der['Inicio TH'].astype('datetime64[ns]')
+        }).sort_values('Inicio TH', kind='stable')
+        asof = pd.merge_asof(izq.sort_values('_clave', kind='stable'),
+                             der,
+                             left_on='_clave',
+                             right_on='Inicio TH',
+                             by='id_norm',
+                             direction='backward')
+        filas = asof['_fila'].to_numpy()
+        con_fecha = np.zeros(len(m), dtype=bool)
+        con_fecha[filas] = True
+        for col in ['TICKET KEY', 'Inicio TH', 'Fin TH']:
+            valores = pd.Series(asof[col].to_numpy(), index=filas)
+            m[col] = valores.reindex(m.index).where(con_fecha, m[col])
+
+    m['Estado'] = np.where(m['TICKET KEY'].notna(), 'Encontrado en TH',
+                           'No Encontrado')
+    m['TK TH'] = m['TICKET KEY'].fillna('N/A')
+    return m[['ATM', 'TK TH', 'Status', 'Estado', 'Inicio TH', 'Fin TH']]
+
+
+def procesar_base_fallas_ncr(df_ncr, df_th, tol=30, matriz=None):
+    df_ncr['inicio'] = df_ncr.apply(lambda r: combinar_fecha_hora(
+        r.get('FECHA INICIAL'), r.get('HORA INICIAL')),
+                                    axis=1)
+    th = indice_th(df_th)
+    if matriz is None:
+        matriz = construir_matriz_ncr(th)
+    por_wo = th.por_wo
+    mascaras = th.mascaras(matriz)
+    normas = normalizar_id(df_ncr['ATM'].astype(str))
+
+    res = ResultBuilder(len(df_ncr))
+    categorias, estados = [], []
+    for i, (wo, falla, ini, norm) in enumerate(
+            zip(df_ncr['WO'], df_ncr['FALLA NCR'], df_ncr['inicio'], normas)):
+        wo = str(wo).strip()
+        cat = categoria_por_falla_ncr(falla)
+        est, pos = 'No Encontrado', -1
+
+        if wo.lower() not in ['nan', '']:
+            if wo in por_wo:
+                est, pos = 'Encontrado por WO', por_wo[wo]
+
+        if est == 'No Encontrado' and pd.notna(ini):
+            sub = th.grupos.get(norm)
+            if sub is not None:
+                diff = _diferencia_minutos(th.inicio_ns[sub], ini)
+                filt = diff <= tol
+                match = filt & ((mascaras[sub] & matriz.bit(cat)) != 0)
+                if match.any():
+                    est, pos = 'Encontrado (ID+Tiempo+Falla)', sub[
+                        _primer_minimo(diff, match)]
+                elif filt.any():
+                    est, pos = 'Encontrado (ID+Tiempo)', sub[_primer_minimo(
+                        diff, filt)]
+                else:
+                    est, pos = 'Encontrado (Solo ID)', sub[0]
+
+        res.append(i, pos)
+        categorias.append(cat)
+        estados.append(est)
+
+    return res.build({
+        'ATM': ('left', df_ncr['ATM']),
+        'TK TH': ('right', th.referencias, 'N/A'),
+        'Status (Categoría)': categorias,
+        'Inicio TH': ('right', th.inicio),
+        'Fin TH': ('right', th.fin),
+        'Estado Búsqueda': estados
+    })
+
@@ -0,0 +1,422 @@
+"""
+Motores de referencia fila por fila (implementación original)
+
+Se conservan sin optimizar como oráculo para utils.diferencial: cualquier
+motor nuevo de procesar_exclusiones_cmm, procesar_base_fallas,
+procesar_base_fallas_ncr o WorkOrderMatcher.find_matches debe dar las
+mismas respuestas que estas funciones. No se usan en el procesamiento.
+
+Al final del módulo hay además versiones fila por fila, igual de directas,
+de los modos agregados después (Base Fallas as-of y la asignación uno a
+uno del matcher), que no existían en la implementación original.
+"""
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+
+
+def normalizar_id(series):
+    return series.astype(str)\
+                 .str.extract(r"(\d+)\s*$", expand=False)\
+                 .str.lstrip('0')
+
+
+def combinar_fecha_hora(f_val, h_val):
+    try:
+        fecha = pd.to_datetime(f_val, errors='coerce').date()
+        if pd.isna(fecha):
+            return None
+        if pd.isna(h_val):
+            return datetime.combine(fecha, time.min)
+        hora = h_val if isinstance(h_val, time) else pd.to_datetime(
+            h_val, errors='coerce').time()
+        return datetime.combine(fecha, hora)
+    except:
+        return None
+
+
+# Funciones de categorización (sin cambios)
+def categoria_por_sbif(codigo):
+    try:
+        c = str(int(float(codigo))).strip()
+    except:
+        c = str(codigo).strip()
+    return {
+        '2': 'Exigidos por SBIF',
+        '6': 'Exigidos por SBIF',
+        '7': 'Exigidos por SBIF',
+        '5': 'Remodelación',
+        '3': 'Vandalismo'
+    }.get(c, 'Comunicaciones')
+
+
+def categoria_por_resumen_falla(falla):
+    m = str(falla).lower()
+    mapa = {
+        'dispensador con falla': 'Dispenser No Paga FLMG',
+        'impresora de recibos': 'Impresora Recibos FLMG',
+        'bna con falla': 'BNA/SDM/Deposito FLMG',
+        '4 gavetas': '4 Gavetas Indisponibles',
+        'host down': 'Aplicacion Fuera de Servicio',
+        'comunicación con falla': 'Comunicaciones',
+        'lector de tarjeta con falla': 'Lector de Tarjeta FLMG',
+        'impresora sin papel': 'Sin Papel Recibos',
+        'modo supervisor': 'Supervisor',
+        'cash out': 'Cash Out'
+    }
+    for k, v in mapa.items():
+        if k in m:
+            return v
+    return 'Comunicaciones'
+
+
+def categoria_por_falla_ncr(falla):
+    m = str(falla).lower()
+    mapa = {
+        'falla de configuración': 'Falla de HW / Servicio Técnico',
+        'hardware': 'Falla de HW / Servicio Técnico',
+        'pantalla con fallas': 'Falla de HW / Servicio Técnico',
+        'lector de tarjeta con falla': 'Lector de Tarjeta SLMG',
+        'impresora con falla': 'Impresora de recibos SLMG',
+        'dispensador con falla': 'Dispenser no paga SLMG',
+        'bna con falla': 'BNA/SDM/Deposito SLMG'
+    }
+    for k, v in mapa.items():
+        if k in m:
+            return v
+    return 'Falla de HW / Servicio Técnico'
+
+
+# Funciones de procesamiento (sin cambios en la lógica)
+def procesar_exclusiones_cmm(df_cmm, df_th, tol):
+    atm_col = 'ATM'
+    fini = next(c for c in df_cmm
+                if 'FECHA' in c.upper() and 'INICIO' in c.upper())
+    hini = next(c for c in df_cmm
+                if 'HORA' in c.upper() and 'INICIO' in c.upper())
+    ffin = next(
+        c for c in df_cmm
+        if 'FECHA' in c.upper() and any(k in c.upper()
+                                        for k in ['TERMINO', 'CIERRE', 'FIN']))
+    hfin = next(
+        c for c in df_cmm
+        if 'HORA' in c.upper() and any(k in c.upper()
+                                       for k in ['TERMINO', 'CIERRE', 'FIN']))
+    sbif = next(c for c in df_cmm
+                if 'SBIF' in c.upper() or 'CODIGO' in c.upper())
+
+    df_cmm['_ini'] = df_cmm.apply(
+        lambda r: combinar_fecha_hora(r[fini], r[hini]), axis=1)
+    df_cmm['_fin'] = df_cmm.apply(
+        lambda r: combinar_fecha_hora(r[ffin], r[hfin]), axis=1)
+
+    df_th['id_norm'] = normalizar_id(df_th['ID'])
+    df_th['ini_th'] = pd.to_datetime(df_th['START TIME'], errors='coerce')
+    df_th['fin_th'] = pd.to_datetime(df_th['END TIME'], errors='coerce')
+
+    out = []
+    for _, r in df_cmm.iterrows():
+        atm, ini, fin = r[atm_col], r['_ini'], r['_fin']
+        if pd.isna(ini): continue
+        orig = categoria_por_sbif(r[sbif])
+        norm = normalizar_id(pd.Series(str(atm))).iloc[0]
+        sub = df_th[df_th['id_norm'] == norm]
+
+        if sub.empty:
+            out.append({
+                'ATM': atm,
+                'Status Orig': orig,
+                'Estado': 'No Encontrado',
+                'TK TH': 'N/A',
+                'Ini Orig': ini,
+                'Fin Orig': fin,
+                'Ini TH': pd.NaT,
+                'Fin TH': pd.NaT
+            })
+        else:
+            sub['diff'] = (sub['ini_th'] - ini).abs().dt.total_seconds() / 60
+            best = sub.loc[sub['diff'].idxmin()]
+            est = 'Encontrado' if best['diff'] <= tol else 'Diferencia'
+            out.append({
+                'ATM': atm,
+                'Status Orig': orig,
+                'Estado': est,
+                'TK TH': best['TICKET KEY'],
+                'Ini Orig': ini,
+                'Fin Orig': fin,
+                'Ini TH': best['ini_th'],
+                'Fin TH': best['fin_th']
+            })
+    return pd.DataFrame(out)
+
+
+def procesar_base_fallas(df_base, df_th):
+    df_base['id_norm'] = normalizar_id(df_base['ATM'])
+    df_base['Status'] = df_base['RESUMEN FALLA'].apply(
+        categoria_por_resumen_falla)
+
+    df_th2 = df_th.copy()
+    df_th2['id_norm'] = normalizar_id(df_th2['ID'])
+    df_th2['sd'] = pd.to_datetime(df_th2['START TIME'], errors='coerce')
+    idx = df_th2.groupby('id_norm')['sd'].idxmax()
+    df_lat = df_th2.loc[idx]
+    df_lat['Inicio TH'] = df_lat['sd']
+    df_lat['Fin TH'] = pd.to_datetime(df_lat['END TIME'], errors='coerce')
+
+    m = pd.merge(df_base,
+                 df_lat[['id_norm', 'TICKET KEY', 'Inicio TH', 'Fin TH']],
+                 on='id_norm',
+                 how='left')
+    m['Estado'] = np.where(m['TICKET KEY'].notna(), 'Encontrado en TH',
+                           'No Encontrado')
+    m['TK TH'] = m['TICKET KEY'].fillna('N/A')
+    return m[['ATM', 'TK TH', 'Status', 'Estado', 'Inicio TH', 'Fin TH']]
+
+
+def procesar_base_fallas_ncr(df_ncr, df_th, tol=30):
+    df_ncr['inicio'] = df_ncr.apply(lambda r: combinar_fecha_hora(
+        r.get('FECHA INICIAL'), r.get('HORA INICIAL')),
+                                    axis=1)
+    df_th['id_norm'] = normalizar_id(df_th['ID'])
+    df_th['inicio_th'] = pd.to_datetime(df_th['START TIME'], errors='coerce')
+    df_th['fin_th'] = pd.to_datetime(df_th['END TIME'], errors='coerce')
+    df_th['REFERENCE'] = df_th['REFERENCE'].astype(str).str.strip()
+
+    out = []
+    for _, r in df_ncr.iterrows():
+        atm, wo, falla, ini = r['ATM'], str(
+            r['WO']).strip(), r['FALLA NCR'], r['inicio']
+        cat = categoria_por_falla_ncr(falla)
+        est, tk, i_th, f_th = 'No Encontrado', 'N/A', pd.NaT, pd.NaT
+
+        if wo.lower() not in ['nan', '']:
+            dfw = df_th[df_th['REFERENCE'] == wo]
+            if not dfw.empty:
+                m0 = dfw.iloc[0]
+                est, tk, i_th, f_th = 'Encontrado por WO', m0['REFERENCE'], m0[
+                    'inicio_th'], m0['fin_th']
+
+        if est == 'No Encontrado' and pd.notna(ini):
+            norm = normalizar_id(pd.Series(str(atm))).iloc[0]
+            sub = df_th[df_th['id_norm'] == norm].copy()
+            if not sub.empty:
+                sub['diff'] = (sub['inicio_th'] -
+                               ini).abs().dt.total_seconds() / 60
+                filt = sub[sub['diff'] <= tol]
+                match = filt[filt['CATEGORY'].str.contains(cat,
+                                                           case=False,
+                                                           na=False)]
+                if not match.empty:
+                    b = match.loc[match['diff'].idxmin()]
+                    est, tk, i_th, f_th = 'Encontrado (ID+Tiempo+Falla)', b[
+                        'REFERENCE'], b['inicio_th'], b['fin_th']
+                elif not filt.empty:
+                    b = filt.loc[filt['diff'].idxmin()]
+                    est, tk, i_th, f_th = 'Encontrado (ID+Tiempo)', b[
+                        'REFERENCE'], b['inicio_th'], b['fin_th']
+                else:
+                    b = sub.iloc[0]
+                    est, tk, i_th, f_th = 'Encontrado (Solo ID)', b[
+                        'REFERENCE'], b['inicio_th'], b['fin_th']
+
+        out.append({
+            'ATM': atm,
+            'TK TH': tk,
+            'Status (Categoría)': cat,
+            'Inicio TH': i_th,
+            'Fin TH': f_th,
+            'Estado Búsqueda': est
+        })
+    return pd.DataFrame(out)
+
+
+def find_matches(work_orders_df, downtime_df, tolerance_minutes=30):
+    """
+    WorkOrderMatcher.find_matches original (todos los pares que coinciden)
+    """
+    tolerance_delta = timedelta(minutes=tolerance_minutes)
+    columns = [
+        'ATM_ID', 'Fecha_Orden', 'Descripcion_Orden', 'Inicio_Downtime',
+        'Fin_Downtime', 'Causa_Downtime', 'Duracion_Downtime_Horas',
+        'Diferencia_Tiempo_Minutos', 'Tolerancia_Minutos'
+    ]
+
+    common_atms = set(work_orders_df['ATM_ID']) & set(downtime_df['ATM_ID'])
+    if not common_atms:
+        return pd.DataFrame(columns=columns)
+
+    matches = []
+    for atm_id in common_atms:
+        work_orders = work_orders_df[work_orders_df['ATM_ID'] == atm_id]
+        downtime_records = downtime_df[downtime_df['ATM_ID'] == atm_id]
+        for _, order in work_orders.iterrows():
+            order_datetime = order['Fecha_Hora']
+            for _, downtime in downtime_records.iterrows():
+                downtime_start = downtime['Fecha_Inicio']
+                downtime_end = downtime['Fecha_Fin']
+                tolerance_start = downtime_start - tolerance_delta
+                tolerance_end = downtime_start + tolerance_delta
+                if (tolerance_start <= order_datetime <= tolerance_end) or \
+                        (downtime_start <= order_datetime <= downtime_end):
+                    time_diff_minutes = abs(
+                        (order['Fecha_Hora'] - downtime['Fecha_Inicio']).total_seconds() / 60)
+                    matches.append({
+                        'ATM_ID': atm_id,
+                        'Fecha_Orden': order['Fecha_Hora'],
+                        'Descripcion_Orden': order['Descripcion'],
+                        'Inicio_Downtime': downtime['Fecha_Inicio'],
+                        'Fin_Downtime': downtime['Fecha_Fin'],
+                        'Causa_Downtime': downtime['Causa'],
+                        'Duracion_Downtime_Horas': downtime['Duracion_Horas'],
+                        'Diferencia_Tiempo_Minutos': time_diff_minutes,
+                        'Tolerancia_Minutos': tolerance_minutes
+                    })
+
+    if not matches:
+        return pd.DataFrame(columns=columns)
+    matches_df = pd.DataFrame(matches)
+    matches_df = matches_df.sort_values(['ATM_ID', 'Fecha_Orden'])
+    return matches_df.reset_index(drop=True)
+
+
+# Referencias de los modos nuevos (sin equivalente en la versión original)
+
+def procesar_base_fallas_asof(df_base, df_th, tol=0):
+    """
+    procesar_base_fallas en modo 'asof': a cada falla, el último ticket de su
+    ATM iniciado hasta la fecha de la falla más tol (entre tickets con el
+    mismo inicio, el último del TH); las filas sin fecha o sin ATM conservan
+    el último ticket global
+    """
+    m = procesar_base_fallas(df_base.copy(), df_th)
+    fechas = [c for c in df_base if 'FECHA' in str(c).upper()]
+    if not fechas:
+        return m
+    horas = [c for c in df_base if 'HORA' in str(c).upper()]
+    fini = next((c for c in fechas if 'INICI' in str(c).upper()), fechas[0])
+    hini = next((c for c in horas if 'INICI' in str(c).upper()),
+                horas[0] if horas else None)
+
+    df_th2 = df_th.copy()
+    df_th2['id_norm'] = normalizar_id(df_th2['ID'])
+    df_th2['sd'] = pd.to_datetime(df_th2['START TIME'], errors='coerce')
+    df_th2['ed'] = pd.to_datetime(df_th2['END TIME'], errors='coerce')
+    normas = normalizar_id(df_base['ATM'])
+
+    for i, (_, r) in enumerate(df_base.iterrows()):
+        fecha = combinar_fecha_hora(r[fini], r[hini] if hini else None)
+        norm = normas.iloc[i]
+        if fecha is None or pd.isna(fecha) or pd.isna(norm):
+            continue
+        limite = pd.Timestamp(fecha) + timedelta(minutes=tol)
+        sub = df_th2[(df_th2['id_norm'] == norm) & (df_th2['sd'] <= limite)]
+        if sub.empty:
+            m.loc[m.index[i], ['TK TH', 'Estado', 'Inicio TH', 'Fin TH']] = \
+                ['N/A', 'No Encontrado', pd.NaT, pd.NaT]
+            continue
+        mejor = sub[sub['sd'] == sub['sd'].max()].iloc[-1]
+        m.loc[m.index[i], ['TK TH', 'Estado', 'Inicio TH', 'Fin TH']] = \
+            [mejor['TICKET KEY'], 'Encontrado en TH', mejor['sd'], mejor['ed']]
+    return m
+
+
+def _pares(work_orders_df, downtime_df, tolerance_minutes):
+    """
+    Pares que coinciden, como en find_matches, con sus posiciones de origen
+    """
+    tolerance_delta = timedelta(minutes=tolerance_minutes)
+    pares = []
+    for o, order in enumerate(work_orders_df.itertuples(index=False)):
+        for d, downtime in enumerate(downtime_df.itertuples(index=False)):
+            if order.ATM_ID != downtime.ATM_ID:
+                continue
+            inicio, fin = downtime.Fecha_Inicio, downtime.Fecha_Fin
+            if (inicio - tolerance_delta <= order.Fecha_Hora <= inicio + tolerance_delta) or \
+                    (inicio <= order.Fecha_Hora <= fin):
+                pares.append((order.ATM_ID, o, d, abs(
+                    (order.Fecha_Hora - inicio).total_seconds() / 60)))
+    return pares
+
+
+def find_matches_greedy(work_orders_df, downtime_df, tolerance_minutes=30):
+    """
+    find_matches con assignment='greedy': se recorren los pares de menor a
+    mayor diferencia (empates: orden y luego downtime de origen) y se toma
+    cada par cuyos extremos sigan libres
+    """
+    usados_o, usados_d, elegidos = set(), set(), []
+    for atm, o, d, diff in sorted(_pares(work_orders_df, downtime_df, tolerance_minutes),
+                                  key=lambda p: (p[3], p[1], p[2])):
+        if o in usados_o or d in usados_d:
+            continue
+        usados_o.add(o)
+        usados_d.add(d)
+        elegidos.append((atm, o, d, diff))
+
+    columns = ['ATM_ID', 'Fecha_Orden', 'Descripcion_Orden', 'Inicio_Downtime',
+               'Fin_Downtime', 'Causa_Downtime', 'Duracion_Downtime_Horas',
+               'Diferencia_Tiempo_Minutos', 'Tolerancia_Minutos']
+    filas = []
+    for atm, o, d, diff in elegidos:
+        order, downtime = work_orders_df.iloc[o], downtime_df.iloc[d]
+        filas.append((str(atm), order['Fecha_Hora'], o, d, {
+            'ATM_ID': atm,
+            'Fecha_Orden': order['Fecha_Hora'],
+            'Descripcion_Orden': order['Descripcion'],
+            'Inicio_Downtime': downtime['Fecha_Inicio'],
+            'Fin_Downtime': downtime['Fecha_Fin'],
+            'Causa_Downtime': downtime['Causa'],
+            'Duracion_Downtime_Horas': downtime['Duracion_Horas'],
+            'Diferencia_Tiempo_Minutos': diff,
+            'Tolerancia_Minutos': tolerance_minutes
+        }))
+    filas.sort(key=lambda f: f[:4])
+    return pd.DataFrame([f[4] for f in filas], columns=columns)
+
+
+def asignacion_optima(work_orders_df, downtime_df, tolerance_minutes=30, max_lado=16):
+    """
+    Resumen por ATM de la asignación uno a uno óptima (assignment='optimal'):
+    primero la mayor cantidad de pares y luego la menor diferencia total,
+    por búsqueda exhaustiva sobre los subconjuntos del lado más chico
+
+    La asignación óptima puede no ser única, así que se compara el resumen
+    (pares y diferencia total por ATM) y no las filas.
+
+    Returns:
+        pd.DataFrame: ATM_ID, Pares, Diferencia_Total (ATMs con pares)
+    """
+    por_atm = {}
+    for atm, o, d, diff in _pares(work_orders_df, downtime_df, tolerance_minutes):
+        por_atm.setdefault(atm, []).append((o, d, diff))
+
+    filas = []
+    for atm, pares in por_atm.items():
+        ordenes = sorted({o for o, _, _ in pares})
+        downtimes = sorted({d for _, d, _ in pares})
+        if len(ordenes) > len(downtimes):
+            pares = [(d, o, diff) for o, d, diff in pares]
+            ordenes, downtimes = downtimes, ordenes
+        if len(ordenes) > max_lado:
+            raise ValueError(f"ATM {atm}: demasiados candidatos para la búsqueda exhaustiva")
+        posicion = {o: i for i, o in enumerate(ordenes)}
+        por_downtime = {}
+        for o, d, diff in pares:
+            por_downtime.setdefault(d, []).append((posicion[o], diff))
+        # mejor[mascara de órdenes usadas] = (pares, -diferencia total)
+        mejor = {0: (0, 0.0)}
+        for d in downtimes:
+            siguiente = dict(mejor)
+            for mascara, (n, costo) in mejor.items():
+                for i, diff in por_downtime[d]:
+                    if mascara & (1 << i):
+                        continue
+                    nueva, valor = mascara | (1 << i), (n + 1, costo - diff)
+                    if valor > siguiente.get(nueva, (-1, 0.0)):
+                        siguiente[nueva] = valor
+            mejor = siguiente
+        n, costo = max(mejor.values())
+        filas.append({'ATM_ID': atm, 'Pares': n, 'Diferencia_Total': -costo})
+    return pd.DataFrame(filas, columns=['ATM_ID', 'Pares', 'Diferencia_Total'])\
+        .sort_values('ATM_ID', kind='stable').reset_index(drop=True)
@@ -0,0 +1,327 @@
+import datetime as dt
+import re
+from itertools import chain, islice, zip_longest
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.utils import get_column_letter
+
+# Mismos formatos que usa pandas.ExcelWriter por defecto
+FORMATO_FECHA_HORA = 'YYYY-MM-DD HH:MM:SS'
+FORMATO_FECHA = 'YYYY-MM-DD'
+
+FILAS_ANCHO = 100  # filas revisadas para calcular el ancho de columna
+LARGO_NOMBRE_HOJA = 31  # máximo de Excel
+
+_FINO_NEGRO = Side(style='thin', color='000000')
+_FINO_GRIS = Side(style='thin', color='CCCCCC')
+_SEPARADOR = Side(style='medium', color='FF6600')  # Línea naranja gruesa
+_CENTRO = Alignment(horizontal='center', vertical='center')
+
+_ESTILOS = {
+    'titulo': dict(font=Font(name='Arial', size=16, bold=True, color='FFFFFF'),
+                   fill=PatternFill('solid', fgColor='1F4E79'),
+                   alignment=_CENTRO),
+    'sub_orig': dict(font=Font(name='Arial', size=12, bold=True, color='FFFFFF'),
+                     fill=PatternFill('solid', fgColor='8B4513'),  # Marrón para originales
+                     alignment=_CENTRO),
+    'sub_res': dict(font=Font(name='Arial', size=12, bold=True, color='FFFFFF'),
+                    fill=PatternFill('solid', fgColor='0066CC'),  # Azul para resultados
+                    alignment=_CENTRO),
+    'enc_orig': dict(font=Font(name='Arial', size=10, bold=True, color='FFFFFF'),
+                     fill=PatternFill('solid', fgColor='A0522D'),  # Marrón más claro
+                     alignment=Alignment(horizontal='center', vertical='center', wrap_text=True)),
+    'enc_res': dict(font=Font(name='Arial', size=10, bold=True, color='FFFFFF'),
+                    fill=PatternFill('solid', fgColor='4A90E2'),  # Azul más claro
+                    alignment=Alignment(horizontal='center', vertical='center', wrap_text=True)),
+    # Datos originales - tonos beige; resultados - tonos azules (filas pares / impares)
+    'dato_orig': (PatternFill('solid', fgColor='F5F5DC'), PatternFill('solid', fgColor='FAEBD7')),
+    'dato_res': (PatternFill('solid', fgColor='E6F3FF'), PatternFill('solid', fgColor='CCE7FF')),
+}
+_FUENTE_ORIG = Font(name='Arial', size=9, color='2F4F4F')
+_FUENTE_RES = Font(name='Arial', size=9, color='003366', bold=True)
+_BORDE_ENC = Border(left=_FINO_NEGRO, right=_FINO_NEGRO, top=_FINO_NEGRO,
+                    bottom=Side(style='medium', color='000000'))
+_BORDE_DATO = Border(left=_FINO_GRIS, right=_FINO_GRIS, top=_FINO_GRIS, bottom=_FINO_GRIS)
+
+
+def _bloques(fuente):
+    """
+    Normaliza una fuente de datos a un iterador de DataFrames
+    (DataFrame, iterable de bloques o función que devuelve uno)
+    """
+    if callable(fuente) and not isinstance(fuente, pd.DataFrame):
+        fuente = fuente()
+    if isinstance(fuente, pd.DataFrame):
+        return iter([fuente])
+    return iter(fuente)
+
+
+def _columnas_y_filas(fuente):
+    """
+    Devuelve (columnas, iterador de filas) de una fuente por bloques
+    """
+    bloques = _bloques(fuente)
+    primero = next(bloques, None)
+    if primero is None:
+        return [], iter(())
+    filas = chain.from_iterable(
+        b.itertuples(index=False, name=None) for b in chain([primero], bloques))
+    return list(primero.columns), filas
+
+
+def valor_excel(valor):
+    """
+    Convierte un valor al formato que escribe pandas.DataFrame.to_excel
+
+    Returns:
+        tuple: (valor, formato numérico o None)
+    """
+    if pd.api.types.is_scalar(valor) and pd.isna(valor):
+        return '', None
+    if isinstance(valor, (bool, np.bool_)):
+        return bool(valor), None
+    if isinstance(valor, (int, np.integer)):
+        return int(valor), None
+    if isinstance(valor, (float, np.floating)):
+        return float(valor), None
+    if isinstance(valor, dt.datetime):
+        if valor.tzinfo is not None:
+            raise ValueError("Excel no admite fechas con zona horaria")
+        return valor, FORMATO_FECHA_HORA
+    if isinstance(valor, dt.date):
+        return valor, FORMATO_FECHA
+    if isinstance(valor, dt.timedelta):
+        return valor.total_seconds() / 86400, '0'
+    if isinstance(valor, np.datetime64):
+        return valor_excel(pd.Timestamp(valor))
+    return str(valor), None
+
+
+def _celda(ws, valor, **estilo):
+    valor, formato = valor_excel(valor)
+    celda = WriteOnlyCell(ws, valor)
+    if formato:
+        celda.number_format = formato
+    for atributo, v in estilo.items():
+        setattr(celda, atributo, v)
+    return celda
+
+
+def _nombre_hoja(nombre, usados):
+    """
+    Nombre de hoja válido para Excel (sin []:*?/\\, hasta 31 caracteres y
+    sin repetir, sin distinguir mayúsculas)
+    """
+    base = re.sub(r'[\[\]:*?/\\]', '-', str(nombre))[:LARGO_NOMBRE_HOJA]
+    candidato, n = base, 2
+    while candidato.upper() in usados:
+        sufijo = f' ({n})'
+        candidato = base[:LARGO_NOMBRE_HOJA - len(sufijo)] + sufijo
+        n += 1
+    usados.add(candidato.upper())
+    return candidato
+
+
+def _portada(wb, tol, fecha):
+    ws = wb.create_sheet('Portada')
+    ws.column_dimensions['A'].width = 80
+    lineas = [
+        'Reporte Generado',
+        f'Fecha: {fecha.strftime("%d/%m/%Y %H:%M:%S")}',
+        'Descripción: Resultados del procesamiento de Exclusiones-CMM, Base Fallas y Base Fallas NCR',
+        'Generado por: Sistema Automatizado v2.0',
+        f'Tolerancia utilizada: {tol} minutos',
+        f'Archivo: Resultados_ATM_Formateado.xlsx'
+    ]
+    # Encabezado con el estilo de pandas (bordes finos, centrado arriba)
+    ws.append([_celda(ws, 'Sistema de Gestión ATM',
+                      font=Font(name='Arial', size=16, bold=True, color='00FF00'),
+                      fill=PatternFill('solid', fgColor='004D40'),
+                      border=Border(left=Side(style='thin'), right=Side(style='thin'),
+                                    top=Side(style='thin'), bottom=Side(style='thin')),
+                      alignment=Alignment(horizontal='center', vertical='top'))])
+    for i, linea in enumerate(lineas):
+        if i < 5:
+            ws.append([_celda(ws, linea, font=Font(name='Arial', size=12, color='000000'))])
+        else:
+            ws.append([_celda(ws, linea)])
+
+
+def _hoja_resumen(wb, resumen):
+    ws = wb.create_sheet('Resumen')
+    columnas = list(resumen.columns)
+    filas = list(resumen.itertuples(index=False, name=None))
+    for col_idx, columna in enumerate(columnas):
+        largo = max([len(str(columna))] +
+                    [len(str(valor_excel(f[col_idx])[0])) for f in filas[:FILAS_ANCHO]])
+        ws.column_dimensions[get_column_letter(col_idx + 1)].width = \
+            min(max(largo + 2, 12), 50)
+    ws.freeze_panes = 'A3'
+
+    ws.append([_celda(ws, 'Resumen', **_ESTILOS['titulo'])])
+    ws.merged_cells.add(f"A1:{get_column_letter(max(len(columnas), 1))}1")
+    ws.append([_celda(ws, columna, border=_BORDE_ENC, **_ESTILOS['enc_res'])
+               for columna in columnas])
+    for row_idx, fila in enumerate(filas, start=3):
+        relleno = _ESTILOS['dato_res'][row_idx % 2]
+        ws.append([_celda(ws, valor, fill=relleno, font=_FUENTE_RES,
+                          alignment=_CENTRO, border=_BORDE_DATO)
+                   for valor in fila])
+
+
+def _hoja_cambios(wb, cambios):
+    """
+    Hoja 'Cambios': conteos por proceso y tipo de cambio, y luego solo las
+    filas nuevas, resueltas o con cambio de estado de cada proceso
+    """
+    from utils.cambios import COLUMNAS_CAMBIOS, TIPOS_CAMBIO, conteos
+
+    ws = wb.create_sheet('Cambios')
+    encabezado_conteos = ['Proceso'] + TIPOS_CAMBIO + ['Total']
+    filas_conteos = []
+    for nombre, df in cambios.items():
+        por_tipo = conteos(df)
+        filas_conteos.append([nombre] + list(por_tipo.values()) + [sum(por_tipo.values())])
+    columnas = ['Proceso'] + COLUMNAS_CAMBIOS
+    detalle = [(nombre, df.reindex(columns=COLUMNAS_CAMBIOS, fill_value=''))
+               for nombre, df in cambios.items() if df is not None and len(df)]
+    filas = ((nombre,) + fila for nombre, df in detalle
+             for fila in df.itertuples(index=False, name=None))
+    primeras = list(islice(filas, FILAS_ANCHO))
+    largos = [len(c) for c in columnas]
+    for fila in [encabezado_conteos] + filas_conteos + primeras:
+        for col_idx, valor in enumerate(fila):
+            largos[col_idx] = max(largos[col_idx], len(str(valor_excel(valor)[0])))
+    for col_idx, largo in enumerate(largos):
+        ws.column_dimensions[get_column_letter(col_idx + 1)].width = \
+            min(max(largo + 2, 12), 50)
+
+    ws.append([_celda(ws, 'Cambios desde la corrida anterior', **_ESTILOS['titulo'])])
+    ws.merged_cells.add(f"A1:{get_column_letter(len(columnas))}1")
+    ws.append([_celda(ws, columna, border=_BORDE_ENC, **_ESTILOS['enc_res'])
+               for columna in encabezado_conteos])
+    for row_idx, fila in enumerate(filas_conteos, start=3):
+        ws.append([_celda(ws, valor, fill=_ESTILOS['dato_res'][row_idx % 2],
+                          font=_FUENTE_RES, alignment=_CENTRO, border=_BORDE_DATO)
+                   for valor in fila])
+    ws.append([])
+
+    ws.append([_celda(ws, columna, border=_BORDE_ENC, **_ESTILOS['enc_res'])
+               for columna in columnas])
+    for row_idx, fila in enumerate(chain(primeras, filas)):
+        ws.append([_celda(ws, valor, fill=_ESTILOS['dato_res'][row_idx % 2],
+                          font=_FUENTE_RES, alignment=_CENTRO, border=_BORDE_DATO)
+                   for valor in fila])
+
+
+def _hoja_resultados(wb, nombre, originales, resultados, hoja=None):
+    ws = wb.create_sheet(hoja or nombre)
+
+    cols_in, filas_in = _columnas_y_filas(originales)
+    cols_out, filas_out = _columnas_y_filas(resultados)
+    n_in, n_out = len(cols_in), len(cols_out)
+    n_total = n_in + n_out
+    vacio_in, vacio_out = (np.nan,) * n_in, (np.nan,) * n_out
+
+    # Combinar datos originales con resultados por posición (como pd.concat axis=1)
+    filas = (
+        (a if a is not None else vacio_in) + (b if b is not None else vacio_out)
+        for a, b in zip_longest(filas_in, filas_out)
+    )
+    encabezados = cols_in + cols_out
+
+    # AJUSTAR ANCHO DE COLUMNAS con el encabezado y las primeras filas
+    primeras = list(islice(filas, FILAS_ANCHO))
+    for col_idx in range(n_total):
+        max_length = len(str(encabezados[col_idx]))
+        for fila in primeras:
+            valor, _ = valor_excel(fila[col_idx])
+            if valor is not None:
+                max_length = max(max_length, len(str(valor)))
+        ws.column_dimensions[get_column_letter(col_idx + 1)].width = \
+            min(max(max_length + 2, 12), 50)
+
+    # CONGELAR PANELES después de títulos y encabezados
+    ws.freeze_panes = 'A4'
+
+    # TÍTULO PRINCIPAL
+    ws.append([_celda(ws, nombre, **_ESTILOS['titulo'])])
+    ws.merged_cells.add(f"A1:{get_column_letter(max(n_total, 1))}1")
+
+    # SUBTÍTULOS PARA DIFERENCIAR SECCIONES
+    fila2 = [_celda(ws, "DATOS ORIGINALES", **_ESTILOS['sub_orig'])] + \
+        [None] * (n_in - 1)
+    fila2.append(_celda(ws, "RESULTADOS DEL PROCESAMIENTO",
+                        border=Border(left=_SEPARADOR, right=Side(), top=Side(),
+                                      bottom=Side()),
+                        **_ESTILOS['sub_res']))
+    ws.append(fila2)
+    ws.merged_cells.add(f"A2:{get_column_letter(max(n_in, 1))}2")
+    ws.merged_cells.add(f"{get_column_letter(n_in + 1)}2:"
+                        f"{get_column_letter(max(n_total, n_in + 1))}2")
+
+    # ENCABEZADOS DE COLUMNAS (fila 3)
+    separador_enc = Border(left=_SEPARADOR, right=_BORDE_ENC.right,
+                           top=_BORDE_ENC.top, bottom=_BORDE_ENC.bottom)
+    ws.append([
+        _celda(ws, encabezado,
+               border=separador_enc if col_idx == n_in else _BORDE_ENC,
+               **_ESTILOS['enc_orig' if col_idx < n_in else 'enc_res'])
+        for col_idx, encabezado in enumerate(encabezados)
+    ])
+
+    # DATOS (desde fila 4 en adelante)
+    separador_dato = Border(left=_SEPARADOR, right=_FINO_GRIS, top=_FINO_GRIS,
+                            bottom=_FINO_GRIS)
+    for row_idx, fila in enumerate(chain(primeras, filas), start=4):
+        par = row_idx % 2
+        relleno_orig = _ESTILOS['dato_orig'][par]
+        relleno_res = _ESTILOS['dato_res'][par]
+        ws.append([
+            _celda(ws, valor,
+                   fill=relleno_orig if col_idx < n_in else relleno_res,
+                   font=_FUENTE_ORIG if col_idx < n_in else _FUENTE_RES,
+                   alignment=_CENTRO,
+                   border=separador_dato if col_idx == n_in else _BORDE_DATO)
+            for col_idx, valor in enumerate(fila)
+        ])
+
+
+def escribir_reporte(destino, secciones, tol, fecha=None, resumen=None, cambios=None):
+    """
+    Escribe el reporte Excel formateado fila por fila (openpyxl write-only)
+
+    Los datos de cada sección se consumen por bloques, de modo que el reporte
+    se puede generar directamente desde un spool en disco sin cargar todos
+    los resultados en memoria.
+
+    Args:
+        destino: Ruta o buffer binario de salida
+        secciones (list): [(nombre, originales, resultados)]; originales y
+            resultados son DataFrames o iterables de DataFrames por bloques
+        tol (int): Tolerancia utilizada (para la portada)
+        fecha (datetime): Fecha del reporte (por defecto, ahora)
+        resumen (pd.DataFrame): Tabla para una hoja 'Resumen' después de la
+            portada (por ejemplo, el resumen de un lote de libros)
+        cambios (dict): Proceso -> filas que cambiaron desde la corrida
+            anterior (utils.cambios.diferencias; None si no hay anterior),
+            para una hoja 'Cambios'. Con secciones vacías el reporte solo
+            tiene la portada y los cambios.
+    """
+    wb = Workbook(write_only=True)
+    _portada(wb, tol, fecha or dt.datetime.now())
+    usados = {'PORTADA'}
+    if resumen is not None:
+        _hoja_resumen(wb, resumen)
+        usados.add('RESUMEN')
+    if cambios:
+        _hoja_cambios(wb, cambios)
+        usados.add('CAMBIOS')
+    for nombre, originales, resultados in secciones:
+        _hoja_resultados(wb, nombre, originales, resultados,
+                         _nombre_hoja(nombre, usados))
+    wb.save(destino)
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+
+class ResultBuilder:
+    """
+    Constructor columnar de resultados a partir de pares de índices
+    
+    En lugar de armar un dict por fila, los procesos registran la posición de
+    la fila de origen (izquierda) y de la fila encontrada (derecha, -1 si no hay)
+    en arreglos enteros preasignados. Las columnas de salida se construyen al
+    final con take vectorizado sobre los DataFrames de origen, opcionalmente
+    en el orden final.
+    """
+    
+    def __init__(self, capacity=1024):
+        """
+        Args:
+            capacity (int): Capacidad inicial de los arreglos de índices
+        """
+        self._left = np.empty(capacity, dtype=np.int64)
+        self._right = np.empty(capacity, dtype=np.int64)
+        self._size = 0
+    
+    def __len__(self):
+        return self._size
+    
+    @property
+    def left(self):
+        """Posiciones de las filas de origen"""
+        return self._left[:self._size]
+    
+    @property
+    def right(self):
+        """Posiciones de las filas encontradas (-1 si no hay)"""
+        return self._right[:self._size]
+    
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= len(self._left):
+            return
+        capacity = max(needed, 2 * len(self._left))
+        for name in ('_left', '_right'):
+            grown = np.empty(capacity, dtype=np.int64)
+            grown[:self._size] = getattr(self, name)[:self._size]
+            setattr(self, name, grown)
+    
+    def append(self, left, right=-1):
+        """
+        Registra un par (fila de origen, fila encontrada o -1)
+        """
+        self._reserve(1)
+        self._left[self._size] = left
+        self._right[self._size] = right
+        self._size += 1
+    
+    def extend(self, left, right):
+        """
+        Registra un bloque de pares
+        """
+        left = np.asarray(left, dtype=np.int64)
+        right = np.broadcast_to(np.asarray(right, dtype=np.int64), left.shape)
+        self._reserve(len(left))
+        self._left[self._size:self._size + len(left)] = left
+        self._right[self._size:self._size + len(left)] = right
+        self._size += len(left)
+    
+    @staticmethod
+    def take(series, positions, fill=None):
+        """
+        Toma valores de una columna por posición; las posiciones -1 quedan
+        nulas o con el valor fill
+        
+        Args:
+            series (pd.Series): Columna de origen
+            positions (np.ndarray): Posiciones a tomar (-1 = sin valor)
+            fill: Valor para las posiciones -1 (None = nulo del tipo de la columna)
+            
+        Returns:
+            np.ndarray: Valores tomados
+        """
+        series = series.reset_index(drop=True)
+        missing = positions < 0
+        if not missing.any():
+            return series.take(positions).to_numpy()
+        values = series.reindex(positions)
+        if fill is not None:
+            values = values.astype(object).where(~missing, fill)
+        return values.to_numpy()
+    
+    def build(self, columns, order=None):
+        """
+        Construye el DataFrame de resultados
+        
+        Args:
+            columns (dict): {columna de salida: especificación}, donde la
+                especificación es ('left', serie), ('right', serie),
+                ('right', serie, fill) o un arreglo/escalar ya calculado
+                por par (en el mismo orden de registro)
+            order (np.ndarray): Permutación de los pares para el orden final
+            
+        Returns:
+            pd.DataFrame: Resultados con las columnas en el orden indicado
+        """
+        left, right = self.left, self.right
+        if order is not None:
+            left, right = left[order], right[order]
+        
+        data = {}
+        for name, spec in columns.items():
+            if isinstance(spec, tuple) and spec and spec[0] in ('left', 'right'):
+                positions = left if spec[0] == 'left' else right
+                fill = spec[2] if len(spec) > 2 else None
+                data[name] = self.take(spec[1], positions, fill)
+            elif np.ndim(spec) == 0:
+                data[name] = np.full(len(left), spec)
+            else:
+                values = np.asarray(spec)
+                data[name] = values[order] if order is not None else values
+        
+        # Igual que un DataFrame construido desde dicts, inferir tipos de columnas object
+        return pd.DataFrame(data, columns=list(columns)).infer_objects()
@@ -0,0 +1,478 @@
+"""
+Servicio HTTP local para procesar archivos ATM sin la interfaz Streamlit
+
+Uso:
+    python -m utils.servicio --puerto 8502
+
+Endpoints:
+    POST   /trabajos                         multipart: th, datos (archivos),
+                                             excl, base, ncr (hojas), tol, modo_base
+    GET    /trabajos/<id>                    estado del trabajo (JSON)
+    GET    /trabajos/<id>/reporte            reporte Excel formateado
+    GET    /trabajos/<id>/resultados/<tipo>  resultado en Parquet (excl, base, ncr)
+    DELETE /trabajos/<id>                    elimina el trabajo y sus archivos
+    GET    /salud                            estado del servicio
+    GET    /metrics                          métricas en formato Prometheus
+
+Los envíos de más de [servicio] max_mb_subida se rechazan con 413, y los
+trabajos terminados se eliminan (con sus archivos) tras ttl_horas.
+"""
+import argparse
+import email.parser
+import email.policy
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+from utils.bloques import escribir_parquet
+from utils.config import seccion_config
+from utils.metricas import (CORRIDAS, REGISTRO, TIPO_CONTENIDO,
+                            configurar_exportacion, exportar, registrar_corrida,
+                            resumen_corrida)
+from utils.pipeline import (CacheEtapas, ejecutar_sin_interfaz,
+                            iniciar_cache_proceso, limites_disco)
+from utils.procesamiento import MODOS_BASE_FALLAS
+from utils.reporte import escribir_reporte
+from utils.visor import columna_estado, metricas_resultado
+
+# Tipo de hoja en la API -> nombre del proceso
+TIPOS = {
+    'excl': 'Exclusiones-CMM',
+    'base': 'Base Fallas',
+    'ncr': 'Base Fallas NCR',
+}
+
+MIME_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+INTERVALO_LIMPIEZA = 600  # segundos entre barridos de trabajos vencidos
+
+def procesar_trabajo(directorio, hojas, tol, modo_base='ultimo'):
+    """
+    Ejecuta un trabajo en un proceso del pool
+
+    Lee th.xlsx y datos.xlsx del directorio del trabajo y deja ahí el
+    reporte y un Parquet por resultado. Las etapas del TH se cachean por
+    contenido, así que los trabajos que suben el mismo TH reutilizan su
+    limpieza e índice.
+
+    Args:
+        directorio (str): Carpeta del trabajo
+        hojas (dict): Tipo de hoja (excl, base, ncr) -> nombre de la hoja
+        tol (int): Tolerancia en minutos
+        modo_base (str): Modo de Base Fallas
+
+    Returns:
+        dict: Métricas por tipo, errores por tipo, etapas ejecutadas y los
+            datos de la corrida para utils.metricas (en 'corrida')
+    """
+    inicio = time.perf_counter()
+    with open(os.path.join(directorio, 'th.xlsx'), 'rb') as f:
+        contenido_th = f.read()
+    with open(os.path.join(directorio, 'datos.xlsx'), 'rb') as f:
+        contenido_datos = f.read()
+
+    tipos = {nombre: tipo for tipo, nombre in TIPOS.items()}
+    pipeline, resultados, errores = ejecutar_sin_interfaz(
+        contenido_th, contenido_datos,
+        {TIPOS[tipo]: hoja for tipo, hoja in hojas.items()}, tol, modo_base)
+
+    resumen = {'resultados': {},
+               'errores': {tipos[n]: e for n, e in errores.items()}}
+    for nombre, (_, df_out) in resultados.items():
+        escribir_parquet(df_out, os.path.join(directorio, f'{tipos[nombre]}.parquet'))
+        resumen['resultados'][tipos[nombre]] = metricas_df(df_out)
+
+    corrida = resumen_corrida(pipeline, resultados)
+    if resultados:
+        ruta_reporte = os.path.join(directorio, 'reporte.xlsx')
+        inicio_reporte = time.perf_counter()
+        escribir_reporte(ruta_reporte,
+                         [(n, df_in, df_out) for n, (df_in, df_out) in resultados.items()],
+                         tol)
+        corrida['reporte_segundos'] = round(time.perf_counter() - inicio_reporte, 3)
+        corrida['reporte_bytes'] = os.path.getsize(ruta_reporte)
+    corrida['errores'] = errores
+    corrida['segundos'] = round(time.perf_counter() - inicio, 3)
+    resumen['etapas'] = corrida['etapas']
+    resumen['corrida'] = corrida
+    return resumen
+
+
+def metricas_df(df):
+    """
+    Métricas de resumen de un resultado, serializables a JSON
+    """
+    columna = columna_estado(df)
+    por_estado = None
+    if columna:
+        por_estado = {str(k): int(v) for k, v in
+                      df[columna].value_counts(dropna=False).items()}
+    return metricas_resultado(len(df), len(df.columns), por_estado)
+
+
+class ServicioATM:
+    """
+    Cola de trabajos de procesamiento sobre un pool de procesos
+
+    Cada trabajo guarda sus archivos en una carpeta propia. El estado se
+    toma del futuro del pool, así que varios clientes pueden enviar
+    trabajos a la vez y el rendimiento queda limitado por los núcleos.
+    Un hilo elimina periódicamente los trabajos terminados hace más de
+    ttl_horas (ver purgar).
+    """
+
+    def __init__(self, directorio=None, procesos=None, config=None):
+        """
+        Args:
+            directorio (str): Carpeta de trabajo (por defecto, una temporal)
+            procesos (int): Procesos del pool (por defecto, [servicio] procesos
+                o la cantidad de núcleos)
+            config (dict): Configuración (por defecto, atm_config.toml)
+        """
+        seccion = seccion_config('servicio', config)
+        self.max_bytes_subida = float(seccion.get('max_mb_subida', 200)) * 2**20
+        self.ttl = float(seccion.get('ttl_horas', 24)) * 3600
+        self.directorio = directorio or tempfile.mkdtemp(prefix='atm_servicio_')
+        self._temporal = directorio is None
+        os.makedirs(os.path.join(self.directorio, 'trabajos'), exist_ok=True)
+        directorio_cache = seccion.get('directorio_cache') or \
+            os.path.join(self.directorio, 'cache')
+
+        self.pool = ProcessPoolExecutor(
+            max_workers=procesos or seccion.get('procesos') or os.cpu_count(),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=iniciar_cache_proceso,
+            initargs=(directorio_cache, int(seccion.get('max_entradas', 32)),
+                      limites_disco(config)))
+        self._cache = CacheEtapas(directorio=directorio_cache, **limites_disco(config))
+        self.trabajos = {}
+        self._lock = threading.Lock()
+        configurar_exportacion(config)
+        self._parar = threading.Event()
+        threading.Thread(target=self._limpiar_periodicamente, daemon=True,
+                         name='limpieza-servicio').start()
+
+    def _carpeta(self, id_trabajo):
+        return os.path.join(self.directorio, 'trabajos', id_trabajo)
+
+    def enviar(self, contenido_th, contenido_datos, hojas, tol=30, modo_base='ultimo'):
+        """
+        Encola un trabajo
+
+        Returns:
+            str: Identificador del trabajo
+        """
+        if not hojas:
+            raise ValueError("Selecciona al menos una hoja (excl, base o ncr)")
+        desconocidos = set(hojas) - set(TIPOS)
+        if desconocidos:
+            raise ValueError(f"Tipos de hoja desconocidos: {sorted(desconocidos)}")
+        if modo_base not in MODOS_BASE_FALLAS:
+            raise ValueError(f"Modo de Base Fallas desconocido: {modo_base}")
+
+        id_trabajo = uuid.uuid4().hex
+        carpeta = self._carpeta(id_trabajo)
+        os.makedirs(carpeta)
+        with open(os.path.join(carpeta, 'th.xlsx'), 'wb') as f:
+            f.write(contenido_th)
+        with open(os.path.join(carpeta, 'datos.xlsx'), 'wb') as f:
+            f.write(contenido_datos)
+
+        enviado = time.perf_counter()
+        trabajo = {
+            'creado': datetime.now().isoformat(timespec='seconds'),
+            'hojas': dict(hojas),
+            'tol': int(tol),
+        }
+        trabajo['futuro'] = self.pool.submit(procesar_trabajo, carpeta, dict(hojas),
+                                             int(tol), modo_base)
+        trabajo['futuro'].add_done_callback(lambda f: _registrar_trabajo(f, enviado))
+        trabajo['futuro'].add_done_callback(
+            lambda _: trabajo.setdefault('terminado', time.time()))
+        with self._lock:
+            self.trabajos[id_trabajo] = trabajo
+        return id_trabajo
+
+    def estado(self, id_trabajo):
+        """
+        Estado de un trabajo (None si no existe)
+
+        Returns:
+            dict: id, estado (en_cola, procesando, terminado, error) y,
+                al terminar, métricas, errores y etapas
+        """
+        with self._lock:
+            trabajo = self.trabajos.get(id_trabajo)
+        if trabajo is None:
+            return None
+        futuro = trabajo['futuro']
+        estado = {'id': id_trabajo, 'creado': trabajo['creado'],
+                  'hojas': trabajo['hojas'], 'tol': trabajo['tol']}
+        if not futuro.done():
+            estado['estado'] = 'procesando' if futuro.running() else 'en_cola'
+        elif futuro.exception() is not None:
+            estado['estado'] = 'error'
+            estado['error'] = str(futuro.exception())
+        else:
+            estado['estado'] = 'terminado'
+            estado.update(futuro.result())
+        return estado
+
+    def archivo(self, id_trabajo, nombre):
+        """
+        Ruta de un archivo de salida de un trabajo terminado (None si no existe)
+        """
+        estado = self.estado(id_trabajo)
+        if estado is None or estado['estado'] != 'terminado':
+            return None
+        ruta = os.path.join(self._carpeta(id_trabajo), nombre)
+        return ruta if os.path.exists(ruta) else None
+
+    def eliminar(self, id_trabajo):
+        """
+        Elimina un trabajo y sus archivos (cancela si aún está en cola)
+        """
+        with self._lock:
+            trabajo = self.trabajos.pop(id_trabajo, None)
+        if trabajo is None:
+            return False
+        if not trabajo['futuro'].cancel() and not trabajo['futuro'].done():
+            # En curso: los archivos se eliminan cuando termine
+            trabajo['futuro'].add_done_callback(
+                lambda _: shutil.rmtree(self._carpeta(id_trabajo), ignore_errors=True))
+        else:
+            shutil.rmtree(self._carpeta(id_trabajo), ignore_errors=True)
+        return True
+
+    def purgar(self, ahora=None):
+        """
+        Elimina los trabajos terminados hace más de ttl_horas, las carpetas
+        de trabajos que ya no están registrados (p. ej. de una ejecución
+        anterior con el mismo directorio) y las entradas vencidas de la
+        caché de etapas
+
+        Returns:
+            int: Trabajos eliminados
+        """
+        ahora = ahora or time.time()
+        with self._lock:
+            vencidos = [id_trabajo for id_trabajo, trabajo in self.trabajos.items()
+                        if ahora - trabajo.get('terminado', ahora) > self.ttl]
+            registrados = set(self.trabajos)
+        for id_trabajo in vencidos:
+            self.eliminar(id_trabajo)
+
+        carpeta_trabajos = os.path.join(self.directorio, 'trabajos')
+        for nombre in os.listdir(carpeta_trabajos):
+            ruta = os.path.join(carpeta_trabajos, nombre)
+            try:
+                huerfana = nombre not in registrados and \
+                    ahora - os.path.getmtime(ruta) > self.ttl
+            except OSError:
+                continue
+            if huerfana:
+                shutil.rmtree(ruta, ignore_errors=True)
+        self._cache.podar_disco()
+        return len(vencidos)
+
+    def _limpiar_periodicamente(self):
+        while not self._parar.wait(INTERVALO_LIMPIEZA):
+            try:
+                self.purgar()
+            except OSError:
+                # Se reintenta en el próximo barrido
+                pass
+
+    def cerrar(self):
+        """
+        Detiene el pool y elimina la carpeta temporal
+        """
+        self._parar.set()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        if self._temporal:
+            shutil.rmtree(self.directorio, ignore_errors=True)
+
+
+def _registrar_trabajo(futuro, enviado):
+    """
+    Registra en las métricas un trabajo terminado (una vez, al terminar)
+    """
+    if futuro.cancelled():
+        return
+    if futuro.exception() is not None:
+        CORRIDAS.sumar(origen='servicio', resultado='error')
+        exportar()
+        return
+    corrida = futuro.result()['corrida']
+    registrar_corrida(corrida, 'servicio',
+                      espera=time.perf_counter() - enviado - corrida['segundos'])
+
+
+def _leer_multipart(tipo_contenido, cuerpo):
+    """
+    Separa un cuerpo multipart/form-data en campos y archivos
+    """
+    mensaje = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f'Content-Type: {tipo_contenido}\r\n\r\n'.encode() + cuerpo)
+    if not mensaje.is_multipart():
+        raise ValueError("Se esperaba un cuerpo multipart/form-data")
+    campos = {}
+    for parte in mensaje.iter_parts():
+        nombre = parte.get_param('name', header='content-disposition')
+        if nombre:
+            campos[nombre] = parte.get_payload(decode=True) or b''
+    return campos
+
+
+class ManejadorServicio(BaseHTTPRequestHandler):
+    """
+    Rutas HTTP del servicio (el servidor expone el ServicioATM en .servicio)
+    """
+
+    server_version = 'ServicioATM/1.0'
+
+    def log_message(self, formato, *args):
+        if self.server.registrar:
+            super().log_message(formato, *args)
+
+    def _responder(self, codigo, cuerpo, tipo='application/json', nombre=None):
+        if isinstance(cuerpo, (dict, list)):
+            cuerpo = json.dumps(cuerpo, ensure_ascii=False, default=str).encode()
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        if nombre:
+            self.send_header('Content-Disposition', f'attachment; filename="{nombre}"')
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _archivo(self, ruta, tipo, nombre):
+        with open(ruta, 'rb') as f:
+            self._responder(200, f.read(), tipo, nombre)
+
+    def _partes(self):
+        return [unquote(p) for p in urlparse(self.path).path.strip('/').split('/') if p]
+
+    def do_GET(self):
+        partes = self._partes()
+        servicio = self.server.servicio
+        if partes == ['salud']:
+            return self._responder(200, {'estado': 'ok', 'trabajos': len(servicio.trabajos)})
+        if partes == ['metrics']:
+            return self._responder(200, REGISTRO.texto().encode(), TIPO_CONTENIDO)
+        if len(partes) < 2 or partes[0] != 'trabajos':
+            return self._responder(404, {'error': 'Ruta no encontrada'})
+
+        id_trabajo = partes[1]
+        estado = servicio.estado(id_trabajo)
+        if estado is None:
+            return self._responder(404, {'error': 'Trabajo no encontrado'})
+        if len(partes) == 2:
+            return self._responder(200, estado)
+
+        if partes[2:] == ['reporte']:
+            ruta = servicio.archivo(id_trabajo, 'reporte.xlsx')
+            if ruta:
+                return self._archivo(ruta, MIME_XLSX, f'Resultados_ATM_{id_trabajo[:8]}.xlsx')
+        elif len(partes) == 4 and partes[2] == 'resultados':
+            tipo = partes[3].removesuffix('.parquet')
+            ruta = servicio.archivo(id_trabajo, f'{tipo}.parquet') if tipo in TIPOS else None
+            if ruta:
+                return self._archivo(ruta, 'application/vnd.apache.parquet', f'{tipo}.parquet')
+        else:
+            return self._responder(404, {'error': 'Ruta no encontrada'})
+
+        if estado['estado'] in ('en_cola', 'procesando'):
+            return self._responder(409, {'error': 'El trabajo aún no terminó',
+                                         'estado': estado['estado']})
+        return self._responder(404, {'error': 'El trabajo no generó ese archivo',
+                                     'estado': estado['estado']})
+
+    def do_POST(self):
+        if self._partes() != ['trabajos']:
+            return self._responder(404, {'error': 'Ruta no encontrada'})
+        try:
+            largo = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            return self._responder(400, {'error': 'Content-Length inválido'})
+        maximo = self.server.servicio.max_bytes_subida
+        if largo > maximo:
+            # El cuerpo no se lee: se cierra la conexión después de responder
+            self.close_connection = True
+            return self._responder(413, {
+                'error': f'El envío supera el máximo de {maximo / 2**20:g} MB'})
+        try:
+            campos = _leer_multipart(self.headers.get('Content-Type', ''),
+                                     self.rfile.read(largo))
+            if not campos.get('th') or not campos.get('datos'):
+                raise ValueError("Los archivos 'th' y 'datos' son requeridos")
+            hojas = {tipo: campos[tipo].decode() for tipo in TIPOS
+                     if campos.get(tipo)}
+            id_trabajo = self.server.servicio.enviar(
+                campos['th'], campos['datos'], hojas,
+                int(campos.get('tol', b'30').decode() or 30),
+                campos.get('modo_base', b'ultimo').decode() or 'ultimo')
+        except ValueError as e:
+            return self._responder(400, {'error': str(e)})
+        self._responder(202, {'id': id_trabajo, 'estado': f'/trabajos/{id_trabajo}'})
+
+    def do_DELETE(self):
+        partes = self._partes()
+        if len(partes) != 2 or partes[0] != 'trabajos':
+            return self._responder(404, {'error': 'Ruta no encontrada'})
+        if not self.server.servicio.eliminar(partes[1]):
+            return self._responder(404, {'error': 'Trabajo no encontrado'})
+        self._responder(200, {'id': partes[1], 'estado': 'eliminado'})
+
+
+def crear_servidor(host='127.0.0.1', puerto=8502, servicio=None, registrar=True):
+    """
+    Crea el servidor HTTP (cada petición se atiende en su propio hilo)
+
+    Args:
+        host (str): Interfaz de escucha (por defecto, solo localhost)
+        puerto (int): Puerto (0 = uno libre)
+        servicio (ServicioATM): Servicio a exponer (por defecto, uno nuevo)
+        registrar (bool): Registrar las peticiones en stderr
+
+    Returns:
+        ThreadingHTTPServer: Servidor con el servicio en .servicio
+    """
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorServicio)
+    servidor.servicio = servicio or ServicioATM()
+    servidor.registrar = registrar
+    return servidor
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servicio HTTP de procesamiento ATM')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8502)
+    parser.add_argument('--procesos', type=int, default=None)
+    parser.add_argument('--directorio', default=None,
+                        help='Carpeta de trabajo (por defecto, una temporal)')
+    args = parser.parse_args(argv)
+
+    servidor = crear_servidor(args.host, args.puerto,
+                              ServicioATM(args.directorio, args.procesos))
+    print(f"Servicio ATM escuchando en http://{args.host}:{servidor.server_port}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servidor.servicio.cerrar()
+
+
+if __name__ == '__main__':
+    main()
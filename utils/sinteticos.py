@@ -0,0 +1,80 @@
+"""
+Libros Excel sintéticos para las herramientas de línea de comandos
+
+Un TH Downtime (con el encabezado del reporte antes de los títulos) y un
+libro ATM con las hojas CMM, BF y NCR, generados en memoria con una
+semilla fija. Los usan la prueba de carga (utils.carga) y el ejemplo de
+métricas (utils.metricas) sin importar Streamlit.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+
+
+def libros_sinteticos(filas_th=5000, filas_datos=2000, semilla=0):
+    """
+    Genera un TH Downtime y un libro ATM (hojas CMM, BF y NCR) en memoria
+
+    Args:
+        filas_th (int): Tickets del TH
+        filas_datos (int): Filas de cada hoja del libro ATM
+        semilla (int): Semilla del generador
+
+    Returns:
+        tuple: (bytes del TH, bytes del libro ATM)
+    """
+    rng = np.random.default_rng(semilla)
+    base = pd.Timestamp('2024-01-01')
+    n_atm = max(10, filas_th // 20)
+
+    inicio_th = base + pd.to_timedelta(rng.integers(0, 60 * 24 * 30, filas_th), 'm')
+    th = pd.DataFrame({
+        'ID': [f'ATM{i:05d}' for i in rng.integers(1, n_atm, filas_th)],
+        'TICKET KEY': [f'TK{i}' for i in range(filas_th)],
+        'START TIME': inicio_th.astype(str),
+        'END TIME': (inicio_th + pd.to_timedelta(rng.integers(10, 600, filas_th), 'm'))
+        .astype(str),
+        'REFERENCE': np.where(rng.random(filas_th) < 0.5,
+                              [f'WO{i}' for i in range(filas_th)], None),
+        'CATEGORY': rng.choice(['Dispenser no paga SLMG', 'Lector de Tarjeta SLMG',
+                                'Impresora de recibos SLMG', 'BNA/SDM/Deposito SLMG',
+                                'Falla de HW / Servicio Técnico', 'Comunicaciones'],
+                               filas_th),
+    })
+
+    inicio = base + pd.to_timedelta(rng.integers(0, 60 * 24 * 30, filas_datos), 'm')
+    fin = inicio + pd.to_timedelta(rng.integers(10, 600, filas_datos), 'm')
+    atm = [f'{i:04d}' for i in rng.integers(1, n_atm, filas_datos)]
+    hojas = {
+        'CMM': pd.DataFrame({
+            'ATM': atm, 'FECHA INICIO': inicio.normalize(),
+            'HORA INICIO': [t.time() for t in inicio],
+            'FECHA TERMINO': fin.normalize(), 'HORA TERMINO': [t.time() for t in fin],
+            'CODIGO SBIF': rng.integers(1, 8, filas_datos)}),
+        'BF': pd.DataFrame({
+            'ATM': atm,
+            'RESUMEN FALLA': rng.choice(['dispensador con falla', 'host down',
+                                         'impresora sin papel', 'cash out'], filas_datos),
+            'FECHA INICIO': inicio.normalize(), 'HORA INICIO': [t.time() for t in inicio]}),
+        'NCR': pd.DataFrame({
+            'ATM': atm,
+            'WO': np.where(rng.random(filas_datos) < 0.4,
+                           [f'WO{i}' for i in rng.integers(0, filas_th * 2, filas_datos)],
+                           None),
+            'FALLA NCR': rng.choice(['Dispensador con falla', 'lector de tarjeta con falla',
+                                     'impresora con falla', 'hardware'], filas_datos),
+            'FECHA INICIAL': inicio.normalize(),
+            'HORA INICIAL': [t.time() for t in inicio]}),
+    }
+
+    buffer_th = io.BytesIO()
+    with pd.ExcelWriter(buffer_th) as writer:
+        # Encabezado del reporte TH antes de la fila de títulos
+        pd.DataFrame([['Reporte TH Downtime']]).to_excel(writer, index=False, header=False)
+        th.to_excel(writer, index=False, startrow=2)
+    buffer_datos = io.BytesIO()
+    with pd.ExcelWriter(buffer_datos) as writer:
+        for hoja, df in hojas.items():
+            df.to_excel(writer, sheet_name=hoja, index=False)
+    return buffer_th.getvalue(), buffer_datos.getvalue()
@@ -0,0 +1,515 @@
+"""
+Procesamiento desatendido de una carpeta compartida
+
+Uso:
+    python -m utils.vigilancia --entrada /datos/entrada --salida /datos/reportes
+
+Cada archivo Excel que llega a la carpeta de entrada se considera completo
+cuando existe su archivo centinela (<archivo>.ok o <nombre>.ok) o cuando su
+última modificación tiene al menos el tiempo de estabilidad (y no cambió
+entre dos revisiones). Los archivos TH Downtime se reconocen por su
+encabezado; cada archivo de datos se procesa contra el TH más reciente (por
+fecha de modificación) y su reporte queda en la carpeta de salida. Los
+archivos cuyo contenido ya se procesó se omiten; los que fallaron se
+reintentan hasta `reintentos` veces.
+"""
+import argparse
+import fnmatch
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from utils.cambios import RegistroCorridas, conteos, fuente_libro
+from utils.config import seccion_config
+from utils.metricas import (CORRIDAS, configurar_exportacion, exportar,
+                            registrar_corrida, resumen_corrida)
+from utils.pipeline import (ejecutar_sin_interfaz, iniciar_cache_proceso,
+                            limites_disco)
+from utils.reporte import escribir_reporte
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONES = ('.xlsx', '.xls')
+SUFIJOS_CENTINELA = ('.ok', '.listo')
+REGISTRO = '.procesados.json'
+
+# Hojas buscadas en cada archivo de datos, por proceso
+HOJAS_DEFECTO = {
+    'Exclusiones-CMM': ['Exclusiones-CMM', 'CMM'],
+    'Base Fallas': ['Base Fallas'],
+    'Base Fallas NCR': ['Base Fallas NCR', 'NCR'],
+}
+
+
+def huella_archivo(ruta, bloque=1 << 20):
+    """
+    Hash del contenido de un archivo (leído por bloques)
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(ruta, 'rb') as f:
+        for trozo in iter(lambda: f.read(bloque), b''):
+            h.update(trozo)
+    return h.hexdigest()
+
+
+def es_archivo_th(ruta):
+    """
+    Indica si un archivo es un export de TH Downtime (por su encabezado)
+    """
+    try:
+        primeras = pd.read_excel(ruta, header=None, nrows=5)
+    except Exception:
+        return False
+    texto = ' '.join(primeras.astype(str).to_numpy().ravel()).upper()
+    return 'TICKET KEY' in texto and 'START TIME' in texto
+
+
+def hojas_a_procesar(ruta, hojas_config=None):
+    """
+    Procesos que se pueden ejecutar con las hojas presentes en un archivo
+
+    Returns:
+        dict: Nombre de proceso -> hoja del archivo
+    """
+    disponibles = {h.strip().upper(): h for h in pd.ExcelFile(ruta).sheet_names}
+    seleccion = {}
+    for nombre, candidatas in (hojas_config or HOJAS_DEFECTO).items():
+        if isinstance(candidatas, str):
+            candidatas = [candidatas]
+        for candidata in candidatas:
+            if candidata.strip().upper() in disponibles:
+                seleccion[nombre] = disponibles[candidata.strip().upper()]
+                break
+    return seleccion
+
+
+def procesar_archivo(ruta_th, ruta_datos, hojas, tol, modo_base, ruta_reporte,
+                     dir_cambios=None, solo_cambios=False):
+    """
+    Procesa un archivo de datos en un proceso del pool
+
+    Args:
+        dir_cambios (str): Carpeta de instantáneas de utils.cambios; si se
+            indica, el reporte agrega la hoja 'Cambios' respecto de la
+            corrida anterior de cada proceso
+        solo_cambios (bool): Con una corrida anterior, escribir solo la
+            portada y la hoja 'Cambios'
+
+    Returns:
+        dict: Filas por proceso, errores, cambios por tipo, segundos de
+            procesamiento y los datos de la corrida para utils.metricas
+    """
+    inicio = time.perf_counter()
+    with open(ruta_th, 'rb') as f:
+        contenido_th = f.read()
+    with open(ruta_datos, 'rb') as f:
+        contenido_datos = f.read()
+
+    pipeline, resultados, errores = ejecutar_sin_interfaz(
+        contenido_th, contenido_datos, hojas, tol, modo_base)
+    cambios = {}
+    if dir_cambios:
+        registro = RegistroCorridas(dir_cambios)
+        for nombre, (df_in, df_out) in resultados.items():
+            diferencia = registro.comparar(nombre, df_in, df_out,
+                                          fuente=fuente_libro(ruta_datos))
+            if diferencia is not None:
+                cambios[nombre] = diferencia
+    reporte = {}
+    if resultados:
+        secciones = [] if solo_cambios and cambios else \
+            [(n, df_in, df_out) for n, (df_in, df_out) in resultados.items()]
+        inicio_reporte = time.perf_counter()
+        escribir_reporte(ruta_reporte, secciones, tol, cambios=cambios)
+        reporte = {'reporte_segundos': round(time.perf_counter() - inicio_reporte, 3),
+                   'reporte_bytes': os.path.getsize(ruta_reporte)}
+    return {
+        **resumen_corrida(pipeline, resultados),
+        **reporte,
+        'errores': errores,
+        'cambios': {n: conteos(c) for n, c in cambios.items()},
+        'segundos': round(time.perf_counter() - inicio, 3),
+    }
+
+
+class VigilanteCarpeta:
+    """
+    Vigila una carpeta y procesa automáticamente los archivos que llegan
+
+    Cada revisión detecta los archivos completos, reconoce los TH y envía
+    cada archivo de datos nuevo a un pool acotado de procesos. El registro
+    de huellas procesadas se guarda en la carpeta de salida, de modo que un
+    reinicio no vuelve a procesar lo ya hecho.
+    """
+
+    def __init__(self, entrada, salida, procesos=None, estabilidad=30,
+                 tol=30, modo_base='ultimo', hojas=None, patron='*', config=None,
+                 dir_cambios=None, solo_cambios=False, espera_th=0, reintentos=3):
+        """
+        Args:
+            entrada (str): Carpeta vigilada
+            salida (str): Carpeta de reportes (y del registro de procesados)
+            procesos (int): Máximo de archivos procesados a la vez
+            estabilidad (float): Antigüedad mínima de la última modificación
+                para dar un archivo por completo (segundos)
+            tol (int): Tolerancia en minutos
+            modo_base (str): Modo de Base Fallas
+            hojas (dict): Proceso -> nombres de hoja aceptados
+            patron (str): Patrón de nombres de archivo a considerar
+            config (dict): Configuración (por defecto, atm_config.toml)
+            dir_cambios (str): Carpeta de instantáneas para la hoja 'Cambios'
+                (por defecto, la de la sección [cambios])
+            solo_cambios (bool): Reportes solo con los cambios respecto de la
+                corrida anterior (por defecto, el de la sección [cambios])
+            espera_th (float): Segundos que un archivo de datos posterior al
+                último TH espera a que llegue el TH del día antes de
+                procesarse con el anterior
+            reintentos (int): Intentos por archivo antes de dejarlo en error
+        """
+        self.entrada = entrada
+        self.salida = salida
+        self.estabilidad = estabilidad
+        self.tol = tol
+        self.modo_base = modo_base
+        self.hojas = hojas or HOJAS_DEFECTO
+        self.patron = patron
+        self.espera_th = espera_th
+        self.reintentos = reintentos
+        os.makedirs(salida, exist_ok=True)
+        seccion = seccion_config('cambios', config)
+        self.dir_cambios = dir_cambios or seccion.get('directorio') or None
+        self.solo_cambios = solo_cambios or bool(seccion.get('solo_cambios', False))
+        configurar_exportacion(config)
+
+        seccion = seccion_config('pipeline', config)
+        self.pool = ProcessPoolExecutor(
+            max_workers=procesos or min(4, os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=iniciar_cache_proceso,
+            initargs=(seccion.get('directorio_cache') or None,
+                      int(seccion.get('max_entradas', 32)),
+                      limites_disco(config)))
+
+        self._vistos = {}      # ruta -> (tamaño, mtime) en la última revisión
+        self._esperando = set()  # archivos de datos a la espera de un TH nuevo
+        self._huellas = {}     # ruta -> (tamaño, mtime, huella)
+        self._en_curso = {}    # huella -> futuro
+        self._lock = threading.Lock()
+        self.registro = self._cargar_registro()
+
+    @classmethod
+    def desde_config(cls, entrada=None, salida=None, config=None, **kwargs):
+        """
+        Crea el vigilante según la sección [vigilancia] de atm_config.toml
+        """
+        seccion = seccion_config('vigilancia', config)
+        opciones = {clave: seccion[clave] for clave in
+                    ('procesos', 'estabilidad', 'tol', 'modo_base', 'hojas', 'patron',
+                     'espera_th', 'reintentos')
+                    if clave in seccion}
+        opciones.update({k: v for k, v in kwargs.items() if v is not None})
+        return cls(entrada or seccion['entrada'], salida or seccion['salida'],
+                   config=config, **opciones)
+
+    # Registro de archivos procesados
+
+    def _ruta_registro(self):
+        return os.path.join(self.salida, REGISTRO)
+
+    def _cargar_registro(self):
+        if not os.path.exists(self._ruta_registro()):
+            return {}
+        with open(self._ruta_registro(), encoding='utf-8') as f:
+            return json.load(f)
+
+    def _guardar_registro(self):
+        temporal = self._ruta_registro() + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(self.registro, f, ensure_ascii=False, indent=2)
+        os.replace(temporal, self._ruta_registro())
+
+    # Detección de archivos completos
+
+    def _tiene_centinela(self, ruta):
+        base = os.path.splitext(ruta)[0]
+        return any(os.path.exists(ruta + s) or os.path.exists(base + s)
+                   for s in SUFIJOS_CENTINELA)
+
+    def archivos_completos(self, ahora=None):
+        """
+        Archivos Excel de la entrada que ya terminaron de copiarse
+
+        Returns:
+            list: Rutas completas, de la más antigua a la más reciente
+        """
+        ahora = time.time() if ahora is None else ahora
+        completos, presentes = [], set()
+        for nombre in os.listdir(self.entrada):
+            ruta = os.path.join(self.entrada, nombre)
+            if nombre.startswith(('~$', '.')) or \
+                    not nombre.lower().endswith(EXTENSIONES) or \
+                    not fnmatch.fnmatch(nombre, self.patron) or \
+                    not os.path.isfile(ruta):
+                continue
+            presentes.add(ruta)
+            estado = os.stat(ruta)
+            firma = (estado.st_size, estado.st_mtime)
+            anterior = self._vistos.get(ruta)
+            self._vistos[ruta] = firma
+            # Un cambio entre revisiones indica que se sigue copiando; si no,
+            # alcanza con la antigüedad de la última modificación (también
+            # en la primera revisión, p. ej. con --una-vez o tras un reinicio)
+            cambio = anterior is not None and anterior != firma
+            if self._tiene_centinela(ruta) or \
+                    (not cambio and ahora - estado.st_mtime >= self.estabilidad):
+                completos.append((estado.st_mtime, ruta))
+        for ruta in set(self._vistos) - presentes:
+            del self._vistos[ruta]
+        return [ruta for _, ruta in sorted(completos)]
+
+    def _huella(self, ruta):
+        tamano, mtime = self._vistos[ruta][:2]
+        guardada = self._huellas.get(ruta)
+        if guardada is None or guardada[:2] != (tamano, mtime):
+            guardada = (tamano, mtime, huella_archivo(ruta))
+            self._huellas[ruta] = guardada
+        return guardada[2]
+
+    # Procesamiento
+
+    def revisar(self):
+        """
+        Revisa la carpeta una vez y envía al pool los archivos nuevos
+
+        Returns:
+            list: Rutas enviadas a procesar en esta revisión
+        """
+        datos = []
+        for ruta in self.archivos_completos():
+            huella = self._huella(ruta)
+            if huella in self._en_curso or not self._pendiente(huella):
+                continue
+            if es_archivo_th(ruta):
+                # Se registran todos los TH nuevos, aunque lleguen varios juntos
+                self._registrar_th(ruta)
+            else:
+                datos.append((ruta, huella))
+
+        mtime_th, th_actual = self._ultimo_th()
+        if datos and th_actual is None:
+            logger.info("Hay %d archivo(s) esperando un TH Downtime", len(datos))
+            return []
+
+        ahora = time.time()
+        enviados = []
+        for ruta, huella in datos:
+            mtime = self._vistos[ruta][1]
+            if mtime > mtime_th:
+                # El archivo es posterior al último TH: el del día puede no
+                # haber llegado todavía
+                if ahora - mtime < self.espera_th:
+                    if ruta not in self._esperando:
+                        logger.info("%s: esperando un TH Downtime posterior (hasta %d s)",
+                                    os.path.basename(ruta), self.espera_th)
+                        self._esperando.add(ruta)
+                    continue
+                logger.warning("%s: se procesa con %s, un TH Downtime anterior al archivo",
+                               os.path.basename(ruta), os.path.basename(th_actual))
+            self._esperando.discard(ruta)
+            hojas = hojas_a_procesar(ruta, self.hojas)
+            if not hojas:
+                logger.warning("%s: sin hojas reconocibles, se omite",
+                               os.path.basename(ruta))
+                self._registrar(huella, ruta, th_actual, estado='omitido')
+                continue
+            self._enviar(ruta, huella, th_actual, hojas)
+            enviados.append(ruta)
+        return enviados
+
+    def _pendiente(self, huella):
+        """
+        Indica si un archivo falta procesar (nuevo, o con error y con
+        intentos disponibles)
+        """
+        datos = self.registro.get(huella)
+        if datos is None:
+            return True
+        return datos.get('estado') == 'error' and \
+            datos.get('intentos', 1) < self.reintentos
+
+    def _ultimo_th(self):
+        """
+        TH vigente: el registrado con la modificación más reciente
+
+        Returns:
+            tuple: (mtime, ruta); (None, None) si no hay ninguno
+        """
+        ths = [(datos.get('mtime') or os.path.getmtime(datos['archivo']), datos['archivo'])
+               for datos in self.registro.values()
+               if datos.get('tipo') == 'th' and os.path.exists(datos['archivo'])]
+        return max(ths) if ths else (None, None)
+
+    def _registrar_th(self, ruta):
+        huella = self._huella(ruta)
+        if huella not in self.registro:
+            logger.info("TH Downtime detectado: %s", os.path.basename(ruta))
+            self._registrar(huella, ruta, None, tipo='th', estado='th',
+                            mtime=self._vistos[ruta][1])
+
+    def _registrar(self, huella, ruta, ruta_th, tipo='datos', **datos):
+        with self._lock:
+            self.registro[huella] = {
+                'archivo': ruta,
+                'tipo': tipo,
+                'th': ruta_th,
+                'fecha': datetime.now().isoformat(timespec='seconds'),
+                **datos,
+            }
+            self._guardar_registro()
+
+    def _enviar(self, ruta, huella, ruta_th, hojas):
+        nombre = os.path.splitext(os.path.basename(ruta))[0]
+        ruta_reporte = os.path.join(
+            self.salida, f"{nombre}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
+        enviado = time.perf_counter()
+        futuro = self.pool.submit(procesar_archivo, ruta_th, ruta, hojas,
+                                  self.tol, self.modo_base, ruta_reporte,
+                                  self.dir_cambios, self.solo_cambios)
+        self._en_curso[huella] = futuro
+        logger.info("%s: en cola (%s)", os.path.basename(ruta), ', '.join(hojas))
+
+        futuro.add_done_callback(functools.partial(
+            self._terminado, ruta=ruta, huella=huella, ruta_th=ruta_th,
+            ruta_reporte=ruta_reporte, enviado=enviado))
+
+    def _terminado(self, futuro, ruta, huella, ruta_th, ruta_reporte, enviado):
+        """
+        Registra el resultado de un archivo (callback del futuro)
+
+        El archivo deja de estar en curso recién después de registrarse, para
+        que esperar() vea el registro completo.
+        """
+        espera_total = round(time.perf_counter() - enviado, 3)
+        try:
+            self._registrar_resultado(futuro, ruta, huella, ruta_th, ruta_reporte,
+                                      espera_total)
+        finally:
+            self._en_curso.pop(huella, None)
+
+    def _registrar_resultado(self, futuro, ruta, huella, ruta_th, ruta_reporte,
+                             espera_total):
+        try:
+            resumen = futuro.result()
+        except Exception as e:
+            intentos = self.registro.get(huella, {}).get('intentos', 0) + 1
+            logger.error("%s: error (%s)%s", os.path.basename(ruta), e,
+                         ', se reintentará' if intentos < self.reintentos else '')
+            CORRIDAS.sumar(origen='vigilancia', resultado='error')
+            exportar()
+            self._registrar(huella, ruta, ruta_th, estado='error', error=str(e),
+                            intentos=intentos, segundos_total=espera_total)
+            return
+        logger.info("%s: procesado en %.2f s (%.2f s desde que entró a la cola) -> %s",
+                    os.path.basename(ruta), resumen['segundos'], espera_total,
+                    os.path.basename(ruta_reporte))
+        for proceso, por_tipo in resumen['cambios'].items():
+            logger.info("%s: cambios en %s: %s", os.path.basename(ruta), proceso,
+                        ', '.join(f'{n} {t.lower()}' for t, n in por_tipo.items()))
+        for proceso, error in resumen['errores'].items():
+            logger.warning("%s: error en %s (%s)", os.path.basename(ruta), proceso, error)
+        registrar_corrida(resumen, 'vigilancia',
+                          espera=espera_total - resumen['segundos'])
+        self._registrar(huella, ruta, ruta_th, estado='procesado',
+                        reporte=ruta_reporte, segundos_total=espera_total,
+                        **resumen)
+
+    def esperar(self):
+        """
+        Espera a que terminen los archivos en curso
+        """
+        for futuro in list(self._en_curso.values()):
+            try:
+                futuro.result()
+            except Exception:
+                pass
+        # Los callbacks se ejecutan después de resolver el futuro
+        while self._en_curso:
+            time.sleep(0.05)
+
+    def ejecutar(self, intervalo=10, detener=None):
+        """
+        Revisa la carpeta cada `intervalo` segundos hasta que se pida detener
+
+        Args:
+            intervalo (float): Segundos entre revisiones
+            detener (threading.Event): Evento para terminar el ciclo
+        """
+        detener = detener or threading.Event()
+        logger.info("Vigilando %s (reportes en %s)", self.entrada, self.salida)
+        while not detener.is_set():
+            try:
+                self.revisar()
+            except Exception:
+                logger.exception("Error revisando %s", self.entrada)
+            detener.wait(intervalo)
+
+    def cerrar(self):
+        """
+        Espera los archivos en curso y detiene el pool
+        """
+        self.esperar()
+        self.pool.shutdown(wait=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Procesamiento automático de una carpeta de archivos ATM')
+    parser.add_argument('--entrada', help='Carpeta vigilada ([vigilancia] entrada)')
+    parser.add_argument('--salida', help='Carpeta de reportes ([vigilancia] salida)')
+    parser.add_argument('--procesos', type=int)
+    parser.add_argument('--estabilidad', type=float,
+                        help='Segundos sin cambios para dar un archivo por completo')
+    parser.add_argument('--intervalo', type=float, default=10,
+                        help='Segundos entre revisiones')
+    parser.add_argument('--tol', type=int)
+    parser.add_argument('--una-vez', action='store_true',
+                        help='Revisar una sola vez, esperar y salir')
+    parser.add_argument('--dir-cambios',
+                        help='Carpeta de instantáneas para la hoja Cambios ([cambios] directorio)')
+    parser.add_argument('--solo-cambios', action='store_true',
+                        help='Reportes solo con los cambios desde la corrida anterior')
+    parser.add_argument('--metricas-puerto', type=int,
+                        help='Puerto del endpoint /metrics de Prometheus ([metricas] puerto)')
+    parser.add_argument('--metricas-archivo',
+                        help='Archivo para el textfile collector ([metricas] archivo)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    configurar_exportacion(archivo=args.metricas_archivo, puerto=args.metricas_puerto)
+    vigilante = VigilanteCarpeta.desde_config(
+        args.entrada, args.salida, procesos=args.procesos,
+        estabilidad=args.estabilidad, tol=args.tol, dir_cambios=args.dir_cambios,
+        solo_cambios=args.solo_cambios or None)
+    try:
+        if args.una_vez:
+            vigilante.revisar()
+        else:
+            vigilante.ejecutar(args.intervalo)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        vigilante.cerrar()
+
+
+if __name__ == '__main__':
+    main()
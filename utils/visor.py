@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+COLUMNAS_ESTADO = ['Estado', 'Estado Búsqueda']
+
+
+def columna_estado(df):
+    """
+    Devuelve la columna de estado del resultado (None si no tiene)
+    """
+    return next((c for c in COLUMNAS_ESTADO if c in df.columns), None)
+
+
+def metricas_resultado(total, columnas, por_estado=None):
+    """
+    Métricas de resumen de un resultado (mismos criterios que la pestaña Resultados)
+
+    Args:
+        total (int): Cantidad de filas
+        columnas (int): Cantidad de columnas
+        por_estado (dict): Conteo de filas por valor de estado (None si no hay estado)
+    """
+    metricas = {'total': total, 'columnas': columnas}
+    if por_estado is not None:
+        metricas['encontrados'] = sum(
+            n for v, n in por_estado.items() if 'Encontrado' in str(v))
+        metricas['no_encontrados'] = por_estado.get('No Encontrado', 0)
+        metricas['por_estado'] = dict(por_estado)
+    return metricas
+
+
+class VisorResultados:
+    """
+    Visor paginado de un resultado que mantiene los datos en el servidor
+
+    Al construirse (una vez, al terminar el procesamiento) precalcula el orden
+    de cada columna, una máscara por valor de estado y las métricas de resumen.
+    Cada página se resuelve combinando esos arreglos y solo se materializan
+    las filas visibles.
+    """
+
+    def __init__(self, df):
+        """
+        Args:
+            df (pd.DataFrame): Resultado del procesamiento
+        """
+        self.df = df.reset_index(drop=True)
+        self.columna_estado = columna_estado(self.df)
+
+        self._ordenes = {col: self._orden_columna(self.df[col])
+                         for col in self.df.columns}
+
+        self._mascaras = {}
+        if self.columna_estado:
+            codigos, valores = pd.factorize(self.df[self.columna_estado])
+            for i, valor in enumerate(valores):
+                self._mascaras[valor] = codigos == i
+
+        self.metricas = self._calcular_metricas()
+
+    @staticmethod
+    def _orden_columna(serie):
+        """
+        Orden ascendente estable con nulos al final y cantidad de nulos
+        """
+        serie = serie.reset_index(drop=True)
+        try:
+            orden = serie.sort_values(kind='stable', na_position='last').index
+        except TypeError:
+            # Columnas con tipos mezclados se ordenan como texto
+            orden = serie.where(serie.isna(), serie.astype(str))\
+                         .sort_values(kind='stable', na_position='last').index
+        return np.asarray(orden, dtype=np.int64), int(serie.isna().sum())
+
+    def _calcular_metricas(self):
+        """
+        Métricas de resumen del resultado
+        """
+        por_estado = None
+        if self.columna_estado:
+            por_estado = {v: int(m.sum()) for v, m in self._mascaras.items()}
+        return metricas_resultado(len(self.df), len(self.df.columns), por_estado)
+
+    @property
+    def estados(self):
+        """
+        Valores de estado presentes en el resultado
+        """
+        return list(self._mascaras)
+
+    def seleccionar(self, columna_orden=None, ascendente=True, estados=None):
+        """
+        Posiciones de las filas filtradas por estado y ordenadas
+
+        Args:
+            columna_orden (str): Columna por la que ordenar (None = orden original)
+            ascendente (bool): Sentido del orden (los nulos siempre al final)
+            estados (list): Valores de estado a mostrar (None o vacío = todos)
+
+        Returns:
+            np.ndarray: Posiciones de fila en el orden a mostrar
+        """
+        if columna_orden is None:
+            posiciones = np.arange(len(self.df))
+        else:
+            orden, nulos = self._ordenes[columna_orden]
+            if ascendente:
+                posiciones = orden
+            else:
+                corte = len(orden) - nulos
+                posiciones = np.concatenate([orden[:corte][::-1], orden[corte:]])
+
+        if estados:
+            mascara = np.zeros(len(self.df), dtype=bool)
+            for estado in estados:
+                if estado in self._mascaras:
+                    mascara |= self._mascaras[estado]
+            posiciones = posiciones[mascara[posiciones]]
+
+        return posiciones
+
+    def pagina(self, numero, tamano, columna_orden=None, ascendente=True, estados=None):
+        """
+        Materializa una página de resultados
+
+        Args:
+            numero (int): Número de página (desde 1)
+            tamano (int): Filas por página
+
+        Returns:
+            tuple: (DataFrame de la página, total de filas filtradas, total de páginas)
+        """
+        posiciones = self.seleccionar(columna_orden, ascendente, estados)
+        total = len(posiciones)
+        paginas = max(1, -(-total // tamano))
+        numero = min(max(1, numero), paginas)
+        inicio = (numero - 1) * tamano
+        return self.df.iloc[posiciones[inicio:inicio + tamano]], total, paginas
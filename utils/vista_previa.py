@@ -0,0 +1,180 @@
+"""
+Vista previa por muestreo: tasas de coincidencia estimadas antes de procesar
+
+Se toma una muestra estratificada por ATM de la hoja, se procesa contra el
+índice TH con los mismos procesos de la corrida completa y se estima la
+proporción de cada estado (Encontrado, Diferencia, No Encontrado...) con
+intervalos de confianza de Wilson, junto con el tiempo que tomaría la
+corrida completa (lectura de la hoja más procesamiento).
+"""
+import math
+import time
+from collections import namedtuple
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from utils.procesamiento import normalizar_id
+from utils.visor import columna_estado
+
+TAMANO_MUESTRA = 400
+NIVEL_CONFIANZA = 0.95
+REPETICIONES = 2  # mediciones de tiempo por tamaño de muestra
+
+# tabla: Estado, Muestra, Tasa, IC inferior, IC superior, Filas estimadas;
+# segundos_estimados = segundos_lectura + segundos_proceso
+VistaPrevia = namedtuple('VistaPrevia', ['tabla', 'muestra', 'total',
+                                         'segundos_muestra', 'segundos_estimados',
+                                         'segundos_lectura', 'segundos_proceso'])
+
+
+def _z(nivel):
+    """
+    Cuantil normal de dos colas para un nivel de confianza
+    """
+    return NormalDist().inv_cdf(0.5 + nivel / 2)
+
+
+def intervalo_wilson(exitos, n, nivel=NIVEL_CONFIANZA):
+    """
+    Intervalo de Wilson para una proporción
+
+    A diferencia del intervalo normal, no se sale de [0, 1] ni colapsa a un
+    punto cuando la muestra no tiene casos (o solo tiene casos).
+
+    Args:
+        exitos (int): Casos en la muestra
+        n (int): Tamaño de la muestra
+        nivel (float): Nivel de confianza
+
+    Returns:
+        tuple: (inferior, superior)
+    """
+    if n == 0:
+        return 0.0, 1.0
+    z = _z(nivel)
+    p = exitos / n
+    centro = (p + z * z / (2 * n)) / (1 + z * z / n)
+    margen = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, centro - margen), min(1.0, centro + margen)
+
+
+def muestra_estratificada(df, n=TAMANO_MUESTRA, semilla=0, columna='ATM'):
+    """
+    Muestra sistemática sobre las filas ordenadas por ATM
+
+    Ordenar por ATM (y al azar dentro de cada ATM) y tomar una fila cada
+    len(df) / n reparte la muestra entre los ATMs en proporción a sus filas.
+
+    Args:
+        df (pd.DataFrame): Hoja de datos
+        n (int): Tamaño de la muestra
+        semilla (int): Semilla del generador
+        columna (str): Columna de ATM
+
+    Returns:
+        pd.DataFrame: Filas de la muestra, en el orden de la hoja
+    """
+    if len(df) <= n:
+        return df
+    rng = np.random.default_rng(semilla)
+    estrato = normalizar_id(df[columna]).fillna('').to_numpy() \
+        if columna in df else np.zeros(len(df))
+    orden = np.lexsort((rng.random(len(df)), estrato))
+    paso = len(df) / n
+    posiciones = orden[(rng.uniform(0, paso) + paso * np.arange(n)).astype(np.int64)]
+    return df.iloc[np.sort(posiciones)]
+
+
+def muestra_por_bloques(bloques, n=TAMANO_MUESTRA, semilla=0, columna='ATM'):
+    """
+    Muestra estratificada de una hoja leída por bloques
+
+    Se conserva una muestra aleatoria de 4n filas (las de menor clave al
+    azar) y al final se estratifica sobre ella, sin tener la hoja completa
+    en memoria.
+
+    Returns:
+        tuple: (muestra, filas de la hoja)
+    """
+    rng = np.random.default_rng(semilla)
+    reserva, claves, total = None, None, 0
+    for bloque in bloques:
+        total += len(bloque)
+        bloque_claves = rng.random(len(bloque))
+        if reserva is None:
+            reserva, claves = bloque, bloque_claves
+        else:
+            reserva = pd.concat([reserva, bloque])
+            claves = np.concatenate([claves, bloque_claves])
+        if len(reserva) > 4 * n:
+            menores = np.sort(np.argpartition(claves, 4 * n)[:4 * n])
+            reserva, claves = reserva.iloc[menores], claves[menores]
+    if reserva is None:
+        return pd.DataFrame(), 0
+    return muestra_estratificada(reserva, n, semilla, columna), total
+
+
+def _medir(procesar, df, th, parametros):
+    inicio = time.perf_counter()
+    resultado = procesar(df.copy(), th, **parametros)
+    return resultado, time.perf_counter() - inicio
+
+
+def vista_previa(procesar, datos, th, parametros=None, n=TAMANO_MUESTRA, semilla=0,
+                 total=None, segundos_lectura=0.0):
+    """
+    Estima las tasas por estado y el tiempo de la corrida completa
+
+    Se mide el tiempo con la mitad de la muestra y con la muestra completa
+    para separar el costo fijo del proceso del costo por fila al proyectar
+    el tiempo de la hoja completa.
+
+    Args:
+        procesar (callable): Proceso de la hoja (ver pipeline.PROCESOS)
+        datos (pd.DataFrame): Hoja completa o muestra ya tomada
+        th: Índice TH
+        parametros (dict): tol, modo, matriz... del proceso
+        n (int): Tamaño de la muestra
+        semilla (int): Semilla del muestreo
+        total (int): Filas de la hoja (si datos ya es una muestra)
+        segundos_lectura (float): Tiempo que la corrida completa tardará en
+            leer la hoja (0 si la lectura ya está en caché)
+
+    Returns:
+        VistaPrevia
+    """
+    parametros = parametros or {}
+    total = len(datos) if total is None else total
+    muestra = muestra_estratificada(datos, n, semilla)
+
+    # Mejor de dos mediciones por tamaño: la primera paga el calentamiento
+    resultado, t_muestra = _medir(procesar, muestra, th, parametros)
+    t_mitad = min(_medir(procesar, muestra.iloc[::2], th, parametros)[1]
+                  for _ in range(REPETICIONES))
+    t_muestra = min([t_muestra] + [_medir(procesar, muestra, th, parametros)[1]
+                                   for _ in range(REPETICIONES - 1)])
+
+    # t = fijo + por_fila * filas, con los dos tamaños medidos
+    filas_mitad = len(muestra.iloc[::2])
+    por_fila = (t_muestra - t_mitad) / max(len(muestra) - filas_mitad, 1)
+    if por_fila <= 0:
+        por_fila, fijo = t_muestra / max(len(muestra), 1), 0.0
+    else:
+        fijo = max(t_muestra - por_fila * len(muestra), 0.0)
+    proceso = fijo + por_fila * total
+
+    estado = columna_estado(resultado)
+    conteo = resultado[estado].value_counts() if estado else pd.Series(dtype=int)
+    filas = []
+    for valor, casos in conteo.items():
+        inferior, superior = intervalo_wilson(int(casos), len(muestra))
+        tasa = casos / len(muestra)
+        filas.append({'Estado': valor, 'Muestra': int(casos), 'Tasa': tasa,
+                      'IC inferior': inferior, 'IC superior': superior,
+                      'Filas estimadas': int(round(tasa * total))})
+    tabla = pd.DataFrame(filas, columns=['Estado', 'Muestra', 'Tasa', 'IC inferior',
+                                         'IC superior', 'Filas estimadas'])
+    return VistaPrevia(tabla, len(muestra), total, t_muestra,
+                       segundos_lectura + proceso, segundos_lectura, proceso)